@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#Codec microbenchmark of the per cycle CPU path: frames, register decoding and publishing
+#time is given in ns/op, memory with tracemalloc: peak bytes allocated during one op and bytes kept after it
+#results can be saved as a baseline and compared with a later run on the same machine
+#usage: python3 codecBench.py [-f filter] [-s baseline.json] [-c baseline.json]
+
+import os,sys,argparse,json,logging,platform,timeit,tracemalloc
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','src'));
+import DDModbus,DDSchema,DDSimulator,Diematic3Panel,Diematic32MQTT
+from Diematic3Panel import DDREGISTER
+
+#frame with CRC, as received from the bus
+def withCrc(frame):
+	crc=DDModbus.calc_crc(frame);
+	return bytes(frame)+bytes((crc & 0xFF,(crc>>8) & 0xFF));
+
+#MQTT client stub, messages are dropped
+class StubClient:
+	def publish(self,topic,payload=None,qos=0,retain=False):
+		pass;
+
+	def message_callback_add(self,sub,callback):
+		pass;
+
+	def subscribe(self,topic,qos=0):
+		pass;
+
+#regulator panel filled with the simulator register map, without bus connection
+def createPanel():
+	panel=Diematic3Panel.Diematic3Panel('127.0.0.1',0,0x0A,'UTC');
+	panel.updateCallback=lambda attributes=None: None;
+	registers={reg:0 for reg in panel.planner.registers};
+	registers.update({reg.value:value for reg,value in DDSimulator.DEFAULT_REGISTERS.items()});
+	registers.update({DDREGISTER.HEURE.value:12,DDREGISTER.MINUTE.value:30,DDREGISTER.JOUR_SEMAINE.value:3,
+		DDREGISTER.JOUR.value:15,DDREGISTER.MOIS.value:1,DDREGISTER.ANNEE.value:25});
+	panel.storeRegisters(registers,0);
+	panel.refreshAttributes();
+	return panel;
+
+#benchmarked operations, name and function without argument
+def benchmarks():
+	bus=DDModbus.DDModbus.__new__(DDModbus.DDModbus);
+	bus.logger=logging.getLogger('DDModbus');
+	readRequest=bytes(bus.readRequest(0x0A,427,37)[:-1]);
+	regs=list(range(64));
+	answer=withCrc(bytes((0x0A,0x03,2*len(regs)))+b''.join(reg.to_bytes(2,'big') for reg in regs));
+	boilerFrame=withCrc(bytes((0x20,0x10,0,14,0,5,10))+b''.join(reg.to_bytes(2,'big') for reg in (200,180,60,8,205)));
+	framer=DDModbus.RTUFramer();
+	def frameAnswer():
+		framer.feed(answer,0);
+		return framer.frame(0);
+
+	panel=createPanel();
+	temp=[600];
+	def refreshTemp():
+		#one changed burner register, as in most boiler cycles
+		temp[0]^=1;
+		panel.storeRegisters({DDREGISTER.TEMP_CHAUD.value:temp[0]},0);
+		panel.refreshAttributes(panel.changedRegisters);
+		panel.changedRegisters=set();
+
+	client=StubClient();
+	gateway=Diematic32MQTT.Gateway('bench',panel,client,'bench/boiler','bench',True,False,dict(),'homeassistant');
+	jsonGateway=Diematic32MQTT.Gateway('bench',panel,client,'bench/boiler','bench',False,True,dict(),'homeassistant');
+	#gateways bind the panel callback to their publish, decoding is measured without publishing
+	panel.updateCallback=lambda attributes=None: None;
+	gateway.publish();
+	jsonGateway.publish();
+	buffer=Diematic32MQTT.MessageBuffer(client,'bench/boiler');
+	topics=['topic'+str(i) for i in range(36)];
+	values=[0];
+	def bufferCycle():
+		#36 topics updated and published
+		values[0]^=1;
+		for topic in topics:
+			buffer.update(topic,str(values[0]));
+		buffer.send();
+	def publishTemp():
+		refreshTemp();
+		gateway.publish({'temp'});
+
+	return [('calc_crc 8 bytes',lambda: DDModbus.calc_crc(readRequest[:6])),
+		('calc_crc 131 bytes',lambda: DDModbus.calc_crc(answer[:-2])),
+		('readRequest',lambda: bus.readRequest(0x0A,427,37)),
+		('writeRequest 3 registers',lambda: bus.writeRequest(0x0A,4,[12,30,3])),
+		('readAnswer 64 registers',lambda: bus.readAnswer(answer,0x0A,0,64)),
+		('RTUFramer 64 registers answer',frameAnswer),
+		('slaveRequest read',lambda: DDModbus.slaveRequest(readRequest)),
+		('slaveRequest write 5 registers',lambda: DDModbus.slaveRequest(boilerFrame)),
+		('float10',lambda: DDSchema.float10(205)),
+		('refreshAttributes all',lambda: panel.refreshAttributes()),
+		('refreshAttributes 1 register',refreshTemp),
+		('Gateway.publish all topics',lambda: gateway.publish()),
+		('Gateway.publish all json',lambda: jsonGateway.publish()),
+		('Gateway.publish 1 changed topic',publishTemp),
+		('MessageBuffer 36 updates+send',bufferCycle)];
+
+#time in ns/op, best of several runs
+def measureTime(function,repeat=5):
+	timer=timeit.Timer(function);
+	number,duration=timer.autorange();
+	return min([duration]+timer.repeat(repeat-1,number))/number*1e9;
+
+#peak bytes allocated during one op and bytes kept after it, averaged over several ops
+def measureMemory(function,number=20):
+	function();
+	tracemalloc.start();
+	peak=0;
+	start=tracemalloc.get_traced_memory()[0];
+	for i in range(number):
+		current=tracemalloc.get_traced_memory()[0];
+		tracemalloc.reset_peak();
+		function();
+		peak+=tracemalloc.get_traced_memory()[1]-current;
+	kept=tracemalloc.get_traced_memory()[0]-start;
+	tracemalloc.stop();
+	return peak/number,kept/number;
+
+if __name__ == '__main__':
+	parser=argparse.ArgumentParser(description='Codec microbenchmark');
+	parser.add_argument('-f','--filter',help='only benchmarks whose name contains this text');
+	parser.add_argument('-s','--save',help='save results as a baseline JSON file');
+	parser.add_argument('-c','--compare',help='compare results with a baseline JSON file');
+	args=parser.parse_args();
+	logging.basicConfig(level=logging.CRITICAL+1);
+
+	baseline=dict();
+	if args.compare:
+		with open(args.compare) as file:
+			baseline=json.load(file)['results'];
+
+	results=dict();
+	print(f"{'benchmark':34s} {'ns/op':>10s} {'peak B/op':>10s} {'kept B/op':>10s}"+(f" {'baseline':>10s} {'delta':>7s}" if baseline else ''));
+	for name,function in benchmarks():
+		if args.filter and (args.filter not in name):
+			continue;
+		duration=measureTime(function);
+		peak,kept=measureMemory(function);
+		results[name]={'ns':duration,'peak':peak,'kept':kept};
+		line=f"{name:34s} {duration:10.0f} {peak:10.0f} {kept:10.1f}";
+		if name in baseline:
+			line+=f" {baseline[name]['ns']:10.0f} {100*(duration/baseline[name]['ns']-1):+6.1f}%";
+		print(line);
+
+	if args.save:
+		with open(args.save,'w') as file:
+			json.dump({'python':platform.python_version(),'machine':platform.machine(),'results':results},file,indent=1);
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#CRC microbenchmark: compare the former bit by bit calc_crc with the table driven one
+#usage: python3 crcBench.py [number of iterations]
+
+import os,sys,timeit,random
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','src'));
+import DDModbus
+
+#former bit by bit CRC calculation, kept as reference
+def calc_crc_bitwise(data):
+	crc = 0xFFFF
+	for pos in data:
+		crc ^= pos
+		for i in range(8):
+			if ((crc & 1) != 0):
+				crc >>= 1
+				crc ^= 0xA001
+			else:
+				crc >>= 1
+	return crc
+
+#incremental calculation, frame received in 2 TCP segments
+def calc_crc_incremental(data):
+	crc=DDModbus.CRC16();
+	half=len(data)//2;
+	crc.update(data[:half]);
+	return crc.update(data[half:]);
+
+#realistic frame sizes seen on the link (size without CRC)
+FRAMES={'read request (6 bytes)':6,
+	'write ack (6 bytes)':6,
+	'write 1 register (9 bytes)':9,
+	'write 3 registers (13 bytes)':13,
+	'answer 23 registers (49 bytes)':49,
+	'answer 63 registers (129 bytes)':129,
+	'answer 64 registers (131 bytes)':131};
+
+if __name__ == '__main__':
+	number=int(sys.argv[1]) if len(sys.argv)>1 else 20000;
+	random.seed(0);
+	print(f"{'frame':34s} {'bitwise':>10s} {'table':>10s} {'increm.':>10s} {'gain':>6s}");
+	for name,size in FRAMES.items():
+		data=bytes(random.randrange(256) for i in range(size));
+		#check results are identical
+		assert calc_crc_bitwise(data)==DDModbus.calc_crc(data)==calc_crc_incremental(data);
+		results=list();
+		for function in (calc_crc_bitwise,DDModbus.calc_crc,calc_crc_incremental):
+			results.append(min(timeit.repeat(lambda: function(data),number=number,repeat=3))/number*1e6);
+		print(f"{name:34s} {results[0]:8.2f}us {results[1]:8.2f}us {results[2]:8.2f}us {results[0]/results[1]:5.1f}x");
@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#End to end command latency benchmark: MQTT set message -> gateway -> regulator write -> read back -> state message
+#the gateway runs against the boiler simulator, with an in-process MQTT loopback or a local broker
+#commands are sent at a random position of the boiler cycle and latency is measured until the confirmed state is published
+#usage: python3 latencyBench.py [-n commands per mix] [-m mix,...] [-e thread|asyncio] [-b broker[:port]] [-o results.json]
+
+import os,sys,argparse,datetime,json,logging,math,random,threading,time
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','src'));
+import paho.mqtt.client as mqtt
+import DDSimulator,Diematic3Panel,Diematic32MQTT
+
+TOPIC_PREFIX='bench/boiler';
+#maximum time waited for the confirmed state
+COMMAND_TIMEOUT=60;
+
+#MQTT client of the broker mode, paho-mqtt 2 needs the callback API version, callbacks use the version 1 signatures
+def brokerClient():
+	if hasattr(mqtt,'CallbackAPIVersion'):
+		return mqtt.Client(mqtt.CallbackAPIVersion.VERSION1);
+	return mqtt.Client();
+
+#message given to gateway callbacks by the loopback client
+class LoopbackMessage:
+	def __init__(self,topic,payload):
+		self.topic=topic;
+		self.payload=payload if isinstance(payload,bytes) else str(payload).encode();
+
+#in-process replacement of the MQTT client and broker: set messages are delivered to gateway callbacks
+#and messages published by the gateway are given to the listener
+class LoopbackClient:
+	def __init__(self,listener):
+		self.listener=listener;
+		self.callbacks=list();
+
+	def message_callback_add(self,sub,callback):
+		self.callbacks.append((sub,callback));
+
+	def subscribe(self,topic,qos=0):
+		pass;
+
+	def publish(self,topic,payload=None,qos=0,retain=False):
+		message=LoopbackMessage(topic,payload);
+		for sub,callback in self.callbacks:
+			if mqtt.topic_matches_sub(sub,topic):
+				callback(self,None,message);
+		self.listener(topic,message.payload.decode());
+
+#record of state messages published by the gateway
+class StateRecorder:
+	def __init__(self):
+		self.condition=threading.Condition();
+		self.messages=list();
+
+	def __call__(self,topic,payload):
+		with self.condition:
+			self.messages.append((time.time(),topic,payload));
+			self.condition.notify_all();
+
+	#wait for a message on topic published after since and satisfying check, return its time or None on timeout
+	def wait(self,topic,check,since,timeout=COMMAND_TIMEOUT):
+		deadline=time.time()+timeout;
+		index=0;
+		with self.condition:
+			while True:
+				while index < len(self.messages):
+					messageTime,messageTopic,payload=self.messages[index];
+					index+=1;
+					if (messageTime >= since) and (messageTopic==topic) and check(payload):
+						return messageTime;
+				remaining=deadline-time.time();
+				if (remaining <= 0):
+					return None;
+				self.condition.wait(remaining);
+
+#command mixes, each command gives the set messages, the state topic and the check of the confirmed value
+class CommandMix:
+	def __init__(self,bench):
+		self.bench=bench;
+
+	#prepare the regulator before a command, not measured
+	def prepare(self,index):
+		pass;
+
+#single setpoint change
+class SetpointMix(CommandMix):
+	name='setpoint';
+	def command(self,index):
+		value=20.0+0.5*(index % 4);
+		if (value==self.bench.panel.zoneADayTargetTemp):
+			value+=2.5;
+		return [('zoneA/dayTemp/set',str(value))],'zoneA/dayTemp',lambda payload: payload==Diematic32MQTT.floatValue(value);
+
+#slider moved by the user: several setpoints within one second, the last one must be confirmed
+class SliderMix(CommandMix):
+	name='slider';
+	STEPS=5;
+	def command(self,index):
+		start=18.0+(index % 2)*3;
+		values=[start+0.5*step for step in range(self.STEPS)];
+		return [('zoneA/nightTemp/set',str(value)) for value in values],'zoneA/nightTemp',lambda payload: payload==Diematic32MQTT.floatValue(values[-1]);
+
+#zone A mode change, done with the multi-step write procedure
+class ModeMix(CommandMix):
+	name='mode';
+	def command(self,index):
+		mode='PERM JOUR' if (self.bench.panel.zoneAMode!='PERM JOUR') else 'AUTO';
+		return [('zoneA/mode/set',mode)],'zoneA/mode',lambda payload: payload==mode;
+
+#boiler clock synchronisation, the boiler clock is set one hour late first
+class DateMix(CommandMix):
+	name='date';
+	LATE=3600;
+	def prepare(self,index):
+		self.bench.simulator.clockOffset=-self.LATE;
+		self.bench.simulator.updateClock();
+		self.bench.panel.refreshRequest=True;
+		self.bench.recorder.wait('date',lambda payload: self.skew(payload) > self.LATE/2,time.time());
+
+	def command(self,index):
+		return [('date/set','Now')],'date',lambda payload: self.skew(payload) < 120;
+
+	def skew(self,payload):
+		if (payload==''):
+			return 0;
+		return abs(datetime.datetime.now().astimezone().timestamp()-datetime.datetime.fromisoformat(payload).timestamp());
+
+MIXES={mix.name:mix for mix in (SetpointMix,SliderMix,ModeMix,DateMix)};
+
+#nearest rank percentile
+def percentile(values,ratio):
+	values=sorted(values);
+	return values[min(max(math.ceil(ratio*len(values))-1,0),len(values)-1)];
+
+class LatencyBench:
+	#time between two set messages of a command
+	MESSAGE_GAP=0.2;
+
+	def __init__(self,asyncEngine=False,broker=None,seed=0):
+		self.random=random.Random(seed);
+		self.recorder=StateRecorder();
+		self.simulator=DDSimulator.DiematicSimulator(seed=seed);
+		port=self.simulator.start();
+		self.panel=Diematic3Panel.Diematic3Panel('127.0.0.1',port,0x0A,'',False,False,asyncEngine);
+		self.panel.refreshPeriod=60;
+		#gateway MQTT client, and bench client used to send commands and receive states with a broker
+		if broker is None:
+			self.client=LoopbackClient(self.recordState);
+			self.commandClient=self.client;
+		else:
+			host,port=(broker.split(':')+['1883'])[0:2];
+			self.client=brokerClient();
+			self.commandClient=brokerClient();
+			self.commandClient.on_message=lambda client,userdata,message: self.recordState(message.topic,message.payload.decode());
+			for client in (self.client,self.commandClient):
+				client.connect(host,int(port));
+				client.loop_start();
+			self.commandClient.subscribe(TOPIC_PREFIX+'/#',1);
+		self.gateway=Diematic32MQTT.Gateway('bench',self.panel,self.client,TOPIC_PREFIX,'bench',True,False,dict(),'homeassistant');
+		if broker is not None:
+			self.gateway.connected();
+		self.panel.loop_start();
+
+	def recordState(self,topic,payload):
+		if topic.startswith(TOPIC_PREFIX+'/') and not topic.endswith('/set'):
+			self.recorder(topic[len(TOPIC_PREFIX)+1:],payload);
+
+	def stop(self):
+		self.panel.loop_stop();
+		self.simulator.stop();
+		if (self.client is not self.commandClient):
+			for client in (self.client,self.commandClient):
+				client.loop_stop();
+				client.disconnect();
+
+	#wait for the first complete refresh, then measure the bus transactions done without command
+	def warmup(self,idleTime):
+		if self.recorder.wait('status',lambda payload: payload=='Online',0) is None:
+			raise TimeoutError('Regulator not available');
+		start=time.time();
+		transactions=self.transactions();
+		time.sleep(idleTime);
+		return (self.transactions()-transactions)/(time.time()-start);
+
+	def transactions(self):
+		return self.simulator.stats['reads']+self.simulator.stats['writes'];
+
+	#run a command and return its latency, bus transactions and writes
+	def run(self,mix,index):
+		mix.prepare(index);
+		#random position in the boiler cycle
+		time.sleep(self.random.uniform(0,DDSimulator.DiematicSimulator.MASTER_DURATION+DDSimulator.DiematicSimulator.SLAVE_DURATION));
+		messages,topic,check=mix.command(index);
+		transactions,writes=self.transactions(),self.simulator.stats['writes'];
+		for i,(setTopic,payload) in enumerate(messages):
+			if (i!=0):
+				time.sleep(self.MESSAGE_GAP);
+			start=time.time();
+			self.commandClient.publish(TOPIC_PREFIX+'/'+setTopic,payload,1);
+		confirmTime=self.recorder.wait(topic,check,start);
+		result={'latency':(confirmTime-start) if (confirmTime is not None) else None,
+			'transactions':self.transactions()-transactions,
+			'writes':self.simulator.stats['writes']-writes};
+		#transactions still running for the command are not counted with the next one
+		time.sleep(0.5);
+		return result;
+
+if __name__ == '__main__':
+	parser=argparse.ArgumentParser(description='End to end command latency benchmark');
+	parser.add_argument('-n','--number',type=int,default=10,help='commands per mix');
+	parser.add_argument('-m','--mix',default=','.join(MIXES),help='command mixes: '+', '.join(MIXES));
+	parser.add_argument('-e','--engine',choices=('thread','asyncio'),default='thread');
+	parser.add_argument('-b','--broker',help='local MQTT broker host[:port], an in-process loopback is used by default');
+	parser.add_argument('-o','--output',help='JSON file of the results of each command');
+	parser.add_argument('-v','--verbose',action='store_true');
+	args=parser.parse_args();
+	logging.basicConfig(level=logging.INFO if args.verbose else logging.CRITICAL+1);
+
+	bench=LatencyBench(args.engine=='asyncio',args.broker);
+	results=dict();
+	try:
+		idleRate=bench.warmup(DDSimulator.DiematicSimulator.MASTER_DURATION+DDSimulator.DiematicSimulator.SLAVE_DURATION);
+		print(f"engine: {args.engine}, idle polling: {idleRate:.2f} transactions/s");
+		print(f"{'mix':10s} {'n':>3s} {'p50':>7s} {'p95':>7s} {'p99':>7s} {'max':>7s} {'tx/cmd':>7s} {'wr/cmd':>7s} {'timeout':>7s}");
+		for name in args.mix.split(','):
+			mix=MIXES[name](bench);
+			results[name]=[bench.run(mix,index) for index in range(args.number)];
+			latencies=[result['latency'] for result in results[name] if result['latency'] is not None];
+			transactions=sum(result['transactions'] for result in results[name])/len(results[name]);
+			writes=sum(result['writes'] for result in results[name])/len(results[name]);
+			timeouts=len(results[name])-len(latencies);
+			if (len(latencies)==0):
+				print(f"{name:10s} {len(results[name]):3d} {'-':>7s} {'-':>7s} {'-':>7s} {'-':>7s} {transactions:7.1f} {writes:7.1f} {timeouts:7d}");
+				continue;
+			print(f"{name:10s} {len(results[name]):3d} {percentile(latencies,0.5):6.2f}s {percentile(latencies,0.95):6.2f}s {percentile(latencies,0.99):6.2f}s {max(latencies):6.2f}s {transactions:7.1f} {writes:7.1f} {timeouts:7d}");
+	finally:
+		bench.stop();
+	if args.output:
+		with open(args.output,'w') as file:
+			json.dump({'engine':args.engine,'idleRate':idleRate,'results':results},file,indent=1);
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import logging
+import socket
+import time
+from enum import IntEnum
+
+#TCP keepalive, a dead converter is detected even without any exchange
+KEEPALIVE_IDLE=10;
+KEEPALIVE_INTERVAL=5;
+KEEPALIVE_COUNT=3;
+
+#enable TCP keepalive on a socket, with the platform options which are available
+def setKeepalive(sock):
+	sock.setsockopt(socket.SOL_SOCKET,socket.SO_KEEPALIVE,1);
+	for option,value in (('TCP_KEEPIDLE',KEEPALIVE_IDLE),('TCP_KEEPINTVL',KEEPALIVE_INTERVAL),('TCP_KEEPCNT',KEEPALIVE_COUNT)):
+		if hasattr(socket,option):
+			sock.setsockopt(socket.IPPROTO_TCP,getattr(socket,option),value);
+
+#definition of recovery actions, from the lightest to the heaviest
+class RecoveryTier(IntEnum):
+	NONE=0;
+	#flush of received bytes
+	CLEAN=1;
+	#bus state machine reset, waiting for boiler frames again
+	RESYNC=2;
+	#new converter connection
+	RECONNECT=3;
+
+#class used to choose the recovery action of the bus connection according error counters
+#connection attempts are spaced by an exponential backoff, reset once an exchange succeeds
+class ConnectionManager:
+	#consecutive window errors triggering each recovery tier
+	CLEAN_ERRORS=1;
+	RESYNC_ERRORS=2;
+	RECONNECT_ERRORS=3;
+	#bus silence triggering a reconnection, in seconds or in boiler cycles when the cycle is known
+	SILENCE_TIMEOUT=15;
+	SILENCE_CYCLES=1.5;
+	#delay between connection attempts
+	BACKOFF_MIN=1;
+	BACKOFF_MAX=60;
+
+	def __init__(self):
+		#logger
+		self.logger = logging.getLogger(__name__);
+		#consecutive window errors, and errors already handled by a recovery action
+		self.errors=0;
+		self.handledErrors=0;
+		#connection attempts
+		self.backoff=self.BACKOFF_MIN;
+		self.nextConnectTime=0;
+		#statistics
+		self.connects=0;
+		self.connectFailures=0;
+		self.recoveries={tier:0 for tier in RecoveryTier if tier!=RecoveryTier.NONE};
+
+	#successful exchange with the regulator
+	def success(self):
+		self.errors=0;
+		self.handledErrors=0;
+		self.backoff=self.BACKOFF_MIN;
+
+	#failed exchange with the regulator
+	def error(self):
+		self.errors+=1;
+
+	#connection attempt, next one is delayed even if this one succeeds as long as no exchange succeeds
+	def attempt(self,now=None):
+		if now is None:
+			now=time.time();
+		self.nextConnectTime=now+self.backoff;
+		self.backoff=min(2*self.backoff,self.BACKOFF_MAX);
+
+	def connected(self):
+		self.connects+=1;
+		self.errors=0;
+		self.handledErrors=0;
+
+	def connectFailed(self):
+		self.connectFailures+=1;
+
+	#time to wait before next connection attempt
+	def connectDelay(self,now=None):
+		if now is None:
+			now=time.time();
+		return max(self.nextConnectTime-now,0);
+
+	#bus silence after which the connection is considered dead, depending on the boiler cycle period if known
+	def silenceTimeout(self,period=None):
+		if period is None:
+			return self.SILENCE_TIMEOUT;
+		return max(self.SILENCE_TIMEOUT,self.SILENCE_CYCLES*period);
+
+	#recovery action to do, each error count is handled once
+	def tier(self,connected,silence,period=None):
+		tier=RecoveryTier.NONE;
+		if (not connected) or (silence > self.silenceTimeout(period)):
+			tier=RecoveryTier.RECONNECT;
+		elif (self.errors > self.handledErrors):
+			self.handledErrors=self.errors;
+			if (self.errors >= self.RECONNECT_ERRORS):
+				tier=RecoveryTier.RECONNECT;
+			elif (self.errors >= self.RESYNC_ERRORS):
+				tier=RecoveryTier.RESYNC;
+			elif (self.errors >= self.CLEAN_ERRORS):
+				tier=RecoveryTier.CLEAN;
+		if (tier!=RecoveryTier.NONE):
+			self.recoveries[tier]+=1;
+		return tier;
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import logging
+import math
+import mmap
+import os
+import struct
+import threading
+
+#class used to keep the samples of regulator values in a fixed size memory mapped ring file
+#a record is the sample time in seconds followed by a float32 per channel, NaN when the value is unknown
+#file size doesn't change once created, old samples are overwritten by new ones
+class HistoryStore:
+	MAGIC=b'DDHS';
+	VERSION=1;
+	#magic, version, channel number, capacity, next record index, record number
+	HEADER=struct.Struct('<4sHHIII');
+	#records begin on the second page, channel names are saved after the header in the first one
+	HEADER_SIZE=4096;
+
+	def __init__(self,path,channels,duration=86400,period=10):
+		#logger
+		self.logger = logging.getLogger(__name__);
+		self.path=path;
+		self.channels=list(channels);
+		#minimum time between two samples
+		self.period=period;
+		self.capacity=max(int(duration/period),1);
+		self.record=struct.Struct('<I'+'f'*len(self.channels));
+		self.lock=threading.Lock();
+		self.lastTime=0;
+
+		names='\n'.join(self.channels).encode();
+		if (self.HEADER.size+len(names) > self.HEADER_SIZE):
+			raise ValueError('Too many history channels');
+		size=self.HEADER_SIZE+self.capacity*self.record.size;
+
+		#file of another version, channel list or capacity is created again
+		fd=os.open(path,os.O_RDWR | os.O_CREAT,0o644);
+		try:
+			if (os.fstat(fd).st_size!=size) or not self.sameLayout(fd,names):
+				self.logger.warning('History file created: '+path+', '+str(size)+' bytes');
+				os.ftruncate(fd,0);
+				os.ftruncate(fd,size);
+				os.pwrite(fd,self.HEADER.pack(self.MAGIC,self.VERSION,len(self.channels),self.capacity,0,0)+names,0);
+			self.map=mmap.mmap(fd,size);
+		finally:
+			os.close(fd);
+		magic,version,channelNb,capacity,self.next,self.count=self.HEADER.unpack_from(self.map,0);
+		if (self.count!=0):
+			self.lastTime=self.record.unpack_from(self.map,self.offset(self.next-1))[0];
+		self.logger.info('History: '+str(self.count)+' samples of '+str(len(self.channels))+' channels in '+path);
+
+	def sameLayout(self,fd,names):
+		header=os.pread(fd,self.HEADER.size+len(names),0);
+		if (len(header)!=self.HEADER.size+len(names)):
+			return False;
+		magic,version,channelNb,capacity,next,count=self.HEADER.unpack_from(header,0);
+		return (magic,version,channelNb,capacity)==(self.MAGIC,self.VERSION,len(self.channels),self.capacity) and (header[self.HEADER.size:]==names);
+
+	def offset(self,index):
+		return self.HEADER_SIZE+(index % self.capacity)*self.record.size;
+
+	#True if a new sample can be saved
+	def due(self,timestamp):
+		return (timestamp-self.lastTime >= self.period);
+
+	#save a sample, values being given in channel order, None for unknown ones
+	def append(self,timestamp,values):
+		values=[(float(value) if value is not None else math.nan) for value in values];
+		with self.lock:
+			self.record.pack_into(self.map,self.offset(self.next),int(timestamp),*values);
+			self.next=(self.next+1) % self.capacity;
+			self.count=min(self.count+1,self.capacity);
+			#record is written before the header, a sample is never half visible after a crash
+			self.HEADER.pack_into(self.map,0,self.MAGIC,self.VERSION,len(self.channels),self.capacity,self.next,self.count);
+			self.lastTime=timestamp;
+
+	#samples between start and end times, oldest first, as a list of (time,values)
+	def samples(self,start,end):
+		with self.lock:
+			first=self.next-self.count;
+			if (first >= 0):
+				data=self.map[self.offset(first):self.offset(first)+self.count*self.record.size];
+			else:
+				#ring wrapped: end of the file then its beginning
+				data=self.map[self.offset(first):]+self.map[self.HEADER_SIZE:self.offset(self.next)];
+		return [(sample[0],sample[1:]) for sample in self.record.iter_unpack(data) if (start <= sample[0] <= end)];
+
+	#values of the requested channels between start and end times
+	#with a step, samples are averaged in buckets of step seconds, each one given by its start time
+	def query(self,start,end,step=None,channels=None):
+		indexes=[self.channels.index(channel) for channel in (channels if channels is not None else self.channels)];
+		times=list();
+		columns=[list() for index in indexes];
+		if not step:
+			for timestamp,values in self.samples(start,end):
+				times.append(timestamp);
+				for column,index in zip(columns,indexes):
+					column.append(values[index]);
+		else:
+			bucketTime=None;
+			for timestamp,values in self.samples(start,end)+[(None,None)]:
+				sampleBucket=(int(timestamp//step)*step) if (timestamp is not None) else None;
+				if (sampleBucket!=bucketTime):
+					#average of the bucket which is complete, unknown values are skipped
+					if (bucketTime is not None):
+						times.append(bucketTime);
+						for column,sums in zip(columns,bucket):
+							column.append(sums[0]/sums[1] if (sums[1]!=0) else math.nan);
+					bucketTime=sampleBucket;
+					bucket=[[0.0,0] for index in indexes];
+				if (timestamp is not None):
+					for sums,index in zip(bucket,indexes):
+						if not math.isnan(values[index]):
+							sums[0]+=values[index];
+							sums[1]+=1;
+		return times,{self.channels[index]:column for index,column in zip(indexes,columns)};
+
+	def close(self):
+		with self.lock:
+			self.map.flush();
+			self.map.close();
@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import logging
+import math
+import threading
+import time
+from http.server import BaseHTTPRequestHandler,HTTPServer
+
+CONTENT_TYPE='application/openmetrics-text; version=1.0.0; charset=utf-8';
+
+#label value escaping of the exposition format
+def escape(value):
+	return str(value).replace('\\','\\\\').replace('"','\\"').replace('\n','\\n');
+
+def formatLabels(names,values,extra=None):
+	labels=['%s="%s"' % (name,escape(value)) for name,value in zip(names,values)];
+	if extra is not None:
+		labels.append('%s="%s"' % extra);
+	return ('{'+','.join(labels)+'}') if (len(labels)!=0) else '';
+
+def formatValue(value):
+	if math.isinf(value):
+		return '+Inf' if (value > 0) else '-Inf';
+	return repr(float(value)) if isinstance(value,float) else str(value);
+
+#metric family with its samples by label values
+class Metric:
+	TYPE='unknown';
+
+	def __init__(self,name,help,labelNames,lock):
+		self.name=name;
+		self.help=help;
+		self.labelNames=tuple(labelNames);
+		self.lock=lock;
+		self.values=dict();
+
+	def samples(self):
+		with self.lock:
+			return list(self.values.items());
+
+	def render(self):
+		lines=['# TYPE '+self.name+' '+self.TYPE,'# HELP '+self.name+' '+self.help];
+		for labels,value in self.samples():
+			lines.append(self.name+formatLabels(self.labelNames,labels)+' '+formatValue(value));
+		return lines;
+
+class Counter(Metric):
+	TYPE='counter';
+
+	def inc(self,labels=(),value=1):
+		with self.lock:
+			self.values[labels]=self.values.get(labels,0)+value;
+
+	def render(self):
+		lines=['# TYPE '+self.name+' '+self.TYPE,'# HELP '+self.name+' '+self.help];
+		for labels,value in self.samples():
+			lines.append(self.name+'_total'+formatLabels(self.labelNames,labels)+' '+formatValue(value));
+		return lines;
+
+#gauge set by the instrumented code, or computed by functions when the metrics are collected
+class Gauge(Metric):
+	TYPE='gauge';
+
+	def __init__(self,name,help,labelNames,lock):
+		Metric.__init__(self,name,help,labelNames,lock);
+		self.functions=dict();
+
+	def set(self,labels,value):
+		with self.lock:
+			self.values[labels]=value;
+
+	#function giving the value, None if there's no value
+	def function(self,labels,function):
+		with self.lock:
+			self.functions[labels]=function;
+
+	def samples(self):
+		samples=Metric.samples(self);
+		with self.lock:
+			functions=list(self.functions.items());
+		for labels,function in functions:
+			value=function();
+			if value is not None:
+				samples.append((labels,value));
+		return samples;
+
+class Histogram(Metric):
+	TYPE='histogram';
+
+	def __init__(self,name,help,labelNames,lock,buckets):
+		Metric.__init__(self,name,help,labelNames,lock);
+		self.buckets=tuple(sorted(buckets))+(math.inf,);
+
+	#value of each label set is [bucket counts, sum]
+	def observe(self,labels,value):
+		with self.lock:
+			counts=self.values.get(labels);
+			if counts is None:
+				counts=self.values[labels]=[[0]*len(self.buckets),0.0];
+			for i,bound in enumerate(self.buckets):
+				if (value <= bound):
+					counts[0][i]+=1;
+					break;
+			counts[1]+=value;
+
+	def samples(self):
+		with self.lock:
+			return [(labels,(list(counts),total)) for labels,(counts,total) in self.values.items()];
+
+	def render(self):
+		lines=['# TYPE '+self.name+' '+self.TYPE,'# HELP '+self.name+' '+self.help];
+		for labels,(counts,total) in self.samples():
+			count=0;
+			for bound,bucketCount in zip(self.buckets,counts):
+				count+=bucketCount;
+				lines.append(self.name+'_bucket'+formatLabels(self.labelNames,labels,('le',formatValue(bound)))+' '+str(count));
+			lines.append(self.name+'_count'+formatLabels(self.labelNames,labels)+' '+str(count));
+			lines.append(self.name+'_sum'+formatLabels(self.labelNames,labels)+' '+formatValue(total));
+		return lines;
+
+#class used to hold the metric families of the process and to render them in OpenMetrics text format
+class Registry:
+	def __init__(self):
+		self.lock=threading.Lock();
+		self.metrics=dict();
+
+	def register(self,metricClass,name,*args,**kwargs):
+		with self.lock:
+			metric=self.metrics.get(name);
+		if metric is None:
+			metric=metricClass(name,*args,lock=threading.Lock(),**kwargs);
+			with self.lock:
+				metric=self.metrics.setdefault(name,metric);
+		return metric;
+
+	def counter(self,name,help,labelNames=()):
+		return self.register(Counter,name,help,labelNames);
+
+	def gauge(self,name,help,labelNames=()):
+		return self.register(Gauge,name,help,labelNames);
+
+	def histogram(self,name,help,labelNames=(),buckets=(0.1,1,10)):
+		return self.register(Histogram,name,help,labelNames,buckets=buckets);
+
+	def render(self):
+		with self.lock:
+			metrics=list(self.metrics.values());
+		lines=list();
+		for metric in metrics:
+			lines.extend(metric.render());
+		lines.append('# EOF');
+		return '\n'.join(lines)+'\n';
+
+#instrumentation of a regulator panel and of the bus it owns
+#regulator label is the gateway name, bus transactions are labelled with the modbus address of the regulator
+class PanelMetrics:
+	def __init__(self,registry,name,panel):
+		self.name=name;
+		self.transactions=registry.counter('diematic_transactions','Modbus transactions by function and outcome',('regulator','address','function','outcome'));
+		self.transactionTime=registry.histogram('diematic_transaction_seconds','Round trip time of successful modbus transactions',('regulator','function'),
+			(0.05,0.1,0.15,0.2,0.3,0.5,1,2.5));
+		self.synchroLosses=registry.counter('diematic_synchro_losses','Master windows with a failed exchange',('regulator',));
+		self.synchroTimeouts=registry.counter('diematic_synchro_timeouts','Regulator values reset after a too long time without refresh',('regulator',));
+		self.reconnects=registry.counter('diematic_reconnects','Converter reconnections',('regulator',));
+		self.recoveries=registry.counter('diematic_recoveries','Bus recovery actions by tier',('regulator','tier'));
+		self.utilization=registry.histogram('diematic_window_utilization','Master window utilization ratio',('regulator',),
+			(0.1,0.2,0.3,0.4,0.5,0.6,0.7,0.8,0.9,1));
+		self.queueWait=registry.histogram('diematic_queue_wait_seconds','Time from a write request to its execution on the bus',('regulator',),
+			(0.5,1,2,5,10,15,20,30,60));
+		self.refreshTime=registry.histogram('diematic_refresh_duration_seconds','Duration of the exchanges of a master window',('regulator',),
+			(0.1,0.25,0.5,1,2,3,4,5));
+		#gauges computed when collected, no cost in the modbus loop
+		pending=registry.gauge('diematic_queue_jobs','Jobs waiting for a master window by priority',('regulator','priority'));
+		for priority in ('WRITE','READBACK','POLL','SCAN'):
+			pending.function((name,priority),lambda priority=priority: panel.pendingJobs(priority));
+		registry.gauge('diematic_pending_writes','Register writes and mode changes requested and not yet queued',('regulator',)).function((name,),panel.pendingWrites);
+		registry.gauge('diematic_refresh_age_seconds','Time since the last successful refresh',('regulator',)).function((name,),
+			lambda: (time.time()-panel.lastRefreshTime) if (panel.lastRefreshTime is not None) else None);
+		registry.gauge('diematic_available','Regulator values available',('regulator',)).function((name,),lambda: int(bool(panel.availability)));
+		registry.gauge('diematic_cycle_period_seconds','Learned boiler cycle period',('regulator',)).function((name,),lambda: panel.cyclePeriod);
+
+	def transaction(self,modbusAddress,function,outcome,duration):
+		self.transactions.inc((self.name,'0x%02X' % modbusAddress,function,outcome));
+		if (outcome=='ok'):
+			self.transactionTime.observe((self.name,function),duration);
+
+	def synchroLoss(self):
+		self.synchroLosses.inc((self.name,));
+
+	def synchroTimeout(self):
+		self.synchroTimeouts.inc((self.name,));
+
+	def reconnect(self):
+		self.reconnects.inc((self.name,));
+
+	def recovery(self,tier):
+		self.recoveries.inc((self.name,tier.name));
+
+	def window(self,utilization,duration):
+		self.utilization.observe((self.name,),utilization);
+		self.refreshTime.observe((self.name,),duration);
+
+	def jobWait(self,waitTime):
+		self.queueWait.observe((self.name,),waitTime);
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+	def do_GET(self):
+		if (self.path.split('?')[0] not in ('/','/metrics')):
+			self.send_error(404);
+			return;
+		body=self.server.registry.render().encode();
+		self.send_response(200);
+		self.send_header('Content-Type',CONTENT_TYPE);
+		self.send_header('Content-Length',str(len(body)));
+		self.end_headers();
+		self.wfile.write(body);
+
+	def log_message(self,format,*args):
+		self.server.logger.debug(format % args);
+
+#local HTTP endpoint giving the metrics, requests are handled one after the other in a single thread
+class MetricsServer:
+	def __init__(self,registry,host='127.0.0.1',port=9108):
+		#logger
+		self.logger = logging.getLogger(__name__);
+		self.server=HTTPServer((host,port),MetricsRequestHandler);
+		self.server.timeout=5;
+		self.server.registry=registry;
+		self.server.logger=self.logger;
+		self.thread=None;
+
+	def start(self):
+		self.thread=threading.Thread(target=self.server.serve_forever,daemon=True);
+		self.thread.start();
+		self.logger.critical('Metrics endpoint: http://'+self.server.server_address[0]+':'+str(self.server.server_address[1])+'/metrics');
+
+	def stop(self):
+		self.server.shutdown();
+		self.server.server_close();
+		self.thread.join();
@@ -4,23 +4,63 @@ import threading
 import logging
 import socket
 import traceback
+import time
+import DDConnection
 
-def calc_crc(data):
-    crc = 0xFFFF
-    for pos in data:
-        crc ^= pos 
-        for i in range(8):
-            if ((crc & 1) != 0):
-                crc >>= 1
-                crc ^= 0xA001
-            else:
-                crc >>= 1
-    return crc
+#CRC-16/MODBUS lookup table (reflected polynomial 0xA001), one entry per byte value
+def _crc_table():
+	table=list();
+	for byte in range(256):
+		crc=byte;
+		for i in range(8):
+			if ((crc & 1) != 0):
+				crc=(crc >> 1) ^ 0xA001;
+			else:
+				crc>>=1;
+		table.append(crc);
+	return tuple(table);
+
+CRC_TABLE=_crc_table();
+
+#table driven CRC calculation, crc parameter allow to go on with a previous partial result
+def calc_crc(data,crc=0xFFFF):
+	table=CRC_TABLE;
+	for pos in data:
+		crc=(crc >> 8) ^ table[(crc ^ pos) & 0xFF];
+	return crc
+
+#incremental CRC calculation, used to compute frame CRC while its bytes are received
+class CRC16:
+	def __init__(self,data=b''):
+		self.crc=0xFFFF;
+		self.length=0;
+		self.update(data);
+	
+	#restart a new calculation
+	def reset(self):
+		self.crc=0xFFFF;
+		self.length=0;
+		
+	#add bytes to the calculation and return current CRC
+	def update(self,data):
+		self.crc=calc_crc(data,self.crc);
+		self.length+=len(data);
+		return self.crc;
+	
+	#CRC bytes as sent on the bus (low byte first)
+	def digest(self):
+		return bytes((self.crc & 0xFF,(self.crc >> 8) & 0xFF));
+	
+	#a frame including its own CRC bytes gives a null CRC
+	def valid(self):
+		return (self.length>=2 and self.crc==0);
 
 #class used to define a structure of several continuous registers
 class RegisterSet:
 	address=0;
 	data=list();
+	#time of the write request, if known
+	requestTime=None;
 	
 	def __init__(self,address,data):
 		self.address=address;
@@ -43,7 +83,15 @@ class slaveRequest:
 		self.regAddress=0;
 		self.regNb=0;
 		self.data=dict();
+		#time of reception of first and last frame bytes
+		self.firstByteTime=None;
+		self.lastByteTime=None;
 		
+		#frames sent by slaves answering the boiler are not requests
+		if (len(data)>=2 and (((data[1] == DDModbus.READ_ANALOG_HOLDING_REGISTERS) and (len(data)!=8)) or ((data[1] == DDModbus.WRITE_MULTIPLE_REGISTERS) and (len(data)==8)))):
+			self.logger.debug('Slave answer frame ignored');
+			return;
+			
 		#check rough length
 		if ((len(data) > self.FRAME_MAX_LENGTH) or (len(data) < self.FRAME_MIN_LENGTH )):
 			self.logger.warning('Received Frame Length Error');
@@ -99,10 +147,138 @@ class slaveRequest:
 				self.data[self.regAddress+i]=0x100*data[7+2*i]+data[8+2*i];
 			
 	
+#class used to cut the TCP byte stream into RTU frames
+#a TCP segment may hold a part of a frame or several frames, so bytes are kept between calls
+#frame length is found with the modbus feature code and checked with the CRC
+class RTUFramer:
+	#silence after which pending bytes are considered as a truncated frame
+	FRAME_SILENCE=0.1;
+	#an exception frame is the shortest one
+	FRAME_MIN_LENGTH=0x05;
+	
+	def __init__(self):
+		#logger
+		self.logger = logging.getLogger(__name__)
+		self.buffer=bytearray();
+		#CRC of the buffer beginning, computed incrementally while frame bytes are checked
+		self.crc=CRC16();
+		self.lastRxTime=None;
+		#reception time of the first byte of the buffer
+		self.startTime=None;
+		#reception time of first and last bytes of the last extracted frame
+		self.frameTimes=(None,None);
+		#complete frames extracted before an inter-frame silence, with their times
+		self.pending=list();
+		#bytes which are not part of a valid frame, CRC errors or truncated frames
+		self.droppedBytes=0;
+		#complete candidate frames with a wrong CRC, counted once until next valid frame as resync bytes are checked again
+		self.crcErrors=0;
+		self.crcFailed=False;
+		
+	def clear(self):
+		self.buffer=bytearray();
+		self.crc.reset();
+		self.pending=list();
+		self.crcFailed=False;
+		
+	#add received bytes
+	def feed(self,data,now=None):
+		if now is None:
+			now=time.time();
+		#an inter-frame silence ends the frame, pending bytes are cut without waiting for more
+		if ((len(self.buffer)!=0) and ((now-self.lastRxTime) > RTUFramer.FRAME_SILENCE)):
+			frame=self.nextFrame(True);
+			while frame is not None:
+				self.pending.append((frame,self.frameTimes));
+				frame=self.nextFrame(True);
+			if (len(self.buffer)!=0):
+				self.logger.debug('Truncated frame dropped: '+self.buffer.hex());
+				self.droppedBytes+=len(self.buffer);
+			self.buffer=bytearray();
+			self.crc.reset();
+			self.crcFailed=False;
+		if (len(self.buffer)==0):
+			self.startTime=now;
+		self.buffer.extend(data);
+		self.lastRxTime=now;
+	
+	#possible lengths of the frame at the beginning of the buffer, None if they can't be known yet
+	def candidateLengths(self):
+		feature=self.buffer[1];
+		if (feature == DDModbus.READ_ANALOG_HOLDING_REGISTERS):
+			#request or answer
+			if (len(self.buffer) < 3):
+				return None;
+			return (8,5+self.buffer[2]);
+		if (feature == DDModbus.WRITE_MULTIPLE_REGISTERS):
+			#ack or request
+			if (len(self.buffer) < 7):
+				return (8,);
+			return (8,9+self.buffer[6]);
+		if (feature in (DDModbus.READ_ANALOG_HOLDING_REGISTERS | 0x80,DDModbus.WRITE_MULTIPLE_REGISTERS | 0x80)):
+			#exception of a used function
+			return (5,);
+		return ();
+	
+	#CRC of the buffer beginning up to length
+	def crcAt(self,length):
+		if (length < self.crc.length):
+			self.crc.reset();
+		self.crc.update(memoryview(self.buffer)[self.crc.length:length]);
+		return self.crc.crc;
+	
+	#extract next frame of the buffer, if stale no more byte is waited to complete it
+	def nextFrame(self,stale):
+		while (len(self.buffer) >= 2):
+			lengths=self.candidateLengths();
+			if (lengths is None) and not stale:
+				return None;
+			waiting=False;
+			crcError=False;
+			for length in sorted(lengths or ()):
+				if (length > len(self.buffer)):
+					waiting=True;
+				elif (self.crcAt(length)!=0):
+					crcError=True;
+				else:
+					#frame found
+					frame=bytes(self.buffer[0:length]);
+					del self.buffer[0:length];
+					self.crc.reset();
+					self.crcFailed=False;
+					self.frameTimes=(self.startTime,self.lastRxTime);
+					#next frame has been received with the last bytes
+					self.startTime=self.lastRxTime;
+					return frame;
+			if waiting and not stale and (len(self.buffer) < DDModbus.ANSWER_FRAME_MAX_LENGTH):
+				return None;
+			#a complete candidate frame has a wrong CRC
+			if crcError and not self.crcFailed:
+				self.crcErrors+=1;
+				self.crcFailed=True;
+			#no frame can start with this byte, resynchronisation on next one
+			self.logger.debug('Resync, byte dropped: '+hex(self.buffer[0]));
+			self.droppedBytes+=1;
+			del self.buffer[0];
+			self.crc.reset();
+		return None;
+		
+	#return next complete and valid frame, None if there's not
+	def frame(self,now=None):
+		if (len(self.pending)!=0):
+			frame,self.frameTimes=self.pending.pop(0);
+			return frame;
+		if (len(self.buffer)==0):
+			return None;
+		if now is None:
+			now=time.time();
+		return self.nextFrame((now-self.lastRxTime) > RTUFramer.FRAME_SILENCE);
+	
 class DDModbus:
 	ip=None; #serial port id
 	port=None;
 	CLEANING_TIMEOUT=0.1;
+	CONNECT_TIMEOUT=5;
 	SLAVE_RX_TIMEOUT=0.5;
 	MASTER_RX_TIMEOUT=2.5;
 	READ_ANALOG_HOLDING_REGISTERS=0x03;
@@ -118,8 +294,26 @@ class DDModbus:
 		#socket definition and connection
 		self.ip=ip;
 		self.port=port;
-		self.socket=socket.socket(socket.AF_INET, socket.SOCK_STREAM);
-		self.socket.connect((self.ip,self.port));
+		self.socket=socket.create_connection((self.ip,self.port),DDModbus.CONNECT_TIMEOUT);
+		try:
+			DDConnection.setKeepalive(self.socket);
+		except OSError:
+			self.socket.close();
+			raise;
+		#cleared on connection error
+		self.connected=True;
+		
+		#received byte stream to frames
+		self.framer=RTUFramer();
+		
+		#transaction instrumentation, None when metrics are disabled
+		self.metrics=None;
+		#outcome of the last transaction, as counted by the metrics
+		self.lastOutcome=None;
+	
+	def close(self):
+		self.connected=False;
+		self.socket.close();
 		
 	def clean(self):
 		run= True;
@@ -128,17 +322,50 @@ class DDModbus:
 				self.socket.settimeout(DDModbus.CLEANING_TIMEOUT);
 				data=self.socket.recv(1024);
 				self.logger.debug('Cleaning of: '+str(len(data))+' bytes(s)');
+				if (len(data)==0):
+					#connection closed by converter
+					self.connected=False;
+					run=False;
+			except socket.timeout:
+				run=False;
 			except socket.error as exc:
+				self.connected=False;
 				run=False;
-
-	def slaveRx(self):
+		self.framer.clear();
+	
+	#wait for next complete and valid frame during timeout, return None if there's no one
+	def recvFrame(self,timeout):
+		deadline=time.time()+timeout;
+		while True:
+			frame=self.framer.frame();
+			if frame is not None:
+				self.logger.debug('Frame received: '+frame.hex());
+				return frame;
+			remaining=deadline-time.time();
+			if (remaining <= 0):
+				return None;
+			self.socket.settimeout(remaining);
 			try:
-				self.socket.settimeout(DDModbus.SLAVE_RX_TIMEOUT);
 				data=self.socket.recv(1024);
-				self.logger.debug('Frame received: '+data.hex());
+			except socket.timeout:
+				return None;
+			except OSError:
+				self.connected=False;
+				raise;
+			if (len(data)==0):
+				self.connected=False;
+				raise ConnectionError('Connection closed by converter');
+			self.framer.feed(data);
+
+	def slaveRx(self,timeout=SLAVE_RX_TIMEOUT):
+			try:
+				data=self.recvFrame(timeout);
+				if data is None:
+					return False;
 				
-				#frame are never used and never acknowledged
+				#frame are never acknowledged
 				frame=slaveRequest(data);
+				frame.firstByteTime,frame.lastByteTime=self.framer.frameTimes;
 				
 				#exemple of ack for WRITE_MULTIPLE_REGISTERS request
 				#commented to avoid to the boiler to think there are
@@ -156,9 +383,8 @@ class DDModbus:
 			except socket.error as exc:
 				return False;
 				
-	def masterReadAnalog(self,modbusAddress,regAddress,regNb):
-		
-		#build request
+	#build READ_ANALOG_HOLDING_REGISTERS request
+	def readRequest(self,modbusAddress,regAddress,regNb):
 		request=bytearray();
 		request.append(modbusAddress);
 		request.append(DDModbus.READ_ANALOG_HOLDING_REGISTERS);
@@ -170,64 +396,42 @@ class DDModbus:
 		request.append(crc & 0xFF);
 		request.append((crc>>8)& 0xFF);
 		request.append(0);
+		return request;
+	
+	#check a frame received after a read request, CRC and length have been checked by the framer
+	#return (True,registers dict) for the answer, (True,None) for an exception and (False,None) for a frame which is not the answer
+	def readAnswer(self,answer,modbusAddress,regAddress,regNb):
+		self.logger.debug('Answer received: '+answer.hex());
 		
-		#send it
-		self.logger.debug('Send read request: '+request.hex());
-		self.socket.send(request);
+		#check  modBus address
+		if (answer[0] != modbusAddress):
+			self.logger.warning('Answer modbus address Error');
+			return(False,None);
 		
-		#wait for answer
-		try:
-			self.socket.settimeout(DDModbus.MASTER_RX_TIMEOUT);
-			answer=self.socket.recv(1024);
-			self.logger.debug('Answer received: '+answer.hex());
-			
-			#check answer
-			
-			#check rough length
-			if ((len(answer) > self.ANSWER_FRAME_MAX_LENGTH) or (len(answer) < self.ANSWER_FRAME_MIN_LENGTH )):
-				self.logger.warning('Rough Answer Length Error');
-				return;
+		#check exception
+		if (answer[1] == (DDModbus.READ_ANALOG_HOLDING_REGISTERS | 0x80)):
+			self.logger.warning('Answer exception code: '+hex(answer[2]));
+			return(True,None);
+	
+		#check  modBus feature
+		if (answer[1] != DDModbus.READ_ANALOG_HOLDING_REGISTERS):
+			self.logger.warning('Answer modbus feature Error');
+			return(False,None);
 		
-			#check  modBus address
-			if (answer[0] != modbusAddress):
-				self.logger.warning('Answer modbus address Error');
-				return;
-			
-			#check  modBus feature
-			if (answer[1] != DDModbus.READ_ANALOG_HOLDING_REGISTERS):
-				self.logger.warning('Answer modbus feature Error');
-				return;
-				
-			#check byte nb
-			if (answer[2] != 2*regNb):
-				self.logger.warning('Answer byte number Error');
-				return;
-				
-			#check length
-			answerLength=5+answer[2];
-			if ((len(answer) < answerLength )):
-				self.logger.warning('Answer Length Error');
-				return;
-				
-			#check CRC
-			crc=calc_crc(answer[0:answerLength-2]);
-			if (crc!=0x100*answer[answerLength-1]+answer[answerLength-2]):
-				self.logger.warning('Answer CRC error ');
-				return;
-			self.logger.debug('Answer valid ');
-			
-			#return answer as dict
-			data=dict();
-			for i in range(0,regNb):
-				data[regAddress+i]=0x100*answer[3+2*i]+answer[4+2*i];
-			return(data);
-			
-		except socket.error as exc:
-			self.logger.warning('No answer to masterReadAnalog');
-			return;
-			
-	def masterWriteAnalog(self,modbusAddress,regAddress,data):
-		#build request
+		#check byte nb
+		if ((len(answer) < self.ANSWER_FRAME_MIN_LENGTH) or (answer[2] != 2*regNb)):
+			self.logger.warning('Answer byte number Error');
+			return(False,None);
+		self.logger.debug('Answer valid ');
+		
+		#return answer as dict
+		data=dict();
+		for i in range(0,regNb):
+			data[regAddress+i]=0x100*answer[3+2*i]+answer[4+2*i];
+		return(True,data);
+	
+	#build WRITE_MULTIPLE_REGISTERS request
+	def writeRequest(self,modbusAddress,regAddress,data):
 		request=bytearray();
 		#byte 0
 		request.append(modbusAddress);
@@ -250,30 +454,107 @@ class DDModbus:
 		request.append(crc & 0xFF);
 		request.append((crc>>8)& 0xFF);
 		request.append(0);
+		return request;
+	
+	#check a frame received after a write request
+	#return True for the ack, False for an exception and None for a frame which is not the ack
+	def writeAck(self,answer,request):
+		self.logger.debug('Ack received: '+answer.hex());
+		waited_ack=request[0:6];
+		crc=calc_crc(waited_ack);
+		waited_ack.append(crc & 0xFF);
+		waited_ack.append((crc>>8)& 0xFF);
+		if (waited_ack==answer):
+			self.logger.info('Ack OK');
+			return(True);
+		elif (answer[0:2]==bytes((request[0],DDModbus.WRITE_MULTIPLE_REGISTERS | 0x80))):
+			self.logger.warning('Ack KO. Exception code: '+hex(answer[2]));
+			return(False);
+		else:
+			self.logger.warning('Ack KO. Waited Ack was : '+waited_ack.hex());
+			return(None);
+				
+	#outcome of a transaction without answer, a complete frame with a wrong CRC received during the transaction is a CRC error
+	def failureOutcome(self,crcErrors,answerError):
+		if answerError is not None:
+			return answerError;
+		if (self.framer.crcErrors!=crcErrors):
+			return 'crc_error';
+		return 'timeout';
+	
+	#transaction instrumentation, when metrics are enabled
+	def transactionDone(self,modbusAddress,function,outcome,start):
+		self.lastOutcome=outcome;
+		if self.metrics is not None:
+			self.metrics.transaction(modbusAddress,function,outcome,time.time()-start);
+	
+	def masterReadAnalog(self,modbusAddress,regAddress,regNb):
+		
+		#build request
+		request=self.readRequest(modbusAddress,regAddress,regNb);
 		
 		#send it
-		self.logger.info('Send write request: '+request.hex());
-		self.socket.send(request);
+		self.logger.debug('Send read request: '+request.hex());
+		start=time.time();
+		crcErrors=self.framer.crcErrors;
+		answerError=None;
+		try:
+			self.socket.sendall(request);
+			
+			#wait for answer, frames which are not the answer are skipped
+			deadline=start+DDModbus.MASTER_RX_TIMEOUT;
+			while True:
+				answer=self.recvFrame(deadline-time.time());
+				if answer is None:
+					self.logger.warning('No answer to masterReadAnalog');
+					self.transactionDone(modbusAddress,'read',self.failureOutcome(crcErrors,answerError),start);
+					return;
+				done,data=self.readAnswer(answer,modbusAddress,regAddress,regNb);
+				if done:
+					self.transactionDone(modbusAddress,'read','ok' if (data is not None) else 'exception',start);
+					return(data);
+				#answer of the regulator with a wrong byte number
+				if (answer[0:2]==bytes((modbusAddress,DDModbus.READ_ANALOG_HOLDING_REGISTERS))):
+					answerError='length_error';
+			
+		except socket.error as exc:
+			if not isinstance(exc,socket.timeout):
+				self.connected=False;
+			self.logger.warning('No answer to masterReadAnalog');
+			self.transactionDone(modbusAddress,'read','timeout' if isinstance(exc,socket.timeout) else 'error',start);
+			return;
+			
+	def masterWriteAnalog(self,modbusAddress,regAddress,data):
+		#build request
+		request=self.writeRequest(modbusAddress,regAddress,data);
 		
-		#wait for ack
+		#send it
+		self.logger.info('Send write request: '+request.hex());
+		start=time.time();
+		crcErrors=self.framer.crcErrors;
+		answerError=None;
 		try:
-			self.socket.settimeout(DDModbus.MASTER_RX_TIMEOUT);
-			answer=self.socket.recv(1024);
-			self.logger.debug('Ack received: '+answer.hex());
-			#check ack
-			waited_ack=request[0:6];
-			crc=calc_crc(waited_ack);
-			waited_ack.append(crc & 0xFF);
-			waited_ack.append((crc>>8)& 0xFF);
-			if (waited_ack==answer[0:8]):
-				self.logger.info('Ack OK');
-				return(True);
-			else:
-				self.logger.warning('Ack KO. Waited Ack was : '+waited_ack.hex());
-				return(False);
+			self.socket.sendall(request);
 			
+			#wait for ack, frames which are not the ack are skipped
+			deadline=start+DDModbus.MASTER_RX_TIMEOUT;
+			while True:
+				answer=self.recvFrame(deadline-time.time());
+				if answer is None:
+					self.logger.warning('No ack  to master write request');
+					self.transactionDone(modbusAddress,'write',self.failureOutcome(crcErrors,answerError),start);
+					return(False);
+				ack=self.writeAck(answer,request);
+				if ack is not None:
+					self.transactionDone(modbusAddress,'write','ok' if ack else 'ack_ko',start);
+					return(ack);
+				#ack of the regulator which doesn't match the request
+				if (answer[0:2]==bytes((modbusAddress,DDModbus.WRITE_MULTIPLE_REGISTERS))):
+					answerError='ack_ko';
 			
 		except socket.error as exc:
+			if not isinstance(exc,socket.timeout):
+				self.connected=False;
 			self.logger.warning('No ack  to master write request');
+			self.transactionDone(modbusAddress,'write','timeout' if isinstance(exc,socket.timeout) else 'error',start);
 			return(False);
-
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import asyncio
+import logging
+import time
+import DDModbus,DDConnection
+
+#asyncio version of DDModbus, built on StreamReader/StreamWriter
+#frame building and checking are shared with DDModbus, only the I/O methods are coroutines
+class AsyncDDModbus(DDModbus.DDModbus):
+
+	def __init__(self,ip,port):
+		#logger
+		self.logger = logging.getLogger(__name__)
+
+		#connection parameters, connection is done by connect coroutine
+		self.ip=ip;
+		self.port=port;
+		self.reader=None;
+		self.writer=None;
+		self.connected=False;
+
+		#received byte stream to frames
+		self.framer=DDModbus.RTUFramer();
+		
+		#transaction instrumentation, None when metrics are disabled
+		self.metrics=None;
+		#outcome of the last transaction, as counted by the metrics
+		self.lastOutcome=None;
+
+	async def connect(self):
+		self.reader,self.writer=await asyncio.wait_for(asyncio.open_connection(self.ip,self.port),DDModbus.DDModbus.CONNECT_TIMEOUT);
+		sock=self.writer.get_extra_info('socket');
+		if sock is not None:
+			DDConnection.setKeepalive(sock);
+		self.connected=True;
+
+	def close(self):
+		self.connected=False;
+		if self.writer is not None:
+			self.writer.close();
+			self.writer=None;
+
+	async def clean(self):
+		run= True;
+		while run:
+			try:
+				data=await asyncio.wait_for(self.reader.read(1024),DDModbus.DDModbus.CLEANING_TIMEOUT);
+				self.logger.debug('Cleaning of: '+str(len(data))+' bytes(s)');
+				if (len(data)==0):
+					#connection closed by converter
+					self.connected=False;
+					run=False;
+			except asyncio.TimeoutError:
+				run=False;
+			except OSError:
+				self.connected=False;
+				run=False;
+		self.framer.clear();
+
+	#wait for next complete and valid frame during timeout (None to wait without limit), return None if there's no one
+	async def recvFrame(self,timeout):
+		deadline=(time.time()+timeout) if (timeout is not None) else None;
+		while True:
+			frame=self.framer.frame();
+			if frame is not None:
+				self.logger.debug('Frame received: '+frame.hex());
+				return frame;
+			remaining=(deadline-time.time()) if (deadline is not None) else None;
+			if (remaining is not None) and (remaining <= 0):
+				return None;
+			try:
+				data=await asyncio.wait_for(self.reader.read(1024),remaining);
+			except asyncio.TimeoutError:
+				return None;
+			except OSError:
+				self.connected=False;
+				raise;
+			if (len(data)==0):
+				self.connected=False;
+				raise ConnectionError('Connection closed by converter');
+			self.framer.feed(data);
+
+	#wait for a boiler frame, without timeout the wait lasts until a frame is received
+	async def slaveRx(self,timeout=None):
+		try:
+			data=await self.recvFrame(timeout);
+			if data is None:
+				return False;
+			frame=DDModbus.slaveRequest(data);
+			frame.firstByteTime,frame.lastByteTime=self.framer.frameTimes;
+			return frame;
+		except OSError as exc:
+			return False;
+
+	async def masterReadAnalog(self,modbusAddress,regAddress,regNb):
+		#build and send request
+		request=self.readRequest(modbusAddress,regAddress,regNb);
+		self.logger.debug('Send read request: '+request.hex());
+		start=time.time();
+		crcErrors=self.framer.crcErrors;
+		answerError=None;
+		try:
+			self.writer.write(request);
+			await self.writer.drain();
+
+			#wait for answer, frames which are not the answer are skipped
+			deadline=start+DDModbus.DDModbus.MASTER_RX_TIMEOUT;
+			while True:
+				answer=await self.recvFrame(deadline-time.time());
+				if answer is None:
+					self.logger.warning('No answer to masterReadAnalog');
+					self.transactionDone(modbusAddress,'read',self.failureOutcome(crcErrors,answerError),start);
+					return;
+				done,data=self.readAnswer(answer,modbusAddress,regAddress,regNb);
+				if done:
+					self.transactionDone(modbusAddress,'read','ok' if (data is not None) else 'exception',start);
+					return(data);
+				#answer of the regulator with a wrong byte number
+				if (answer[0:2]==bytes((modbusAddress,DDModbus.DDModbus.READ_ANALOG_HOLDING_REGISTERS))):
+					answerError='length_error';
+		except OSError as exc:
+			self.connected=False;
+			self.logger.warning('No answer to masterReadAnalog');
+			self.transactionDone(modbusAddress,'read','error',start);
+			return;
+
+	async def masterWriteAnalog(self,modbusAddress,regAddress,data):
+		#build and send request
+		request=self.writeRequest(modbusAddress,regAddress,data);
+		self.logger.info('Send write request: '+request.hex());
+		start=time.time();
+		crcErrors=self.framer.crcErrors;
+		answerError=None;
+		try:
+			self.writer.write(request);
+			await self.writer.drain();
+
+			#wait for ack, frames which are not the ack are skipped
+			deadline=start+DDModbus.DDModbus.MASTER_RX_TIMEOUT;
+			while True:
+				answer=await self.recvFrame(deadline-time.time());
+				if answer is None:
+					self.logger.warning('No ack  to master write request');
+					self.transactionDone(modbusAddress,'write',self.failureOutcome(crcErrors,answerError),start);
+					return(False);
+				ack=self.writeAck(answer,request);
+				if ack is not None:
+					self.transactionDone(modbusAddress,'write','ok' if ack else 'ack_ko',start);
+					return(ack);
+				#ack of the regulator which doesn't match the request
+				if (answer[0:2]==bytes((modbusAddress,DDModbus.DDModbus.WRITE_MULTIPLE_REGISTERS))):
+					answerError='ack_ko';
+		except OSError as exc:
+			self.connected=False;
+			self.logger.warning('No ack  to master write request');
+			self.transactionDone(modbusAddress,'write','error',start);
+			return(False);
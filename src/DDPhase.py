@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import logging
+
+#class used to learn the boiler master/slave cycle from the timestamps of sniffed frames
+#once learned, the end of the boiler master phase is predicted from the time of its last frame
+class PhaseTracker:
+	#silence separating two boiler master phases
+	PHASE_GAP=1.0;
+	#accepted cycle period range, other measures are missed cycles
+	PERIOD_MIN=5.0;
+	PERIOD_MAX=30.0;
+	#weight of last measure in estimations
+	FILTER=0.2;
+	#master phases learned before predictions are used
+	LEARNING_CYCLES=3;
+	#silence waited after the predicted last frame
+	GUARD_TIME=0.02;
+	#prediction tolerance in number of jitters
+	JITTER_FACTOR=3;
+
+	def __init__(self):
+		#logger
+		self.logger = logging.getLogger(__name__);
+		self.reset();
+
+	#forget learned cycle, after a reconnection for example
+	def reset(self):
+		#cycle period and its jitter
+		self.period=None;
+		self.jitter=0;
+		#time of the end of the last frame from the beginning of the master phase and its jitter
+		self.duration=None;
+		self.durationJitter=0;
+		#shortest silence between two frames of a master phase
+		self.frameGap=None;
+		self.cycles=0;
+		#current master phase, the first one may have begun before the connection
+		self.firstBurst=True;
+		self.burstStart=None;
+		self.burstFrameGap=None;
+		self.lastFrameEnd=None;
+		#time gained on the switch to master mode
+		self.windowGain=0;
+
+	#update an estimation and its jitter with a new measure
+	def learn(self,value,estimate,jitter):
+		if estimate is None:
+			return value,0;
+		jitter+=self.FILTER*(abs(value-estimate)-jitter);
+		estimate+=self.FILTER*(value-estimate);
+		return estimate,jitter;
+
+	#frame received from the boiler, with the time of its first and last byte
+	def frame(self,first,last):
+		if (self.lastFrameEnd is None) or ((first-self.lastFrameEnd) > self.PHASE_GAP):
+			#new master phase, previous one is learned
+			if (self.burstStart is not None):
+				period=first-self.burstStart;
+				if (not self.firstBurst) and (self.PERIOD_MIN <= period <= self.PERIOD_MAX):
+					self.period,self.jitter=self.learn(period,self.period,self.jitter);
+					self.duration,self.durationJitter=self.learn(self.lastFrameEnd-self.burstStart,self.duration,self.durationJitter);
+					if (self.burstFrameGap is not None):
+						self.frameGap=self.learn(self.burstFrameGap,self.frameGap,0)[0];
+					self.cycles+=1;
+				self.firstBurst=False;
+			self.burstStart=first;
+			self.burstFrameGap=None;
+		else:
+			gap=max(first-self.lastFrameEnd,0);
+			if (self.burstFrameGap is None) or (gap < self.burstFrameGap):
+				self.burstFrameGap=gap;
+		self.lastFrameEnd=last;
+
+	#prediction can be used once learned and precise enough to find the last frame of a master phase
+	def locked(self):
+		if (self.cycles < self.LEARNING_CYCLES) or (self.burstStart is None):
+			return False;
+		return (self.frameGap is None) or (self.JITTER_FACTOR*self.durationJitter < self.frameGap);
+
+	#time at which the boiler is silent, None if it can't be predicted
+	def switchTime(self):
+		if not self.locked():
+			return None;
+		#last frame of the master phase received
+		if (self.lastFrameEnd >= self.burstStart+self.duration-self.JITTER_FACTOR*self.durationJitter):
+			return self.lastFrameEnd+self.GUARD_TIME;
+		return None;
+
+	#predicted start of next boiler master phase, None if it can't be predicted
+	def nextBurstTime(self):
+		if (self.cycles < self.LEARNING_CYCLES) or (self.burstStart is None):
+			return None;
+		#earliest expected start, a missed master phase gives no prediction
+		burstTime=self.burstStart+self.period-self.JITTER_FACTOR*self.jitter;
+		if (burstTime <= self.lastFrameEnd):
+			return None;
+		return burstTime;
+
+	#position in the cycle, from 0 to 1, 0 at the beginning of the master phase
+	def phase(self,now):
+		if (self.period is None) or (self.burstStart is None):
+			return None;
+		return ((now-self.burstStart) % self.period)/self.period;
+
+	#switch to master mode done at now instead of legacyTime
+	def masterSwitch(self,now,legacyTime):
+		self.windowGain+=self.FILTER*(max(legacyTime-now,0)-self.windowGain);
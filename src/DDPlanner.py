@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import logging
+from enum import IntEnum
+
+#class used to estimate modbus transaction durations on the RS485 bus behind the TCP converter
+class BusTiming:
+	#RTU 8N1 : start bit, 8 data bits, stop bit
+	BITS_PER_BYTE=10;
+	BAUDRATE=9600;
+	#regulator answer delay
+	TURNAROUND=0.05;
+	#RS485/TCP converter and network latency
+	CONVERTER_LATENCY=0.02;
+
+	def __init__(self,baudrate=BAUDRATE,turnaround=TURNAROUND,latency=CONVERTER_LATENCY):
+		self.baudrate=baudrate;
+		self.turnaround=turnaround;
+		self.latency=latency;
+
+	#duration of bytes on the bus
+	def bytesTime(self,byteNb):
+		return byteNb*self.BITS_PER_BYTE/self.baudrate;
+
+	#READ_ANALOG_HOLDING_REGISTERS : 8 bytes request followed by a padding byte, 5 bytes answer + 2 bytes per register
+	def readTime(self,regNb):
+		return self.bytesTime(9+5+2*regNb)+self.turnaround+self.latency;
+
+	#WRITE_MULTIPLE_REGISTERS : 9 bytes request + 2 bytes per register followed by a padding byte, 8 bytes ack
+	def writeTime(self,regNb):
+		return self.bytesTime(10+2*regNb+8)+self.turnaround+self.latency;
+
+#class used to build the cheapest list of block reads covering a register set
+#a gap between two registers is read if its bytes cost less than a new request
+class ReadPlanner:
+	#biggest block read by a single request
+	MAX_REG_NB=64;
+
+	def __init__(self,timing=None,maxRegNb=MAX_REG_NB):
+		#logger
+		self.logger = logging.getLogger(__name__);
+		self.timing=timing if timing is not None else BusTiming();
+		self.maxRegNb=maxRegNb;
+		#registers to be read and the corresponding plan
+		self.registers=set();
+		self._plan=None;
+		#plans already computed for register subsets
+		self.cache=dict();
+
+	#add registers to be read, plan is recomputed on next use
+	def addRegisters(self,registers):
+		registers=set(registers);
+		if not registers.issubset(self.registers):
+			self.registers|=registers;
+			self._plan=None;
+			self.cache=dict();
+
+	#plan for the whole register set
+	@property
+	def plan(self):
+		if self._plan is None:
+			self._plan=self.compute(self.registers);
+			self.logger.info('Read plan: '+str(self._plan)+' expected bus time: '+f"{self.busTime(self._plan):.3f}"+'s');
+		return self._plan;
+
+	#return list of (address,register number) blocks covering registers at the lowest bus time
+	def compute(self,registers):
+		key=frozenset(registers);
+		blocks=self.cache.get(key);
+		if blocks is None:
+			blocks=self.solve(sorted(key));
+			#subsets come from a few refresh classes, cache size is bounded anyway
+			if (len(self.cache) >= 64):
+				self.cache=dict();
+			self.cache[key]=blocks;
+		return blocks;
+	
+	def solve(self,regs):
+		#cost[i] is the lowest bus time to read the i first registers, start[i] the first register index of the last block
+		cost=[0.0]*(len(regs)+1);
+		start=[0]*(len(regs)+1);
+		for i in range(1,len(regs)+1):
+			cost[i]=None;
+			j=i-1;
+			while (j>=0) and (regs[i-1]-regs[j] < self.maxRegNb):
+				blockCost=cost[j]+self.timing.readTime(regs[i-1]-regs[j]+1);
+				if (cost[i] is None) or (blockCost < cost[i]):
+					cost[i]=blockCost;
+					start[i]=j;
+				j-=1;
+		#rebuild blocks from the end
+		blocks=list();
+		i=len(regs);
+		while (i>0):
+			j=start[i];
+			blocks.insert(0,(regs[j],regs[i-1]-regs[j]+1));
+			i=j;
+		return blocks;
+
+	#expected bus time of a plan
+	def busTime(self,blocks):
+		return sum(self.timing.readTime(regNb) for address,regNb in blocks);
+
+#definition of register refresh classes
+class RefreshClass(IntEnum):
+	FAST=0;
+	NORMAL=1;
+	SLOW=2;
+	ON_DEMAND=3;
+
+#class used to select registers to be read in each master window according their refresh class period
+class PollScheduler:
+	#a register is due if its period expires before next master window
+	DUE_MARGIN=5;
+	
+	def __init__(self,planner):
+		#logger
+		self.logger = logging.getLogger(__name__);
+		self.planner=planner;
+		#period of each refresh class in seconds, FAST registers are read in each window, ON_DEMAND ones only on request
+		self.periods={RefreshClass.FAST:0,RefreshClass.NORMAL:60,RefreshClass.SLOW:4*3600,RefreshClass.ON_DEMAND:None};
+		#refresh class of each register, NORMAL by default
+		self.registerClass=dict();
+		#time of the last read of each register
+		self.lastRead=dict();
+		#registers requested to be read in next window
+		self.requested=set();
+		
+	def setPeriod(self,refreshClass,period):
+		self.periods[refreshClass]=period;
+	
+	def setClass(self,registers,refreshClass):
+		for reg in registers:
+			self.registerClass[reg]=refreshClass;
+	
+	#request a read of registers in next window, whatever their class
+	def request(self,registers):
+		self.requested.update(registers);
+	
+	#registers to be read in the master window starting at now, refresh flag forces NORMAL class
+	def due(self,now,refresh=False):
+		registers=set(self.requested);
+		for reg in self.planner.registers:
+			refreshClass=self.registerClass.get(reg,RefreshClass.NORMAL);
+			period=self.periods[refreshClass];
+			lastRead=self.lastRead.get(reg);
+			#registers never read are always due
+			if (lastRead is None):
+				registers.add(reg);
+			elif (refresh and (refreshClass<=RefreshClass.NORMAL)):
+				registers.add(reg);
+			elif (period is not None) and ((now-lastRead) > (period-self.DUE_MARGIN)):
+				registers.add(reg);
+		return registers;
+	
+	#blocks to read in the master window starting at now
+	def blocks(self,now,refresh=False):
+		return self.planner.compute(self.due(now,refresh));
+	
+	#save read time of registers
+	def done(self,registers,now):
+		for reg in registers:
+			self.lastRead[reg]=now;
+		self.requested.difference_update(registers);
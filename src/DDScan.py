@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import datetime
+import logging
+import os
+
+#registers by line in scan files
+LINE_REG_NB=16;
+#text of registers not read yet and of registers which can't be read
+NOT_READ='----';
+UNREADABLE='XXXX';
+
+#parse a register range: first-last, decimal or hexadecimal with 0x prefix
+def parseRange(text):
+	first,last=(text.split('-')+[None])[0:2];
+	first=int(first,0);
+	last=int(last,0) if (last is not None) else first;
+	if not (0 <= first <= last <= 0xFFFF):
+		raise ValueError('Wrong register range: '+text);
+	return first,last;
+
+#save scanned registers as text lines of 16 registers, the header line giving the scan state
+def writeScan(path,regulatorAddress,first,last,values,complete):
+	lines=['#regulator '+hex(regulatorAddress)+' registers '+str(first)+'-'+str(last)+' '+datetime.datetime.now().isoformat(timespec='seconds')+' '+('complete' if complete else 'partial')];
+	for lineAddress in range(first,last+1,LINE_REG_NB):
+		texts=list();
+		for reg in range(lineAddress,min(lineAddress+LINE_REG_NB,last+1)):
+			if reg not in values:
+				texts.append(NOT_READ);
+			elif values[reg] is None:
+				texts.append(UNREADABLE);
+			else:
+				texts.append('{:04X}'.format(values[reg]));
+		lines.append('{:04X}: '.format(lineAddress)+' '.join(texts));
+	temp=path+'.tmp';
+	with open(temp,'w') as file:
+		file.write('\n'.join(lines)+'\n');
+	os.replace(temp,path);
+
+#read a scan file, return its range, register values and state, None if the file doesn't exist
+def readScan(path):
+	try:
+		with open(path) as file:
+			lines=file.read().splitlines();
+	except FileNotFoundError:
+		return None;
+	header=lines[0].split();
+	first,last=parseRange(header[3]);
+	values=dict();
+	for line in lines[1:]:
+		lineAddress,texts=line.split(':');
+		for i,text in enumerate(texts.split()):
+			if (text==UNREADABLE):
+				values[int(lineAddress,16)+i]=None;
+			elif (text!=NOT_READ):
+				values[int(lineAddress,16)+i]=int(text,16);
+	return first,last,values,header[-1]=='complete';
+
+#class used to read a register range with chunks read in the spare time of master windows
+#a chunk refused with an exception answer is split until unreadable registers are found, a single register is tried again before being marked unreadable
+#a chunk without answer, timeout or bus error, is read again unchanged
+#progress is saved in a partial file, a scan of the same range is resumed from it
+class RegisterScanner:
+	#failures of a single register before it is marked unreadable
+	MAX_FAILURES=2;
+
+	def __init__(self,regulatorAddress,first,last,path,chunkNb):
+		#logger
+		self.logger = logging.getLogger(__name__);
+		self.regulatorAddress=regulatorAddress;
+		self.first=first;
+		self.last=last;
+		self.path=path;
+		self.values=dict();
+		#differences with the previous complete scan once done, as (register,old value,new value)
+		self.changes=None;
+		self.done=False;
+		#progress saved since last window
+		self.saved=True;
+
+		#values already read by an interrupted scan of the same range
+		partial=readScan(self.partialPath());
+		if (partial is not None) and (partial[0:2]==(first,last)):
+			self.values=partial[2];
+			self.logger.warning('Register scan resumed: '+str(len(self.values))+' register(s) already read');
+
+		#chunks still to read, with their failure count
+		self.chunks=list();
+		chunk=None;
+		for reg in range(first,last+1):
+			if reg in self.values:
+				chunk=None;
+			elif (chunk is None) or (chunk[1]==chunkNb):
+				chunk=[reg,1,0];
+				self.chunks.append(chunk);
+			else:
+				chunk[1]+=1;
+
+	def partialPath(self):
+		return self.path+'.part';
+
+	#chunks to read in next window
+	def pending(self,number):
+		return [(address,regNb) for address,regNb,failures in self.chunks[0:number]];
+
+	#progress ratio
+	def progress(self):
+		return len(self.values)/(self.last-self.first+1);
+
+	#result of a chunk read, registers dict or None on failure, with the transaction outcome
+	def chunkDone(self,address,regNb,registers,outcome):
+		chunk=next((chunk for chunk in self.chunks if chunk[0:2]==[address,regNb]),None);
+		if chunk is None:
+			return;
+		if (registers is None) and (outcome!='exception'):
+			#bus error, the chunk is kept pending
+			self.logger.debug('Register scan: chunk '+str(address)+' nb: '+str(regNb)+' not read, '+str(outcome));
+			return;
+		if registers is not None:
+			self.values.update(registers);
+			self.chunks.remove(chunk);
+		elif (regNb!=1):
+			#an exception answer is given for the whole chunk if one register can't be read
+			index=self.chunks.index(chunk);
+			half=regNb//2;
+			self.chunks[index:index+1]=[[address,half,0],[address+half,regNb-half,0]];
+		else:
+			chunk[2]+=1;
+			if (chunk[2] >= self.MAX_FAILURES):
+				self.logger.info('Register scan: register '+str(address)+' unreadable');
+				self.values[address]=None;
+				self.chunks.remove(chunk);
+		self.saved=False;
+
+	#save progress, result and its differences with the previous scan once the scan is complete
+	def save(self):
+		if self.saved:
+			return;
+		self.saved=True;
+		if (len(self.chunks)!=0):
+			writeScan(self.partialPath(),self.regulatorAddress,self.first,self.last,self.values,False);
+			return;
+		previous=readScan(self.path);
+		self.changes=list();
+		if (previous is not None) and previous[3]:
+			for reg in range(self.first,self.last+1):
+				if (reg in previous[2]) and (previous[2][reg]!=self.values[reg]):
+					self.changes.append((reg,previous[2][reg],self.values[reg]));
+		#diff file of the last scan only
+		if (len(self.changes)!=0):
+			with open(self.path+'.diff','w') as file:
+				file.write('\n'.join('{:04X}: '.format(reg)+('{:04X}'.format(old) if old is not None else UNREADABLE)+' -> '+('{:04X}'.format(new) if new is not None else UNREADABLE) for reg,old,new in self.changes)+'\n');
+		elif os.path.exists(self.path+'.diff'):
+			os.remove(self.path+'.diff');
+		writeScan(self.path,self.regulatorAddress,self.first,self.last,self.values,True);
+		if os.path.exists(self.partialPath()):
+			os.remove(self.partialPath());
+		self.done=True;
+		self.logger.warning('Register scan done: '+self.path+', '+str(len(self.changes))+' change(s) since previous scan');
+
+	#scan state, published by the gateway
+	def status(self):
+		status={'state':'done' if self.done else 'running','first':self.first,'last':self.last,'progress':round(self.progress(),3),
+			'unreadable':sum(1 for value in self.values.values() if value is None)};
+		if self.done:
+			status['file']=self.path;
+			status['changes']=[{'register':reg,'old':old,'new':new} for reg,old,new in self.changes];
+		return status;
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import operator
+
+#unknown value of a register
+UNKNOWN=0xFFFF;
+
+#decoding of Modbus encoded scaled values, sign and magnitude
+def scaled(reg,scale):
+	if (reg==UNKNOWN):
+		return None;
+	if (reg >= 0x8000):
+		reg=-(reg & 0x7FFF)
+	return(reg*scale);
+
+#decoding of Modbus encoded float values, in tenth
+def float10(reg):
+	return scaled(reg,0.1);
+
+#Home Assistant entity of an attribute: component, object id and name
+#state topic is the attribute topic unless given, a binary sensor or a switch has its off and on payloads
+class Entity:
+	def __init__(self,component,objectId,name,deviceClass=None,unit=None,template=None,state=None,payloads=('0','1')):
+		self.component=component;
+		self.objectId=objectId;
+		self.name=name;
+		self.deviceClass=deviceClass;
+		self.unit=unit;
+		self.template=template;
+		self.state=state;
+		self.payloads=payloads;
+
+#declarative schema of a regulator attribute, compiled once into its decoder and encoder
+#register value is masked and shifted, then scaled as a sign and magnitude value or mapped by the enum to its text
+#valid is the register whose unknown value makes the attribute unknown, like the temperature of a missing zone
+#an attribute computed from several registers gives its decoding method and source registers instead
+#limits are the min, max and step of a written value, request is the pending value receiving an encoded mode
+#topic is the published topic, section and key the JSON document of the attribute, format the formatting of its value
+class Attribute:
+	def __init__(self,name,register=None,mask=None,shift=0,scale=None,enum=None,limits=None,valid=None,
+			decode=None,registers=(),request=None,topic=None,section=None,key=None,format=None,entities=(),history=True):
+		self.name=name;
+		self.register=register;
+		self.mask=mask;
+		self.shift=shift;
+		self.scale=scale;
+		self.enum=enum;
+		self.limits=limits;
+		self.valid=valid;
+		self.request=request;
+		self.topic=topic;
+		self.section=section;
+		self.key=key;
+		self.entities=entities;
+		#numeric values of boiler state are kept in the history
+		self.history=history;
+		if format is None:
+			format='float' if (scale is not None) else ('text' if (enum is not None) else 'int');
+		self.format=format;
+
+		#registers the decoded value depends on
+		sources=list(registers);
+		if (register is not None):
+			sources.append(register);
+		if (valid is not None) and (valid not in sources):
+			sources.append(valid);
+		self.sources=tuple(int(reg) for reg in sources);
+
+		#decoder of the attribute value from the panel registers
+		#None for attributes which aren't decoded, an attribute with source registers is then set by the panel and published with them
+		if (decode is not None):
+			self.decode=self.validDecoder(operator.methodcaller(decode));
+		elif (register is not None):
+			self.decode=self.validDecoder(self.registerDecoder());
+		else:
+			self.decode=None;
+		self.writable=(limits is not None) or (request is not None);
+
+		#encoder of a requested value, enum text to its value
+		if (enum is not None):
+			self.values={text:value << shift for value,text in enum.items()};
+
+	#decoder of the register value, built with the decoding steps of the attribute only
+	def registerDecoder(self):
+		reg=int(self.register);
+		if (self.scale is not None):
+			scale=self.scale;
+			return lambda panel: scaled(panel.registers[reg],scale);
+		mask=self.mask if (self.mask is not None) else 0xFFFF;
+		shift=self.shift;
+		if (self.enum is not None):
+			get=self.enum.get;
+			return lambda panel: get((panel.registers[reg] & mask) >> shift);
+		if (self.mask is not None):
+			return lambda panel: (panel.registers[reg] & mask) >> shift;
+		return lambda panel: panel.registers[reg];
+
+	#decoder giving None when the valid register is unknown
+	def validDecoder(self,decoder):
+		if (self.valid is None):
+			return decoder;
+		valid=int(self.valid);
+		return lambda panel: decoder(panel) if (panel.registers[valid]!=UNKNOWN) else None;
+
+	#register value of a requested value, None if it can't be encoded
+	#numeric values are rounded to a multiple of the step and clamped within the limits
+	def encode(self,x):
+		if (self.enum is not None):
+			return self.values.get(x);
+		low,high,step=self.limits;
+		scale=self.scale if (self.scale is not None) else 1;
+		return min(max(round(x/step)*round(step/scale),round(low/scale)),round(high/scale));
+
+#compiled schema of the regulator attributes, with the attributes refreshed by each register
+class Schema:
+	def __init__(self,attributes):
+		self.attributes={attribute.name:attribute for attribute in attributes};
+		#attributes decoded from registers, in schema order
+		self.decoded=[attribute for attribute in attributes if attribute.decode is not None];
+		self.writable=[attribute for attribute in attributes if attribute.writable];
+		self.index=dict();
+		for attribute in attributes:
+			for reg in attribute.sources:
+				self.index.setdefault(reg,list()).append(attribute);
+
+	def __getitem__(self,name):
+		return self.attributes[name];
+
+	def __iter__(self):
+		return iter(self.attributes.values());
+
+	#attributes refreshed by the given registers
+	def refreshedBy(self,registers):
+		attributes=set();
+		for reg in registers:
+			attributes.update(self.index.get(reg,()));
+		return attributes;
+
@@ -0,0 +1,364 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#Diematic boiler simulator, listening on TCP like the RS485/TCP converter
+#the boiler is master during 5s and sends write frames to its peripherals, then it is silent during 5s
+#and the regulator answers READ_ANALOG_HOLDING_REGISTERS and WRITE_MULTIPLE_REGISTERS requests
+#frames are delayed by their transmission time at 9600 bauds and by the regulator turnaround
+#usage: python3 DDSimulator.py [-p port] [-a 0x0A,0x0B] [-r registers.conf]
+
+import argparse,configparser
+import datetime
+import logging
+import queue
+import random
+import socket
+import threading
+import time
+import DDModbus,DDPlanner
+from Diematic3Panel import DDREGISTER
+
+#register values of a boiler with a single heating zone, burner on and hot water pump running
+DEFAULT_REGISTERS={
+	DDREGISTER.CTRL:7,
+	DDREGISTER.TEMP_EXT:85,
+	DDREGISTER.NB_JOUR_ANTIGEL:0,
+	DDREGISTER.CONS_JOUR_A:200,
+	DDREGISTER.CONS_NUIT_A:180,
+	DDREGISTER.CONS_ANTIGEL_A:60,
+	DDREGISTER.MODE_A:8,
+	DDREGISTER.TEMP_AMB_A:205,
+	DDREGISTER.TCALC_A:450,
+	DDREGISTER.CONS_JOUR_B:200,
+	DDREGISTER.CONS_NUIT_B:180,
+	DDREGISTER.CONS_ANTIGEL_B:60,
+	DDREGISTER.MODE_B:8,
+	DDREGISTER.TEMP_AMB_B:0xFFFF,
+	DDREGISTER.TCALC_B:0xFFFF,
+	DDREGISTER.CONS_ECS:550,
+	DDREGISTER.TEMP_ECS:520,
+	DDREGISTER.TEMP_CHAUD:600,
+	DDREGISTER.CONS_ECS_NUIT:450,
+	DDREGISTER.BASE_ECS:0x28,
+	DDREGISTER.OPTIONS_B_C:0,
+	DDREGISTER.IONIZATION_CURRENT:50,
+	DDREGISTER.RETURN_TEMP:450,
+	DDREGISTER.SMOKE_TEMP:700,
+	DDREGISTER.FAN_SPEED:2500,
+	DDREGISTER.PRESSION_EAU:15,
+	DDREGISTER.BOILER_TYPE:2,
+	DDREGISTER.PUMP_POWER:80,
+	DDREGISTER.ALARME:0};
+
+#registers given by the regulator clock
+CLOCK_REGISTERS=(DDREGISTER.HEURE,DDREGISTER.MINUTE,DDREGISTER.JOUR_SEMAINE,DDREGISTER.JOUR,DDREGISTER.MOIS,DDREGISTER.ANNEE);
+
+#register blocks written by the boiler to its peripherals during its master phase
+MASTER_FRAMES=((DDREGISTER.HEURE,4),(DDREGISTER.CONS_JOUR_A,5),(DDREGISTER.CONS_JOUR_B,5),(DDREGISTER.TEMP_CHAUD,1));
+
+#read register map overrides from the [Registers] section of a file, keys are DDREGISTER names or addresses
+def readRegisters(fileName):
+	config=configparser.ConfigParser();
+	config.optionxform=str;
+	if not config.read(fileName):
+		raise FileNotFoundError(fileName);
+	registers=dict();
+	for key,value in config.items('Registers'):
+		address=DDREGISTER[key].value if key in DDREGISTER.__members__ else int(key,0);
+		registers[address]=int(value,0);
+	return registers;
+
+#class used to simulate the regulators and the boiler master phases of a RS485 bus behind a TCP converter
+#every connected client receives the bus frames, like with the converter
+class DiematicSimulator:
+	#boiler master/slave cycle
+	MASTER_DURATION=5.0;
+	SLAVE_DURATION=5.0;
+	#time between two boiler frames
+	MASTER_FRAME_PERIOD=0.5;
+	#destination of boiler frames
+	PERIPHERAL_ADDRESS=0x20;
+	#size of the register map, other addresses give an illegal data address exception
+	REGISTER_NB=0x400;
+	#biggest register number read by a single request
+	MAX_READ_NB=125;
+	#modbus exception codes
+	ILLEGAL_DATA_ADDRESS=0x02;
+	ILLEGAL_DATA_VALUE=0x03;
+
+	def __init__(self,port=0,host='127.0.0.1',regulatorAddresses=(0x0A,),registers=None,timing=None,seed=None):
+		#logger
+		self.logger = logging.getLogger(__name__);
+		self.host=host;
+		self.port=port;
+		#bus timing, at 9600 bauds with the regulator turnaround, converter latency is the one of the network
+		self.timing=timing if (timing is not None) else DDPlanner.BusTiming(latency=0);
+		#register map of each regulator
+		self.maps=dict();
+		for address in regulatorAddresses:
+			self.maps[address]={reg.value:value for reg,value in DEFAULT_REGISTERS.items()};
+			if registers is not None:
+				self.maps[address].update(registers);
+		#regulator clock offset from local time, changed by writes of clock registers
+		self.clockOffset=0;
+		#fault injection: probability of a missing answer and of an answer with a CRC error
+		self.answerLoss=0;
+		self.crcErrors=0;
+		#boiler master frames are not sent while muted
+		self.muted=False;
+		self.random=random.Random(seed);
+		#connected clients and requests received from them
+		self.clients=list();
+		self.clientsLock=threading.Lock();
+		self.requests=queue.Queue();
+		self.server=None;
+		self.threads=list();
+		self.run=False;
+		#statistics
+		self.stats={'cycles':0,'masterFrames':0,'reads':0,'writes':0,'exceptions':0,'collisions':0,'lostAnswers':0,'crcErrors':0,'busTime':0.0};
+		self.logger.debug('Regulators: '+','.join(hex(address) for address in self.maps));
+
+	#register map of a regulator, the first one by default
+	def registers(self,address=None):
+		return self.maps[address if (address is not None) else next(iter(self.maps))];
+
+	def start(self):
+		self.server=socket.socket(socket.AF_INET,socket.SOCK_STREAM);
+		self.server.setsockopt(socket.SOL_SOCKET,socket.SO_REUSEADDR,1);
+		self.server.bind((self.host,self.port));
+		self.server.listen();
+		self.server.settimeout(0.5);
+		self.port=self.server.getsockname()[1];
+		self.logger.info('Simulator listening on port '+str(self.port));
+		self.run=True;
+		self.cycleStart=time.time();
+		for target in (self.acceptLoop,self.busLoop):
+			thread=threading.Thread(target=target,daemon=True);
+			thread.start();
+			self.threads.append(thread);
+		return self.port;
+
+	def stop(self):
+		self.run=False;
+		self.disconnect();
+		self.server.close();
+		for thread in self.threads:
+			thread.join();
+		self.threads=list();
+
+	#close client connections, like a converter reboot
+	def disconnect(self):
+		with self.clientsLock:
+			clients=self.clients;
+			self.clients=list();
+		for client in clients:
+			try:
+				client.shutdown(socket.SHUT_RDWR);
+			except OSError:
+				pass;
+			client.close();
+
+	def acceptLoop(self):
+		while self.run:
+			try:
+				client,address=self.server.accept();
+			except socket.timeout:
+				continue;
+			except OSError:
+				break;
+			self.logger.info('Client connected: '+str(address));
+			with self.clientsLock:
+				self.clients.append(client);
+			threading.Thread(target=self.clientLoop,args=(client,),daemon=True).start();
+
+	#bytes sent by a client are cut into frames and queued with their reception time
+	def clientLoop(self,client):
+		framer=DDModbus.RTUFramer();
+		client.settimeout(0.5);
+		while self.run:
+			try:
+				data=client.recv(1024);
+			except socket.timeout:
+				data=None;
+			except OSError:
+				break;
+			if (data is not None):
+				if (len(data)==0):
+					break;
+				framer.feed(data);
+			frame=framer.frame();
+			while frame is not None:
+				self.requests.put((frame,framer.frameTimes[0]));
+				frame=framer.frame();
+		with self.clientsLock:
+			if client in self.clients:
+				self.clients.remove(client);
+		client.close();
+
+	#send bytes on the bus to all clients, once their transmission time has elapsed
+	def busSend(self,frame,startTime):
+		endTime=startTime+self.timing.bytesTime(len(frame));
+		self.sleepUntil(endTime);
+		self.stats['busTime']+=endTime-startTime;
+		with self.clientsLock:
+			clients=list(self.clients);
+		for client in clients:
+			try:
+				client.sendall(frame);
+			except OSError:
+				pass;
+		return endTime;
+
+	def sleepUntil(self,wakeTime):
+		delay=wakeTime-time.time();
+		if (delay > 0):
+			time.sleep(delay);
+
+	#boiler master phase then regulator slave phase, regulator answers once the last boiler frame is sent
+	def busLoop(self):
+		while self.run:
+			cycleEnd=self.cycleStart+self.MASTER_DURATION+self.SLAVE_DURATION;
+			slaveStart=self.masterPhase(self.cycleStart,self.cycleStart+self.MASTER_DURATION);
+			self.slavePhase(slaveStart,cycleEnd);
+			self.cycleStart=cycleEnd;
+			self.stats['cycles']+=1;
+
+	#boiler frames sent during the master phase, return the end time of the last one
+	def masterPhase(self,start,end):
+		self.updateClock();
+		frameTime=start;
+		lastFrameEnd=start;
+		index=0;
+		while self.run:
+			address,regNb=MASTER_FRAMES[index % len(MASTER_FRAMES)];
+			frame=self.masterFrame(address,regNb);
+			if (frameTime+self.timing.bytesTime(len(frame)) > end):
+				break;
+			self.sleepUntil(frameTime);
+			if not self.muted:
+				lastFrameEnd=self.busSend(frame,frameTime);
+				self.stats['masterFrames']+=1;
+			frameTime+=self.MASTER_FRAME_PERIOD;
+			index+=1;
+		return lastFrameEnd;
+
+	#WRITE_MULTIPLE_REGISTERS frame sent by the boiler with registers of the first regulator
+	def masterFrame(self,address,regNb):
+		registers=self.registers();
+		frame=bytearray((self.PERIPHERAL_ADDRESS,DDModbus.DDModbus.WRITE_MULTIPLE_REGISTERS,(address>>8) & 0xFF,address & 0xFF,0,regNb,2*regNb));
+		for reg in range(address,address+regNb):
+			value=registers.get(reg,0);
+			frame.append((value>>8) & 0xFF);
+			frame.append(value & 0xFF);
+		return self.withCrc(frame);
+
+	#requests are processed one after the other, the bus being busy until the answer end
+	def slavePhase(self,start,end):
+		busFreeTime=start;
+		while self.run and (time.time() < end):
+			try:
+				request,rxTime=self.requests.get(timeout=min(max(end-time.time(),0.001),0.5));
+			except queue.Empty:
+				continue;
+			#request sent while the boiler was master
+			if (rxTime is not None) and (rxTime < start):
+				self.stats['collisions']+=1;
+				self.logger.debug('Request sent during boiler master phase: '+request.hex());
+				continue;
+			#request is followed by the padding byte sent by DDModbus
+			startTime=max(rxTime if (rxTime is not None) else time.time(),busFreeTime);
+			busFreeTime=startTime+self.timing.bytesTime(len(request)+1);
+			answer=self.answer(request);
+			if answer is None:
+				continue;
+			if (self.random.random() < self.answerLoss):
+				self.stats['lostAnswers']+=1;
+				continue;
+			if (self.random.random() < self.crcErrors):
+				self.stats['crcErrors']+=1;
+				answer=answer[:-1]+bytes((answer[-1] ^ 0xFF,));
+			busFreeTime=self.busSend(answer,busFreeTime+self.timing.turnaround);
+
+	#regulator answer to a request, None if the request is not for a simulated regulator
+	def answer(self,request):
+		registers=self.maps.get(request[0]);
+		if registers is None:
+			return None;
+		feature=request[1];
+		regAddress=0x100*request[2]+request[3];
+		regNb=0x100*request[4]+request[5];
+		if (feature==DDModbus.DDModbus.READ_ANALOG_HOLDING_REGISTERS) and (len(request)==8):
+			self.stats['reads']+=1;
+			if (regNb==0) or (regNb > self.MAX_READ_NB):
+				return self.exception(request,self.ILLEGAL_DATA_VALUE);
+			if (regAddress+regNb > self.REGISTER_NB):
+				return self.exception(request,self.ILLEGAL_DATA_ADDRESS);
+			answer=bytearray((request[0],feature,2*regNb));
+			for reg in range(regAddress,regAddress+regNb):
+				value=registers.get(reg,0);
+				answer.append((value>>8) & 0xFF);
+				answer.append(value & 0xFF);
+			return self.withCrc(answer);
+		if (feature==DDModbus.DDModbus.WRITE_MULTIPLE_REGISTERS) and (len(request)==9+2*regNb):
+			self.stats['writes']+=1;
+			if (regAddress+regNb > self.REGISTER_NB):
+				return self.exception(request,self.ILLEGAL_DATA_ADDRESS);
+			for i in range(regNb):
+				registers[regAddress+i]=0x100*request[7+2*i]+request[8+2*i];
+			if any(regAddress <= reg < regAddress+regNb for reg in CLOCK_REGISTERS):
+				self.setClock(registers);
+			self.logger.debug('Registers written: '+str(regAddress)+' nb: '+str(regNb));
+			return self.withCrc(request[0:6]);
+		return None;
+
+	def exception(self,request,code):
+		self.stats['exceptions']+=1;
+		return self.withCrc((request[0],request[1] | 0x80,code));
+
+	def withCrc(self,frame):
+		frame=bytearray(frame);
+		crc=DDModbus.calc_crc(frame);
+		frame.append(crc & 0xFF);
+		frame.append((crc>>8) & 0xFF);
+		return bytes(frame);
+
+	#clock registers of all regulators from local time and clock offset
+	def updateClock(self):
+		now=datetime.datetime.fromtimestamp(time.time()+self.clockOffset);
+		for registers in self.maps.values():
+			registers.update({DDREGISTER.HEURE.value:now.hour,DDREGISTER.MINUTE.value:now.minute,DDREGISTER.JOUR_SEMAINE.value:now.isoweekday(),
+				DDREGISTER.JOUR.value:now.day,DDREGISTER.MOIS.value:now.month,DDREGISTER.ANNEE.value:now.year % 100});
+
+	#clock set by a write, the new offset is kept for next cycles
+	def setClock(self,registers):
+		try:
+			clock=datetime.datetime(2000+registers[DDREGISTER.ANNEE],registers[DDREGISTER.MOIS],registers[DDREGISTER.JOUR],registers[DDREGISTER.HEURE],registers[DDREGISTER.MINUTE]);
+		except (KeyError,ValueError):
+			return;
+		self.clockOffset=clock.timestamp()-time.time();
+		self.logger.info('Clock set to: '+clock.isoformat());
+
+if __name__ == '__main__':
+	parser=argparse.ArgumentParser(description='Diematic boiler simulator behind a RS485/TCP converter');
+	parser.add_argument('-p','--port',type=int,default=20108);
+	parser.add_argument('-a','--address',default='0x0A',help='regulator modbus addresses, comma separated');
+	parser.add_argument('-r','--registers',help='file with a [Registers] section of register values');
+	parser.add_argument('-b','--baudrate',type=int,default=DDPlanner.BusTiming.BAUDRATE);
+	parser.add_argument('--answer-loss',type=float,default=0,help='probability of a missing answer');
+	parser.add_argument('--crc-errors',type=float,default=0,help='probability of an answer with a CRC error');
+	parser.add_argument('-v','--verbose',action='store_true');
+	args=parser.parse_args();
+	logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO,format='%(asctime)s %(levelname)s %(message)s');
+
+	simulator=DiematicSimulator(args.port,'',[int(address,0) for address in args.address.split(',')],
+		readRegisters(args.registers) if args.registers else None,DDPlanner.BusTiming(baudrate=args.baudrate,latency=0));
+	simulator.answerLoss=args.answer_loss;
+	simulator.crcErrors=args.crc_errors;
+	simulator.start();
+	try:
+		while True:
+			time.sleep(60);
+			logging.info('Stats: '+str(simulator.stats));
+	except KeyboardInterrupt:
+		simulator.stop();
+		logging.info('Stats: '+str(simulator.stats));
@@ -0,0 +1,455 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import asyncio
+import logging
+import time
+import threading
+import DDModbus
+from enum import IntEnum
+
+#definition of master window job priorities, lowest value first
+class Priority(IntEnum):
+	WRITE=0;
+	READBACK=1;
+	POLL=2;
+	#register scan, done in the time left by other jobs
+	SCAN=3;
+
+#class used to define a job executed on the bus during a master window
+#callback is called with the job and its result once executed, owner is the regulator panel which submitted it
+#queue time is the time of the request at the origin of the job, its submission time by default
+#a job made of several steps stays queued until it is finished, its next step being executed from ready time
+class Job:
+	def __init__(self,priority,callback=None):
+		self.priority=priority;
+		self.callback=callback;
+		self.owner=None;
+		self.queueTime=None;
+		self.readyTime=0;
+		self.started=False;
+
+	def finished(self):
+		return True;
+
+	#expected duration of the steps following the current one
+	def remaining(self,timing):
+		return 0;
+
+	#expected duration in seconds
+	def estimate(self,timing):
+		return 0;
+
+	#wire time in seconds, excluding regulator turnaround and converter latency
+	def wireTime(self,timing):
+		return None;
+
+	def execute(self,bus):
+		return None;
+
+	#execution with an asyncio bus
+	async def aexecute(self,bus):
+		return self.execute(bus);
+
+#READ_ANALOG_HOLDING_REGISTERS transaction, result is the register dict or None
+class ReadTransaction(Job):
+	def __init__(self,modbusAddress,regAddress,regNb,priority=Priority.POLL,callback=None):
+		Job.__init__(self,priority,callback);
+		self.modbusAddress=modbusAddress;
+		self.regAddress=regAddress;
+		self.regNb=regNb;
+		#transaction outcome once executed: ok, exception, timeout, crc_error...
+		self.outcome=None;
+
+	def estimate(self,timing):
+		return timing.readTime(self.regNb);
+
+	def wireTime(self,timing):
+		return timing.readTime(self.regNb)-timing.turnaround-timing.latency;
+
+	def execute(self,bus):
+		result=bus.masterReadAnalog(self.modbusAddress,self.regAddress,self.regNb);
+		self.outcome=bus.lastOutcome;
+		return result;
+
+	async def aexecute(self,bus):
+		result=await bus.masterReadAnalog(self.modbusAddress,self.regAddress,self.regNb);
+		self.outcome=bus.lastOutcome;
+		return result;
+
+	def __str__(self):
+		return('Read:'+str(self.regAddress)+' nb: '+str(self.regNb));
+
+#WRITE_MULTIPLE_REGISTERS transaction, result is True if acknowledged
+class WriteTransaction(Job):
+	def __init__(self,modbusAddress,regAddress,data,priority=Priority.WRITE,callback=None):
+		Job.__init__(self,priority,callback);
+		self.modbusAddress=modbusAddress;
+		self.regAddress=regAddress;
+		self.data=data;
+
+	def estimate(self,timing):
+		return timing.writeTime(len(self.data));
+
+	def wireTime(self,timing):
+		return timing.writeTime(len(self.data))-timing.turnaround-timing.latency;
+
+	def execute(self,bus):
+		return bus.masterWriteAnalog(self.modbusAddress,self.regAddress,self.data);
+
+	async def aexecute(self,bus):
+		return await bus.masterWriteAnalog(self.modbusAddress,self.regAddress,self.data);
+
+	def __str__(self):
+		return('Write:'+str(self.regAddress)+' data: '+str(self.data));
+
+#definition of sequence steps, functions are called with the context of the sequence when the step is reached
+#write of registers, value is a register list or a function giving it, None to skip the write
+class WriteStep:
+	def __init__(self,modbusAddress,regAddress,value):
+		self.modbusAddress=modbusAddress;
+		self.regAddress=regAddress;
+		self.value=value;
+
+	def job(self,context):
+		data=self.value(context) if callable(self.value) else self.value;
+		return WriteTransaction(self.modbusAddress,self.regAddress,data) if (data is not None) else None;
+
+	def estimate(self,timing):
+		return timing.writeTime(1 if callable(self.value) else len(self.value));
+
+#read of registers, result is saved in the context with key, sequence is aborted if a required read fails
+class ReadStep:
+	def __init__(self,modbusAddress,regAddress,regNb,key=None,required=True):
+		self.modbusAddress=modbusAddress;
+		self.regAddress=regAddress;
+		self.regNb=regNb;
+		self.key=key;
+		self.required=required;
+
+	def job(self,context):
+		return ReadTransaction(self.modbusAddress,self.regAddress,self.regNb);
+
+	def estimate(self,timing):
+		return timing.readTime(self.regNb);
+
+#wait before next step, the bus is used by other jobs meanwhile
+class DelayStep:
+	def __init__(self,duration):
+		self.duration=duration;
+
+	def estimate(self,timing):
+		return self.duration;
+
+#steps run only if predicate is true, else steps otherwise
+class ConditionStep:
+	def __init__(self,predicate,steps,elseSteps=()):
+		self.predicate=predicate;
+		self.steps=list(steps);
+		self.elseSteps=list(elseSteps);
+
+	def estimate(self,timing):
+		return max(sum(step.estimate(timing) for step in self.steps),sum(step.estimate(timing) for step in self.elseSteps));
+
+#function called without bus exchange, typically to compute values used by next steps
+class CallStep:
+	def __init__(self,function):
+		self.function=function;
+
+	def estimate(self,timing):
+		return 0;
+
+#several bus exchanges described by a list of steps, executed one step at a time
+#other jobs are executed during delays, steps which don't use the bus are run as soon as the previous bus step is done
+#callback is called once the sequence is finished, read results being in its context, aborted flag being set if a required read failed
+class Sequence(Job):
+	def __init__(self,name,steps,priority=Priority.WRITE,callback=None):
+		Job.__init__(self,priority,callback);
+		self.name=name;
+		self.steps=list(steps);
+		self.context=dict();
+		self.aborted=False;
+		#bus step to execute, the previous one, and the time from which the current one can be executed
+		self.step=None;
+		self.current=None;
+		self.previous=None;
+		self.advance();
+
+	#run steps until the next bus step
+	def advance(self):
+		self.step=None;
+		self.current=None;
+		while (self.current is None) and (len(self.steps)!=0):
+			step=self.steps.pop(0);
+			if isinstance(step,DelayStep):
+				self.readyTime=time.time()+step.duration;
+			elif isinstance(step,ConditionStep):
+				self.steps[0:0]=step.steps if step.predicate(self.context) else step.elseSteps;
+			elif isinstance(step,CallStep):
+				step.function(self.context);
+			else:
+				self.step=step;
+				self.current=step.job(self.context);
+
+	def finished(self):
+		return (self.current is None);
+
+	#duration of the whole sequence before its start, of the current step after
+	def estimate(self,timing):
+		if self.current is None:
+			return 0;
+		if not self.started:
+			return self.current.estimate(timing)+self.remaining(timing);
+		return self.current.estimate(timing);
+
+	#expected duration of the steps following the current one
+	def remaining(self,timing):
+		return sum(step.estimate(timing) for step in self.steps);
+
+	def wireTime(self,timing):
+		return self.previous.wireTime(timing) if (self.previous is not None) else None;
+
+	def result(self,result):
+		self.previous=self.current;
+		if isinstance(self.step,ReadStep):
+			if (self.step.key is not None):
+				self.context[self.step.key]=result;
+			if (result is None) and self.step.required:
+				self.abort();
+				return None;
+		self.advance();
+		return result;
+
+	def abort(self):
+		self.aborted=True;
+		self.steps=list();
+		self.step=None;
+		self.current=None;
+
+	def execute(self,bus):
+		return self.result(self.current.execute(bus));
+
+	async def aexecute(self,bus):
+		return self.result(await self.current.aexecute(bus));
+
+	def __str__(self):
+		return('Sequence:'+self.name+' '+str(self.current));
+
+#class used to pack prioritized jobs in the time budget of the boiler slave window
+#jobs which don't fit in the remaining time are carried over to the next window
+#jobs of a same priority are shared fairly between owners : the owner with the lowest bus time in the window goes first
+class WindowExecutor:
+	#duration of the boiler slave phase
+	WINDOW_DURATION=5.0;
+	#time kept free at the end of the window, boiler master phase must not be disturbed
+	WINDOW_MARGIN=0.3;
+	#weight of last measure in converter latency estimation
+	LATENCY_FILTER=0.2;
+
+	def __init__(self,timing,bus=None):
+		#logger
+		self.logger = logging.getLogger(__name__);
+		self.timing=timing;
+		self.bus=bus;
+		self.jobs=list();
+		#start and end of current window
+		self.windowStart=0;
+		self.windowEnd=self.WINDOW_DURATION;
+		#time used by jobs in current window, in total and by owner
+		self.busyTime=0;
+		self.ownerTime=dict();
+
+	def submit(self,job,owner=None):
+		job.owner=owner;
+		if job.queueTime is None:
+			job.queueTime=time.time();
+		self.jobs.append(job);
+
+	#remove pending jobs of a priority, typically polls which are rebuilt in each window
+	def discard(self,priority,owner=None):
+		self.jobs=[job for job in self.jobs if (job.priority!=priority) or ((owner is not None) and (job.owner is not owner))];
+
+	def pending(self,priority=None,owner=None):
+		return [job for job in self.jobs if ((priority is None) or (job.priority==priority)) and ((owner is None) or (job.owner is owner))];
+
+	#remaining time in the window
+	def remaining(self,now=None):
+		if now is None:
+			now=time.time();
+		return self.windowEnd-self.WINDOW_MARGIN-now;
+
+	#window end is the predicted start of the next boiler master phase, if known
+	def begin(self,windowStart,windowEnd=None):
+		self.windowStart=windowStart;
+		self.windowEnd=windowEnd if (windowEnd is not None) else windowStart+self.WINDOW_DURATION;
+		self.busyTime=0;
+		self.ownerTime=dict();
+
+	#highest priority ready job fitting in the remaining time, owner with the lowest bus time first, then first submitted first
+	#time needed by the started sequences to finish is kept, jobs are run during their delays
+	def nextJob(self,now=None):
+		if now is None:
+			now=time.time();
+		remaining=self.remaining(now);
+		started=[job for job in self.jobs if job.started];
+		wait=max([job.readyTime-now for job in started]+[0]);
+		reserved=sum(job.estimate(self.timing)+job.remaining(self.timing) for job in started);
+		for job in sorted(self.jobs,key=lambda job: (job.priority,self.ownerTime.get(job.owner,0))):
+			if (job.readyTime > now):
+				continue;
+			if job.started:
+				if (job.estimate(self.timing) <= remaining):
+					return job;
+			#a job longer than the whole window is run alone in a window
+			elif (max(job.estimate(self.timing),wait)+reserved <= remaining) or ((self.busyTime==0) and (remaining > 0)):
+				return job;
+		return None;
+
+	#time until a started sequence can go on in the window, None if there's none
+	def nextReadyTime(self,now=None):
+		if now is None:
+			now=time.time();
+		times=[job.readyTime for job in self.jobs if job.started and (job.readyTime > now) and (job.readyTime+job.estimate(self.timing) <= self.windowEnd-self.WINDOW_MARGIN)];
+		return min(times) if (len(times)!=0) else None;
+
+	#job or job step executed, converter latency estimation update and callback once the job is finished
+	def done(self,job,result,duration):
+		if (not job.started) and (job.priority==Priority.WRITE) and (job.owner is not None) and (job.owner.metrics is not None):
+			job.owner.metrics.jobWait(time.time()-duration-job.queueTime);
+		job.started=True;
+		self.busyTime+=duration;
+		self.ownerTime[job.owner]=self.ownerTime.get(job.owner,0)+duration;
+		wireTime=job.wireTime(self.timing);
+		if (wireTime is not None) and result:
+			latency=max(duration-wireTime-self.timing.turnaround,0);
+			self.timing.latency+=self.LATENCY_FILTER*(latency-self.timing.latency);
+		if job.finished():
+			self.jobs.remove(job);
+			if job.callback is not None:
+				job.callback(job,result);
+
+	#execute jobs while they fit in the window, bus is left idle only when sequences wait and no other job can run
+	def run(self):
+		while True:
+			job=self.nextJob();
+			if job is None:
+				readyTime=self.nextReadyTime();
+				if readyTime is None:
+					break;
+				time.sleep(max(readyTime-time.time(),0));
+				continue;
+			self.logger.debug('Window job: '+str(job)+' remaining time: '+f"{self.remaining():.3f}"+'s');
+			start=time.time();
+			result=job.execute(self.bus);
+			self.done(job,result,time.time()-start);
+		if (len(self.jobs)!=0):
+			self.logger.debug(str(len(self.jobs))+' job(s) carried over to next window');
+
+	#execute jobs while they fit in the window, with an asyncio bus
+	async def arun(self):
+		while True:
+			job=self.nextJob();
+			if job is None:
+				readyTime=self.nextReadyTime();
+				if readyTime is None:
+					break;
+				await asyncio.sleep(max(readyTime-time.time(),0));
+				continue;
+			self.logger.debug('Window job: '+str(job)+' remaining time: '+f"{self.remaining():.3f}"+'s');
+			start=time.time();
+			result=await job.aexecute(self.bus);
+			self.done(job,result,time.time()-start);
+		if (len(self.jobs)!=0):
+			self.logger.debug(str(len(self.jobs))+' job(s) carried over to next window');
+
+	#window usage ratio
+	def utilization(self):
+		return self.busyTime/max(self.windowEnd-self.windowStart-self.WINDOW_MARGIN,self.WINDOW_MARGIN);
+
+#class used to keep only the last requested value, for mode requests
+class PendingValue:
+	def __init__(self):
+		self.lock=threading.Lock();
+		self.value=None;
+		#time of the first request not yet processed
+		self.requestTime=None;
+	
+	def put(self,value):
+		with self.lock:
+			if self.value is None:
+				self.requestTime=time.time();
+			self.value=value;
+	
+	def empty(self):
+		return self.value is None;
+	
+	#get and clear the requested value
+	def get(self):
+		with self.lock:
+			value=self.value;
+			self.value=None;
+			self.requestTime=None;
+			return value;
+
+#time of the oldest request among pending values, None if there's no pending request
+def requestTime(*pendingValues):
+	times=[pendingValue.requestTime for pendingValue in pendingValues if pendingValue.requestTime is not None];
+	return min(times) if (len(times)!=0) else None;
+
+#class used to merge pending register writes
+#the last requested value of a register wins, adjacent registers of the same request are written with a single request
+#registers of independent requests are never merged, a rejected write only fails its own request
+class WriteCoalescer:
+	#biggest register number written by a single request
+	MAX_REG_NB=32;
+	
+	def __init__(self):
+		self.lock=threading.Lock();
+		#pending value of each register, time of its first pending request and number of the request giving its value
+		self.registers=dict();
+		self.requestTimes=dict();
+		self.requests=dict();
+		self.requestNb=0;
+	
+	#request write of a register set
+	def put(self,regSet):
+		with self.lock:
+			now=time.time();
+			self.requestNb+=1;
+			for i,value in enumerate(regSet.data):
+				self.registers[regSet.address+i]=value;
+				self.requestTimes.setdefault(regSet.address+i,now);
+				self.requests[regSet.address+i]=self.requestNb;
+	
+	#give back a register set not written yet, registers requested since then keep their new value
+	def restore(self,regSet):
+		with self.lock:
+			requestTime=regSet.requestTime if (regSet.requestTime is not None) else time.time();
+			self.requestNb+=1;
+			for i,value in enumerate(regSet.data):
+				if (regSet.address+i) not in self.registers:
+					self.registers[regSet.address+i]=value;
+					self.requests[regSet.address+i]=self.requestNb;
+				self.requestTimes[regSet.address+i]=min(self.requestTimes.get(regSet.address+i,requestTime),requestTime);
+	
+	def empty(self):
+		return len(self.registers)==0;
+	
+	#get and clear pending writes as register sets of adjacent registers of the same request, with the time of their oldest request
+	def pop(self):
+		with self.lock:
+			registers=self.registers;
+			requestTimes=self.requestTimes;
+			requests=self.requests;
+			self.registers=dict();
+			self.requestTimes=dict();
+			self.requests=dict();
+		regSets=list();
+		for address in sorted(registers):
+			last=regSets[-1] if (len(regSets)!=0) else None;
+			if (last is not None) and (address==last.address+len(last.data)) and (requests[address]==requests[last.address]) and (len(last.data) < self.MAX_REG_NB):
+				last.data.append(registers[address]);
+				last.requestTime=min(last.requestTime,requestTimes[address]);
+			else:
+				regSets.append(DDModbus.RegisterSet(address,[registers[address]]));
+				regSets[-1].requestTime=requestTimes[address];
+		return regSets;
@@ -1,246 +1,465 @@
 ﻿#!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-import sys,signal,threading
+import os,sys,signal,threading,asyncio,argparse
 import configparser
 import logging, logging.config
-import DDModbus,Diematic3Panel,Hassio
+import DDModbus,DDPlanner,DDMetrics,DDHistory,DDScan,Diematic3Panel,Hassio
 import paho.mqtt.client as mqtt
 import json
-import time,datetime
-
+import time,datetime,math
+
+#class used to define the publishing policy of a topic
+#numeric changes within the absolute or relative deadband are not published, nor changes published before minInterval
+#the last value is published again if nothing has been published during heartbeat
+class PublishPolicy:
+	#float comparison tolerance
+	EPSILON=1e-9;
+	
+	def __init__(self,deadband=None,relativeDeadband=None,minInterval=0,heartbeat=None):
+		self.deadband=deadband;
+		self.relativeDeadband=relativeDeadband;
+		self.minInterval=minInterval;
+		self.heartbeat=heartbeat;
+	
+	#policy from a configuration value like: deadband=0.5 minInterval=30 heartbeat=900
+	@staticmethod
+	def parse(text):
+		parameters=dict();
+		for item in text.split():
+			name,value=item.split('=');
+			parameters[name]=float(value);
+		return PublishPolicy(**parameters);
+	
+	#check that value change from previously published value is bigger than deadbands
+	def significant(self,previous,value):
+		if previous is None:
+			return True;
+		try:
+			delta=abs(float(value)-float(previous));
+		except ValueError:
+			#not numeric values, like unavailable ones
+			return True;
+		if (self.deadband is not None) and (delta <= self.deadband+self.EPSILON):
+			return False;
+		if (self.relativeDeadband is not None) and (delta <= self.relativeDeadband*abs(float(previous))+self.EPSILON):
+			return False;
+		return True;
+
+#class used to publish retained values, only changed values are published according the policy of their topic
+#publication statistics of the last send are kept : message number, bytes and duration
 class MessageBuffer:
-	def __init__(self,mqtt):
+	def __init__(self,mqtt,topicPrefix,policies=None):
 		#logger
 		self.logger = logging.getLogger(__name__);
 		
-		self.buffer=dict();
 		self.mqtt=mqtt;
+		self.topicPrefix=topicPrefix;
+		#publishing policy by topic, topics are case insensitive as configuration options
+		self.policies={topic.lower():policy for topic,policy in (policies or dict()).items()};
+		#value and full topic of each topic
+		self.values=dict();
+		self.fullTopics=dict();
+		#last published value and time of each topic
+		self.published=dict();
+		#topics to be published
+		self.dirty=set();
+		
+		#statistics of last send
+		self.messages=0;
+		self.bytes=0;
+		self.duration=0;
+		#statistics since start
+		self.totalMessages=0;
+		self.totalBytes=0;
 	
 	#clear buffer
 	def clear(self):
-		self.buffer=dict();
-		
+		self.values=dict();
+		self.published=dict();
+		self.dirty=set();
+	
 	#update or create a message in the buffer
 	def update(self,topic,value):
-		#if the topic is not in buffer
-		if ((topic not in self.buffer) or (self.buffer[topic]['value']!=value)):
-			self.buffer[topic]={'value':value,'update':True};
-			
-	#publish buffer content to MQTT broker	
+		#if the topic is not in buffer or its value changed
+		if (self.values.get(topic)!=value):
+			self.values[topic]=value;
+			if topic not in self.fullTopics:
+				#full topic without trailing /
+				self.fullTopics[topic]=(self.topicPrefix+'/'+topic) if (topic!='') else self.topicPrefix;
+			policy=self.policies.get(topic.lower());
+			previous=self.published.get(topic);
+			if (policy is None) or (previous is None) or policy.significant(previous[0],value):
+				self.dirty.add(topic);
+	
+	#publish changed messages to MQTT broker
 	def send(self):
-		#for each topic
-		for topic in self.buffer:
-			if self.buffer[topic]['update']:
-				#send message without trailing / on topic
-				if (topic!=''):
-					self.mqtt.publish(mqttTopicPrefix+'/'+topic,self.buffer[topic]['value'],1,True);
-					self.logger.info('Publish :'+mqttTopicPrefix+'/'+topic+' '+self.buffer[topic]['value'])
-				else:
-					self.mqtt.publish(mqttTopicPrefix,self.buffer[topic]['value'],1,True);
-					self.logger.info('Publish :'+mqttTopicPrefix+' '+self.buffer[topic]['value'])
-				#set the flag to False
-				self.buffer[topic]['update']=False;
+		start=time.time();
+		dirty=self.dirty;
+		#last values of silent topics are published again
+		for topic,(value,publishTime) in self.published.items():
+			policy=self.policies.get(topic.lower());
+			if (policy is not None) and (policy.heartbeat is not None) and (start-publishTime >= policy.heartbeat):
+				dirty.add(topic);
+		if (len(dirty)==0):
+			return;
+		self.dirty=set();
+		debug=self.logger.isEnabledFor(logging.DEBUG);
+		messages=0;
+		size=0;
+		for topic in dirty:
+			value=self.values[topic];
+			previous=self.published.get(topic);
+			policy=self.policies.get(topic.lower());
+			#changes published too early are kept for next send
+			if (policy is not None) and (previous is not None) and (start-previous[1] < policy.minInterval):
+				self.dirty.add(topic);
+				continue;
+			fullTopic=self.fullTopics[topic];
+			self.mqtt.publish(fullTopic,value,1,True);
+			self.published[topic]=(value,start);
+			messages+=1;
+			size+=len(fullTopic.encode())+len(value.encode());
+			if debug:
+				self.logger.debug('Publish :'+fullTopic+' '+value);
+		self.messages=messages;
+		self.bytes=size;
+		self.duration=time.time()-start;
+		self.totalMessages+=messages;
+		self.totalBytes+=size;
+		if (messages!=0):
+			self.logger.info('Published '+str(messages)+' message(s), '+str(size)+' bytes in '+f"{self.duration*1000:.1f}"+'ms');
 	
 	
-def diematic3Publish(self):
-	def floatValue(parameter):
-		return (f"{parameter:.1f}" if parameter is not None else '');
-	def intValue(parameter):
-		return (f"{parameter:d}" if parameter is not None else '');
+#formatting of published values
+def floatValue(parameter):
+	return (f"{parameter:.1f}" if parameter is not None else '');
+def intValue(parameter):
+	return (f"{parameter:d}" if parameter is not None else '');
+def textValue(parameter):
+	return (parameter if parameter is not None else '');
+def dateValue(parameter):
+	return (parameter.isoformat() if parameter is not None else '');
+def jsonValue(parameter):
+	return (json.dumps(parameter) if parameter is not None else '');
+def statusValue(parameter):
+	return ('Online' if parameter else 'Offline');
+
+#formatting of each value format of the schema
+FORMATS={'float':floatValue,'int':intValue,'text':textValue,'date':dateValue,'json':jsonValue,'status':statusValue};
+
+#topic of each published attribute of the schema, its formatting, and its section and key in JSON documents
+ATTRIBUTE_TOPICS={attribute.name:(attribute.topic,FORMATS[attribute.format],attribute.section,attribute.key) for attribute in Diematic3Panel.SCHEMA if attribute.topic is not None};
+
+#writable attribute of each command topic
+COMMAND_TOPICS={'/'+attribute.topic+'/set':attribute for attribute in Diematic3Panel.SCHEMA.writable};
+
+#bus cycle attributes don't depend on registers, they are updated with each publication
+CYCLE_ATTRIBUTES={'cyclePeriod','windowGain'};
+
+#JSON document topic and key of each topic published in a section document, used by Home Assistant discovery
+JSON_STATES={topic:(section+'/state',key) for topic,formatValue,section,key in ATTRIBUTE_TOPICS.values() if section is not None};
+
+#numeric attributes saved in the history, except boiler identity, channels are named by their topic
+HISTORY_CHANNELS={attribute.topic:attribute.name for attribute in Diematic3Panel.SCHEMA if (attribute.topic is not None) and (attribute.format in ('float','int')) and attribute.history};
+
+#value of an attribute in a JSON document
+def documentValue(parameter):
+	if isinstance(parameter,float):
+		return round(parameter,1);
+	if isinstance(parameter,datetime.datetime):
+		return parameter.isoformat();
+	return parameter;
+
+#class used to bind a boiler panel to its MQTT topics
+#several gateways can share the MQTT client, each one with its own topic root
+class Gateway:
+	def __init__(self,name,panel,client,topicPrefix,clientId,publishTopics,publishJson,publishPolicies,hassioDiscoveryPrefix):
+		#logger
+		self.logger = logging.getLogger(__name__+'.'+name);
 		
-	#boiler
-	buffer.update('status','Online' if self.availability else 'Offline');
-	buffer.update('date',self.datetime.isoformat() if self.datetime is not None else '');
-	buffer.update('lastTimeSync',self.lastTimeSync.isoformat() if self.lastTimeSync is not None else '');
-	buffer.update('type',intValue(self.type));
-	buffer.update('ctrl',intValue(self.release));
-	buffer.update('ext/temp',floatValue(self.extTemp));
-	buffer.update('temp',floatValue(self.temp));
-	buffer.update('targetTemp',floatValue(self.targetTemp));
-	buffer.update('returnTemp',floatValue(self.returnTemp));
-	buffer.update('waterPressure',floatValue(self.waterPressure));
-	buffer.update('power',intValue(self.burnerPower));
-	buffer.update('smokeTemp',floatValue(self.smokeTemp));
-	buffer.update('ionizationCurrent',floatValue(self.ionizationCurrent));
-	buffer.update('fanSpeed',intValue(self.fanSpeed));
-	buffer.update('burnerStatus',intValue(self.burnerStatus));
-	buffer.update('pumpPower',intValue(self.pumpPower));
-	buffer.update('alarm',json.dumps(self.alarm) if self.alarm is not None else '');
-	
-	#hotwater
-	buffer.update('hotWater/pump',intValue(self.hotWaterPump));
-	buffer.update('hotWater/temp',floatValue(self.hotWaterTemp));
-	buffer.update('hotWater/mode',self.hotWaterMode if self.hotWaterMode is not None else '');
-	buffer.update('hotWater/dayTemp',floatValue(self.hotWaterDayTargetTemp));
-	buffer.update('hotWater/nightTemp',floatValue(self.hotWaterNightTargetTemp));
-	
-	#area A
-	buffer.update('zoneA/temp',floatValue(self.zoneATemp));
-	buffer.update('zoneA/mode',self.zoneAMode if self.zoneAMode is not None else '');
-	buffer.update('zoneA/pump',intValue(self.zoneAPump));
-	buffer.update('zoneA/dayTemp',floatValue(self.zoneADayTargetTemp));
-	buffer.update('zoneA/nightTemp',floatValue(self.zoneANightTargetTemp));
-	buffer.update('zoneA/antiiceTemp',floatValue(self.zoneAAntiiceTargetTemp));
-
-	#area B
-	buffer.update('zoneB/temp',floatValue(self.zoneBTemp));
-	buffer.update('zoneB/mode',self.zoneBMode if self.zoneBMode is not None else '');
-	buffer.update('zoneB/pump',intValue(self.zoneBPump));
-	buffer.update('zoneB/dayTemp',floatValue(self.zoneBDayTargetTemp));
-	buffer.update('zoneB/nightTemp',floatValue(self.zoneBNightTargetTemp));
-	buffer.update('zoneB/antiiceTemp',floatValue(self.zoneBAntiiceTargetTemp));
-	
-	#send MQTT messages
-	buffer.send();
-
-def haSendDiscoveryMessages(client, userdata, message):
-	if (message.payload.decode()=='online'):
-		logger.info('Sending HA discovery messages');
+		self.name=name;
+		self.panel=panel;
+		self.client=client;
+		self.topicPrefix=topicPrefix;
+		self.publishTopics=publishTopics;
+		self.publishJson=publishJson;
 		
-		#boiler
-		hassio.addSensor('heater_datetime',"Horloge Chaudière",None,'date',"{{ as_timestamp(value) |timestamp_custom ('%d/%m/%Y %H:%M') }}",None);
-		hassio.addSwitch('heater_datetime_set',"Synchro Horloge",'unknown','date/set','--','Now');
-		hassio.addSensor('type',"Type",None,'type',None,None);
-		hassio.addSensor('ctrl',"Controleur",None,'ctrl',None,None);
-		hassio.addSensor('ext_temp',"Température Extérieure",'temperature','ext/temp',None,"°C");
-		hassio.addSensor('boiler_temp',"Température Chaudière",'temperature','temp',None,"°C");	
-		hassio.addSensor('target_temp',"Température Cible",'temperature','targetTemp',None,"°C");
-		hassio.addSensor('return_temp',"Température Retour",'temperature','returnTemp',None,"°C");
-		hassio.addSensor('water_pressure',"Pression d'eau",'pressure','waterPressure',None,"bar");
-		hassio.addSensor('power',"Puissance",'power_factor','power',None,"%");
-		hassio.addSensor('smoke_temp',"Température Fumées",'temperature','smokeTemp',None,"°C");
-		hassio.addSensor('ionization_current',"Courant Ionisation",'current','ionizationCurrent',None,"µA");	
-		hassio.addSensor('fan_speed',"Vitesse Ventilateur",None,'fanSpeed',None,"RPM");	
-		hassio.addBinarySensor('burner_status',"Etat Bruleur",None,'burnerStatus',"1","0");	
-		hassio.addSensor('pump_power',"Puissance Pompe",'power_factor','pumpPower',None,"%");
-		hassio.addSensor('alarm',"Etat",None,'alarm',"{{ value_json.txt}}",None);
-		hassio.addSensor('alarm_id',"N° Erreur",None,'alarm',"{{ value_json.id}}",None);
+		#mqtt message buffer
+		self.buffer=MessageBuffer(client,topicPrefix,publishPolicies);
 		
-		#hot water
-		hassio.addBinarySensor('hot_water_pump',"Pompe ECS",None,'hotWater/pump',"1","0");	
-		hassio.addSensor('hot_water_temp',"Température ECS",'temperature','hotWater/temp',None,"°C");
-		hassio.addSelect('hot_water_mode',"Mode ECS",'hotWater/mode','hotWater/mode/set',['AUTO','TEMP','PERM']);
-		hassio.addSensor('hot_water_mode',"Mode ECS",None,'hotWater/mode',None,None);
-		hassio.addNumber('hot_water_temp_day',"Température ECS Jour",'hotWater/dayTemp','hotWater/dayTemp/set',10,80,5,"°C");
-		hassio.addNumber('hot_water_temp_night',"Température ECS Nuit",'hotWater/nightTemp','hotWater/nightTemp/set',10,80,5,"°C");
+		#HomeAssistant discovery instance
+		self.hassio=Hassio.Hassio(client,topicPrefix,clientId,hassioDiscoveryPrefix);
+		self.hassio.availabilityInfo('status','Online','Offline');
+		#with JSON publishing, entities use section documents
+		if publishJson:
+			self.hassio.jsonStates(JSON_STATES);
 		
-		#area A
-		hassio.addSensor('zone_A_temp',"Température Zone A",'temperature','zoneA/temp',None,"°C");
-		hassio.addSelect('zone_A_mode',"Mode Zone A",'zoneA/mode','zoneA/mode/set',['AUTO','TEMP JOUR','PERM JOUR','TEMP NUIT','PERM NUIT','ANTIGEL']);
-		hassio.addSensor('zone_A_mode',"Mode Zone A",None,'zoneA/mode',None,None);
-		hassio.addBinarySensor('zone_A_pump',"Pompe Zone A",None,'zoneA/pump',"1","0");
-		hassio.addNumber('zone_A_temp_day',"Température Jour Zone A",'zoneA/dayTemp','zoneA/dayTemp/set',5,30,0.5,"°C");
-		hassio.addNumber('zone_A_temp_night',"Température Nuit Zone A",'zoneA/nightTemp','zoneA/nightTemp/set',5,30,0.5,"°C");
-		hassio.addNumber('zone_A_temp_antiice',"Température Antigel Zone A",'zoneA/antiiceTemp','zoneA/antiiceTemp/set',5,20,0.5,"°C");
+		#history of panel values, None when disabled
+		self.history=None;
 		
-		#area B
-		hassio.addSensor('zone_B_temp',"Température Zone B",'temperature','zoneB/temp',None,"°C");
-		hassio.addSelect('zone_B_mode',"Mode Zone B",'zoneB/mode','zoneB/mode/set',['AUTO','TEMP JOUR','PERM JOUR','TEMP NUIT','PERM NUIT','ANTIGEL']);
-		hassio.addSensor('zone_B_mode',"Mode Zone B",None,'zoneB/mode',None,None);
-		hassio.addBinarySensor('zone_B_pump',"Pompe Zone B",None,'zoneB/pump',"1","0");
-		hassio.addNumber('zone_B_temp_day',"Température Jour Zone B",'zoneB/dayTemp','zoneB/dayTemp/set',5,30,0.5,"°C");
-		hassio.addNumber('zone_B_temp_night',"Température Nuit Zone B",'zoneB/nightTemp','zoneB/nightTemp/set',5,30,0.5,"°C");
-		hassio.addNumber('zone_B_temp_antiice',"Température Antigel Zone B",'zoneB/antiiceTemp','zoneB/antiiceTemp/set',5,20,0.5,"°C");		
+		#all the attributes are published by the next publication, set once connected to the broker
+		self.publishAll=True;
 		
+		#panel values are published by the gateway
+		panel.updateCallback=self.publish;
 		
+		#control messages
+		client.message_callback_add(topicPrefix+'/+/+/set',self.paramSet);
+		client.message_callback_add(topicPrefix+'/date/set',self.paramSet);
+		client.message_callback_add(topicPrefix+'/scan/set',self.paramSet);
+	
+	#publication of changed attributes, all of them if not given or after a broker connection
+	#attributes are published in their own topic and/or in a JSON document per section, status is always published in its own topic
+	def publish(self,attributes=None):
+		if self.publishAll:
+			self.publishAll=False;
+			attributes=None;
+		attributes=ATTRIBUTE_TOPICS.keys() if (attributes is None) else (attributes | CYCLE_ATTRIBUTES);
+		sections=set();
+		for attribute in attributes:
+			topic,formatValue,section,key=ATTRIBUTE_TOPICS[attribute];
+			if self.publishTopics or (section is None):
+				self.buffer.update(topic,formatValue(getattr(self.panel,attribute)));
+			if self.publishJson and (section is not None):
+				sections.add(section);
+		
+		#JSON document of sections with changed attributes
+		for section in sections:
+			document={key:documentValue(getattr(self.panel,attribute)) for attribute,(topic,formatValue,attributeSection,key) in ATTRIBUTE_TOPICS.items() if attributeSection==section};
+			self.buffer.update(section+'/state',json.dumps(document,separators=(',',':'),ensure_ascii=False));
+		
+		#send MQTT messages
+		self.buffer.send();
 		
+		#history sample of the values, at most one per history period
+		now=time.time();
+		if (self.history is not None) and self.panel.availability and self.history.due(now):
+			self.history.append(now,[getattr(self.panel,attribute) for attribute in HISTORY_CHANNELS.values()]);
 	
-def on_connect(client, userdata, flags, rc):		
-	logger.critical('Connected to MQTT broker');
-	print('Connected to MQTT broker');
-	#subscribe to control messages with Q0s of 2
-	client.subscribe(mqttTopicPrefix+'/+/+/set',2);
-	client.subscribe(mqttTopicPrefix+'/date/set',2);
-	if hassioDiscoveryEnable:
-		client.subscribe(hassioDiscoveryPrefix+'/status',2);
-	#clear buffer and inform client that status is still Offline
-	buffer.clear();
-	buffer.update('status','Offline');
-	buffer.send();
-
+	#enable the history of panel values and its query topic
+	def enableHistory(self,history):
+		self.history=history;
+		self.client.message_callback_add(self.topicPrefix+'/history/get',self.historyGet);
 	
+	#subscription to control messages and status init once connected to the broker
+	def connected(self):
+		#subscribe to control messages with Q0s of 2
+		self.client.subscribe(self.topicPrefix+'/+/+/set',2);
+		self.client.subscribe(self.topicPrefix+'/date/set',2);
+		self.client.subscribe(self.topicPrefix+'/scan/set',2);
+		if (self.history is not None):
+			self.client.subscribe(self.topicPrefix+'/history/get',1);
+		#clear buffer and inform client that status is still Offline
+		self.buffer.clear();
+		self.buffer.update('status','Offline');
+		self.buffer.send();
+		#buffer being cleared, retained values are published again with the next refresh
+		self.publishAll=True;
 	
-def on_disconnect(client, userdata, rc):
-	logger.critical('Diconnected from MQTT broker');
+	#entities of the schema attributes
+	def sendDiscoveryMessages(self):
+		for attribute in Diematic3Panel.SCHEMA:
+			for entity in attribute.entities:
+				self.hassio.addEntity(entity,attribute);
 	
-def modeSet(client, userdata, message):
-	#table for topic to attribute bind
-	table={'/hotWater/mode/set':'hotWaterMode',
-		'/zoneA/mode/set':'zoneAMode',
-		'/zoneB/mode/set':'zoneBMode'};
+	#value change of a writable attribute, modes are given as text and temperatures as numbers
+	def attributeSet(self,client, userdata, message):
+		#remove root of the topic
+		shortTopic=message.topic[len(self.topicPrefix):]
 		
-	#remove root of the topic
-	shortTopic=message.topic[len(mqttTopicPrefix):]
+		attribute=COMMAND_TOPICS[shortTopic];
+		if (attribute.enum is not None):
+			value=message.payload.decode();
+		else:
+			try:
+				value=float(message.payload);
+			except (ValueError,OverflowError):
+				self.logger.warning('Value error :'+str(message.payload));
+				return
+		setattr(self.panel,attribute.name,value);
+		self.logger.info(shortTopic+' : '+str(value));
 	
-	#if topic exist
-	if shortTopic in table:
-		#process it
-		setattr(panel,table[shortTopic],message.payload.decode());
-		logger.info(shortTopic+' : '+str(message.payload));
-	else:
-		logger.warning('Unknown topic : '+shortTopic);
-
-def tempSet(client, userdata, message):	
-	#table for topic to attribute bind
-	table={'/hotWater/dayTemp/set':'hotWaterDayTargetTemp',
-		'/hotWater/nightTemp/set':'hotWaterNightTargetTemp',
-		'/zoneA/dayTemp/set':'zoneADayTargetTemp',
-		'/zoneA/nightTemp/set':'zoneANightTargetTemp',
-		'/zoneA/antiiceTemp/set':'zoneAAntiiceTargetTemp',
-		'/zoneB/dayTemp/set':'zoneBDayTargetTemp',
-		'/zoneB/nightTemp/set':'zoneBNightTargetTemp',
-		'/zoneB/antiiceTemp/set':'zoneBAntiiceTargetTemp'};
+	def dateSet(self,client, userdata, message):
+		#table for topic to attribute bind
+		table={'/date/set':'datetime'};
+			
+		#remove root of the topic
+		shortTopic=message.topic[len(self.topicPrefix):]
 		
-	#remove root of the topic
-	shortTopic=message.topic[len(mqttTopicPrefix):]
+		#if topic exist
+		if shortTopic in table:
+			#process it
+			self.logger.info(shortTopic+' : '+str(message.payload));
+			if (message.payload.decode()=='Now'):
+				setattr(self.panel,table[shortTopic],datetime.datetime.now().astimezone());
+		else:
+			self.logger.warning('Unknown topic : '+shortTopic);
 	
-	try:
-		value=float(message.payload);
-	except (ValueError,OverflowError):
-		logger.warning('Value error :'+str(message.payload));
-		return
+	#register scan of a range (first-last, 0-255 by default) or stop of the current scan, result is saved in clientId.scan
+	def scanSet(self,client, userdata, message):
+		command=message.payload.decode().strip();
+		self.logger.info('/scan/set : '+command);
+		if (command=='stop'):
+			self.panel.stopScan();
+			return;
+		self.startScan(command if (command not in ('','start')) else '0-255');
 	
-	#if topic exist
-	if shortTopic in table:
-		#process it
-		setattr(panel,table[shortTopic],value);
-		logger.info(shortTopic+' : '+str(value));
-	else:
-		logger.warning('Unknown topic : '+shortTopic);
-
-def dateSet(client, userdata, message):
-	#table for topic to attribute bind
-	table={'/date/set':'datetime'};
-		
-	#remove root of the topic
-	shortTopic=message.topic[len(mqttTopicPrefix):]
+	def startScan(self,registerRange):
+		try:
+			first,last=DDScan.parseRange(registerRange);
+		except ValueError as exc:
+			self.logger.warning('Scan range error : '+registerRange);
+			return;
+		self.panel.startScan(first,last,self.name+'.scan');
 	
-	#if topic exist
-	if shortTopic in table:
-		#process it
-		logger.info(shortTopic+' : '+str(message.payload));
-		if (message.payload.decode()=='Now'):
-			setattr(panel,table[shortTopic],datetime.datetime.now().astimezone());
-	else:
-		logger.warning('Unknown topic : '+shortTopic);
+	def paramSet(self,client, userdata, message):
+		try:
+			self.logger.debug('MQTT msg received :'+message.topic+' '+str(message.payload));
+			if (message.topic[len(self.topicPrefix):] in COMMAND_TOPICS):
+				self.attributeSet(client, userdata, message);
+			elif (message.topic[-8:]=='date/set'):
+				self.dateSet(client, userdata, message);
+			elif (message.topic[-8:]=='scan/set'):
+				self.scanSet(client, userdata, message);
+			else:
+				self.logger.warning('Unknown topic : '+message.topic[len(self.topicPrefix):]);
+		except BaseException as exc:	
+			self.logger.exception(exc);
+
+	#history query, JSON payload with optional fields:
+	#from, to: epoch seconds or ISO date, negative values are relative to now (default: last 24h)
+	#step: averaging period in seconds, or points: maximum number of samples
+	#channels: list of topics (default: all), id: copied in the reply, responseTopic: topic of the reply (default: history)
+	def historyGet(self,client, userdata, message):
+		try:
+			request=json.loads(message.payload) if (len(message.payload)!=0) else dict();
+			now=time.time();
+			start=historyTime(request.get('from',-86400),now);
+			end=historyTime(request.get('to',now),now);
+			step=request.get('step');
+			if (step is None) and ('points' in request):
+				step=math.ceil((end-start)/max(int(request['points']),1));
+			times,columns=self.history.query(start,end,step,request.get('channels'));
+		except (ValueError,TypeError,AttributeError) as exc:
+			self.logger.warning('History request error: '+str(exc)+' '+str(message.payload));
+			client.publish(self.topicPrefix+'/history',json.dumps({'error':str(exc)}),1);
+			return;
+		reply={'from':start,'to':end,'step':step,'time':times,
+			'values':{channel:[(round(value,2) if not math.isnan(value) else None) for value in column] for channel,column in columns.items()}};
+		if ('id' in request):
+			reply['id']=request['id'];
+		client.publish(request.get('responseTopic',self.topicPrefix+'/history'),json.dumps(reply,separators=(',',':')),1);
+		self.logger.info('History reply: '+str(len(times))+' samples');
+
+#time of a history request, epoch seconds or ISO date, negative values being relative to now
+def historyTime(value,now):
+	if isinstance(value,str):
+		return int(datetime.datetime.fromisoformat(value).astimezone().timestamp());
+	return int(now+value) if (value < 0) else int(value);
 
-def paramSet(client, userdata, message):
-	try:
-		logger.debug('MQTT msg received :'+message.topic+' '+str(message.payload));
-		if (message.topic[-8:]=='Temp/set'):
-			tempSet(client, userdata, message);
-		elif (message.topic[-8:]=='mode/set'):
-			modeSet(client, userdata, message);
-		elif (message.topic[-8:]=='date/set'):
-			dateSet(client, userdata, message);
-	except BaseException as exc:	
-		logger.exception(exc);
+def haSendDiscoveryMessages(client, userdata, message):
+	if (message.payload.decode()=='online'):
+		logger.info('Sending HA discovery messages');
+		for gateway in gateways:
+			gateway.sendDiscoveryMessages();
+	
+def on_connect(client, userdata, flags, rc):		
+	logger.critical('Connected to MQTT broker');
+	print('Connected to MQTT broker');
+	if hassioDiscoveryEnable:
+		client.subscribe(hassioDiscoveryPrefix+'/status',2);
+	#process status, when it publishes the messages of several boilers
+	if (bridgeTopic is not None):
+		client.publish(bridgeTopic,'Online',1,True);
+	for gateway in gateways:
+		gateway.connected();
+	
+def on_disconnect(client, userdata, rc):
+	logger.critical('Diconnected from MQTT broker');
 
 def sigterm_exit(signum, frame):
 		logger.critical('Stop requested by SIGTERM, raising KeyboardInterrupt');
 		raise KeyboardInterrupt;
 
+#option of a boiler site section, with the value of the [Modbus] or [Boiler] section as default
+def siteOption(config,site,section,option,**kwargs):
+	if (site is not None) and config.has_option(site,option):
+		return config.get(site,option);
+	return config.get(section,option,**kwargs);
+
+#create the panels and the gateways of the regulators of a boiler site, from its section or from [Modbus] and [Boiler] sections if site is None
+#several regulators on the same RS485 bus share the converter connection of the first one
+def createGateways(config,site):
+	#topic root of a site is given by its clientId, by default the site name
+	if (site is not None):
+		clientId=config.get(site,'clientId',fallback=site[len(SITE_SECTION):].strip());
+	else:
+		clientId=config.get('MQTT','clientId');
+	name=clientId;
+	
+	#Modbus settings
+	modbusAddress=siteOption(config,site,'Modbus','ip');
+	modbusPort=siteOption(config,site,'Modbus','port');
+	modbusRegulatorAddresses=[int(address,0) for address in siteOption(config,site,'Modbus','regulatorAddress').split(',')];
+	logger.critical(name+': Modbus interface address: '+modbusAddress+' : '+modbusPort);
+	logger.critical(name+': Modbus regulator address: '+ ', '.join(hex(address) for address in modbusRegulatorAddresses));
+	
+	#boiler time timezone and automatic time synchro
+	boilerTimezone=siteOption(config,site,'Boiler','timezone');
+	boilerTimeSync=siteOption(config,site,'Boiler','timeSync');
+	boilerSniffing=(siteOption(config,site,'Boiler','sniffing',fallback='False').lower() in ('1','yes','true','on'));
+	
+	period=int(siteOption(config,site,'Boiler','period'),0);
+	gateways=list();
+	for address in modbusRegulatorAddresses:
+		#init panel
+		panel=Diematic3Panel.Diematic3Panel(modbusAddress,int(modbusPort),address,boilerTimezone,boilerTimeSync,boilerSniffing,modbusAsyncEngine);
+		#set refresh period, with a minimum of 10s
+		panel.refreshPeriod=max(period,10);
+		#set burner data and identity refresh periods
+		panel.scheduler.setPeriod(DDPlanner.RefreshClass.FAST,int(siteOption(config,site,'Boiler','fastPeriod',fallback='0')));
+		panel.scheduler.setPeriod(DDPlanner.RefreshClass.SLOW,int(siteOption(config,site,'Boiler','slowPeriod',fallback='14400')));
+		
+		#other regulators exchange through the first one, their clientId is suffixed by their address
+		regulatorClientId=clientId;
+		if (len(gateways)!=0):
+			gateways[0].panel.attach(panel);
+			regulatorClientId=clientId+'_'+f"{address:02X}";
+		topicPrefix=mqttTopicRoot+'/'+regulatorClientId;
+		logger.critical(regulatorClientId+': Topic Root: '+topicPrefix);
+		gateway=Gateway(regulatorClientId,panel,client,topicPrefix,regulatorClientId,publishTopics,publishJson,publishPolicies,hassioDiscoveryPrefix);
+		#history file of each regulator
+		if (historyDuration!=0):
+			historyFile=os.path.join(historyDirectory,regulatorClientId+'.history');
+			gateway.enableHistory(DDHistory.HistoryStore(historyFile,HISTORY_CHANNELS.keys(),historyDuration*3600,historyPeriod));
+		gateways.append(gateway);
+	return gateways;
+
+#stop modbus loops and MQTT client
+def stop():
+	#stop modbus loops, attached regulators are stopped with the panel owning their bus
+	for gateway in gateways:
+		if (gateway.panel.busOwner is None):
+			gateway.panel.loop_stop();
+	if (asyncLoop is not None):
+		asyncLoop.call_soon_threadsafe(asyncLoop.stop);
+		asyncLoopThread.join();
+	if (metricsServer is not None):
+		metricsServer.stop();
+	if (bridgeTopic is not None):
+		client.publish(bridgeTopic,'Offline',1,True);
+	#disconnect mqtt server, network loop ends once pending messages are sent
+	if (mqttThread is not None):
+		client.disconnect();
+		mqttThread.join();
+	#history files are closed once no more query can be received
+	for gateway in gateways:
+		if (gateway.history is not None):
+			gateway.history.close();
+
+#sections of boilers handled by a single process
+SITE_SECTION='Site';
 
 if __name__ == '__main__':
 
@@ -248,33 +467,47 @@ if __name__ == '__main__':
 	logging.config.fileConfig('logging.conf');
 	logger = logging.getLogger(__name__);
 	
+	#command line options
+	parser=argparse.ArgumentParser(description='Diematic boiler to MQTT gateway');
+	parser.add_argument('--scan',metavar='FIRST-LAST',help='scan a register range of the regulators, e.g. 0-255, result is saved in clientId.scan');
+	args=parser.parse_args();
+	
 	#Sigterm trapping
 	signal.signal(signal.SIGTERM, sigterm_exit);
+	gateways=list();
+	asyncLoop=None;
+	metricsServer=None;
+	mqttThread=None;
 	try:
 		#Initialisation config
 		config = configparser.ConfigParser()
 		config.read('Diematic32MQTT.conf')
 
-		#Modbus settings
-		modbusAddress=config.get('Modbus','ip');
-		modbusPort=config.get('Modbus','port');
-		modbusRegulatorAddress=int(config.get('Modbus','regulatorAddress'),0);
-		logger.critical('Modbus interface address: '+modbusAddress+' : '+modbusPort);
-		logger.critical('Modbus regulator address: '+ hex(modbusRegulatorAddress));
-		
-		#boiler time timezone and automatic time synchro
-		boilerTimezone=config.get('Boiler','timezone');
-		boilerTimeSync=config.get('Boiler','timeSync');
+		#Modbus engine, an asyncio event loop is shared by all boilers
+		modbusAsyncEngine=(config.get('Modbus','engine',fallback='thread')=='asyncio');
+		logger.critical('Modbus engine: '+ ('asyncio' if modbusAsyncEngine else 'thread'));
 		
 		#MQTT settings
 		mqttBrokerHost=config.get('MQTT','brokerHost');
 		mqttBrokerPort=config.get('MQTT','brokerPort');
 		
 		mqttClientId=config.get('MQTT','clientId');
-		mqttTopicPrefix=config.get('MQTT','topicPrefix')+'/'+mqttClientId;
+		mqttTopicRoot=config.get('MQTT','topicPrefix');
 		
 		logger.critical('Broker: '+mqttBrokerHost+' : '+mqttBrokerPort);
-		logger.critical('Topic Root: '+mqttTopicPrefix);	
+		
+		#publishing mode: a topic per attribute, a JSON document per section, or both
+		mqttPublishMode=config.get('MQTT','publishMode',fallback='topics');
+		publishTopics=(mqttPublishMode in ('topics','both'));
+		publishJson=(mqttPublishMode in ('json','both'));
+		logger.critical('Publish mode: '+mqttPublishMode);
+		
+		#publishing policies of noisy values
+		publishPolicies=dict();
+		if config.has_section('Publishing'):
+			for topic,policy in config.items('Publishing'):
+				publishPolicies[topic]=PublishPolicy.parse(policy);
+				logger.critical('Publish policy: '+topic+' '+policy);
 		
 		#Home Assistant discovery settings
 		hassioDiscoveryEnable=config.getboolean('Home Assistant','MQTT_DiscoveryEnable');
@@ -283,78 +516,86 @@ if __name__ == '__main__':
 		logger.critical('Hassio Discovery Enable: '+ str(hassioDiscoveryEnable));
 		logger.critical('Hassio Discovery Prefix: '+ hassioDiscoveryPrefix);
 		
-
-		#init panel
-		period=int(config.get('Boiler','period'),0);
-		Diematic3Panel.Diematic3Panel.updateCallback=diematic3Publish;
-		panel=Diematic3Panel.Diematic3Panel(modbusAddress,int(modbusPort),modbusRegulatorAddress,boilerTimezone,boilerTimeSync);
-		#set refresh period, with a minimum of 10s
-		panel.refreshPeriod=max(period,10);
+		#history of regulator values, in hours, 0 to disable it
+		historyDuration=config.getint('History','duration',fallback=0);
+		historyPeriod=config.getint('History','period',fallback=10);
+		historyDirectory=config.get('History','directory',fallback='.');
+		if (historyDuration!=0):
+			logger.critical('History: '+str(historyDuration)+'h, a sample every '+str(historyPeriod)+'s in '+historyDirectory);
+		
+		#boilers of [Site xxx] sections, or the single boiler of [Modbus] and [Boiler] sections
+		sites=[section for section in config.sections() if section.startswith(SITE_SECTION+' ')];
 		
-
 		#init mqtt brooker
 		client = mqtt.Client()
 		client.on_connect = on_connect
 		client.on_disconnect = on_disconnect
-		#last will
-		client.will_set(mqttTopicPrefix+'/status',"Offline",1,True)
+		#last will on the boiler status, or on the process status with several boilers
+		if (len(sites)!=0):
+			bridgeTopic=mqttTopicRoot+'/'+mqttClientId+'/status';
+			logger.critical('Bridge status topic: '+bridgeTopic);
+		else:
+			bridgeTopic=None;
+		client.will_set(bridgeTopic if (bridgeTopic is not None) else mqttTopicRoot+'/'+mqttClientId+'/status',"Offline",1,True)
 		client.connect_async(mqttBrokerHost, int(mqttBrokerPort))
-		client.message_callback_add(mqttTopicPrefix+'/+/+/set',paramSet)
-		client.message_callback_add(mqttTopicPrefix+'/date/set',paramSet)
 		if hassioDiscoveryEnable:
 			client.message_callback_add(hassioDiscoveryPrefix+'/status',haSendDiscoveryMessages)
 		
-		#create HomeAssistant discovery instance
-
-		hassio=Hassio.Hassio(client,mqttTopicPrefix,mqttClientId,hassioDiscoveryPrefix);
-		hassio.availabilityInfo('status','Online','Offline');
-	
-		#create mqtt message buffer
-		buffer=MessageBuffer(client);
+		#create boiler panels and their gateway
+		for site in (sites if (len(sites)!=0) else [None]):
+			for gateway in createGateways(config,site):
+				if (bridgeTopic is not None):
+					gateway.hassio.bridgeInfo(bridgeTopic);
+				gateways.append(gateway);
 		
-		#launch MQTT client
-		client.loop_start();
-
-		#start modbus thread
-		panel.loop_start();
+		#register scan requested on the command line
+		if (args.scan is not None):
+			for gateway in gateways:
+				gateway.startScan(args.scan);
+		
+		#optional local metrics endpoint
+		metricsPort=config.getint('Metrics','port',fallback=0);
+		if (metricsPort!=0):
+			registry=DDMetrics.Registry();
+			for gateway in gateways:
+				gateway.panel.enableMetrics(registry,gateway.name);
+			metricsServer=DDMetrics.MetricsServer(registry,config.get('Metrics','host',fallback='127.0.0.1'),metricsPort);
+			metricsServer.start();
+		
+		#launch MQTT client network loop in its own thread, the broker connection is retried until it succeeds
+		mqttThread=threading.Thread(target=client.loop_forever,kwargs={'retry_first_connection':True},daemon=True);
+		mqttThread.start();
+		
+		#start asyncio event loop shared by modbus loops
+		if modbusAsyncEngine:
+			asyncLoop=asyncio.new_event_loop();
+			asyncLoopThread=threading.Thread(target=asyncLoop.run_forever);
+			asyncLoopThread.start();
+
+		#start modbus loops, one per bus connection
+		busGateways=[gateway for gateway in gateways if (gateway.panel.busOwner is None)];
+		for gateway in busGateways:
+			gateway.panel.loop_start(asyncLoop);
 		run=True;
 		while run:
-			#check every 10s that all threads are living
+			#check every 5s that all modbus loops are living, a stopped one is restarted
 			time.sleep(5);
-			if (threading.active_count()!=3):
-				logger.critical('At least one process has been killed, stop launched');
+			for gateway in busGateways:
+				if not gateway.panel.alive():
+					logger.critical(gateway.name+': Modbus loop stopped, restart launched');
+					gateway.panel.loop_start(asyncLoop);
+			#check MQTT client, event loop and metrics endpoint threads, other threads of the process are ignored
+			threads={'MQTT client':mqttThread,
+				'Event loop':asyncLoopThread if (asyncLoop is not None) else None,
+				'Metrics endpoint':metricsServer.thread if (metricsServer is not None) else None};
+			stopped=[name for name,thread in threads.items() if (thread is not None) and not thread.is_alive()];
+			if (len(stopped)!=0):
+				logger.critical(', '.join(stopped)+' thread stopped, stop launched');
 				run=False;
-		#stop modbus thread
-		panel.loop_stop();		
-		#disconnect mqtt server
-		client.loop_stop();
+		stop();
 		logger.critical('Stopped');
 	except KeyboardInterrupt:
-		#stop modbus thread
-		panel.loop_stop();
-
-		#disconnect mqtt server
-		client.loop_stop();
+		stop();
 		logger.critical('Stopped by KeyboardInterrupt');
 	except BaseException as exc:	
 		logger.exception(exc);
-
-
-			
-
-
-
-	
-		
-
-  
-
-
-
-
-
-
-
-
-
-
@@ -1,19 +1,21 @@
 ﻿#!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-import threading,queue
+import threading,asyncio
 import logging, logging.config
-import DDModbus
+import DDModbus,DDModbusAsync,DDPlanner,DDWindow,DDPhase,DDConnection,DDMetrics,DDScan,DDSchema
 import time,datetime,pytz
 from enum import IntEnum
+from DDSchema import Attribute,Entity
 
 #Target Temp min/max for hotwater
 TEMP_MIN_ECS=10
 TEMP_MAX_ECS=80
 
-#Target Temp min/max for hotwater
+#Target Temp min/max for zones, antiice target has a lower max
 TEMP_MIN_INT=5
 TEMP_MAX_INT=30
+TEMP_MAX_ANTIGEL=20
 
 #definition for state machine used for modBus data exchange
 class DDModBusStatus(IntEnum):
@@ -59,14 +61,117 @@ class DDREGISTER(IntEnum):
 	BOILER_TYPE=457;
 	PUMP_POWER=463;
 	ALARME=465;
+
+#refresh class of registers which are not read with the refresh period
+REGISTER_REFRESH_CLASS={
+	#burner data sampled in each master window
+	DDREGISTER.TEMP_CHAUD:DDPlanner.RefreshClass.FAST,
+	DDREGISTER.BASE_ECS:DDPlanner.RefreshClass.FAST,
+	DDREGISTER.IONIZATION_CURRENT:DDPlanner.RefreshClass.FAST,
+	DDREGISTER.RETURN_TEMP:DDPlanner.RefreshClass.FAST,
+	DDREGISTER.SMOKE_TEMP:DDPlanner.RefreshClass.FAST,
+	DDREGISTER.FAN_SPEED:DDPlanner.RefreshClass.FAST,
+	DDREGISTER.PUMP_POWER:DDPlanner.RefreshClass.FAST,
+	#static identity registers
+	DDREGISTER.CTRL:DDPlanner.RefreshClass.SLOW,
+	DDREGISTER.BOILER_TYPE:DDPlanner.RefreshClass.SLOW,
+	#only used by mode update procedure
+	DDREGISTER.NB_JOUR_ANTIGEL:DDPlanner.RefreshClass.ON_DEMAND};
+
+#registers computed by the regulator from a written register, read back with it
+DERIVED_REGISTERS={
+	DDREGISTER.CONS_JOUR_A:(DDREGISTER.TCALC_A,),
+	DDREGISTER.CONS_NUIT_A:(DDREGISTER.TCALC_A,),
+	DDREGISTER.CONS_ANTIGEL_A:(DDREGISTER.TCALC_A,),
+	DDREGISTER.MODE_A:(DDREGISTER.TCALC_A,),
+	DDREGISTER.CONS_JOUR_B:(DDREGISTER.TCALC_B,),
+	DDREGISTER.CONS_NUIT_B:(DDREGISTER.TCALC_B,),
+	DDREGISTER.CONS_ANTIGEL_B:(DDREGISTER.TCALC_B,),
+	DDREGISTER.MODE_B:(DDREGISTER.TCALC_B,)};
+
+#zone modes and hot water modes, by masked value of the mode register
+MODES={8:'AUTO',36:'TEMP JOUR',4:'PERM JOUR',34:'TEMP NUIT',2:'PERM NUIT',1:'ANTIGEL'};
+HOT_WATER_MODES={0:'AUTO',0x50:'TEMP',0x10:'PERM'};
+
+#alarm texts by alarm register value
+ALARM_TEXTS={0:'OK',10:'Défaut Sonde Retour',21:'Pression d\'eau basse',26:'Défaut Allumage',27:'Flamme Parasite',28:'STB Chaudière',30:'Rearm. Coffret',31:'Défaut Sonde Fumée'};
+
+#min, max and step of target temperatures
+HOT_WATER_LIMITS=(TEMP_MIN_ECS,TEMP_MAX_ECS,5);
+ZONE_LIMITS=(TEMP_MIN_INT,TEMP_MAX_INT,0.5);
+ANTIICE_LIMITS=(TEMP_MIN_INT,TEMP_MAX_ANTIGEL,0.5);
+
+#boiler clock registers
+DATETIME_REGISTERS=(DDREGISTER.ANNEE,DDREGISTER.MOIS,DDREGISTER.JOUR,DDREGISTER.HEURE,DDREGISTER.MINUTE);
+
+#schema of the regulator attributes: register decoding and encoding, published topic and JSON document, Home Assistant entities
+#attributes without register are panel values which are only published
+SCHEMA=DDSchema.Schema([
+	#boiler
+	Attribute('availability',topic='status',format='status'),
+	Attribute('datetime',decode='decodeDatetime',registers=DATETIME_REGISTERS,topic='date',section='boiler',key='date',format='date',
+		entities=(Entity('sensor','heater_datetime',"Horloge Chaudière",template="{{ as_timestamp(value) |timestamp_custom ('%d/%m/%Y %H:%M') }}"),
+			Entity('switch','heater_datetime_set',"Synchro Horloge",state='unknown',payloads=('--','Now')))),
+	Attribute('lastTimeSync',registers=DATETIME_REGISTERS,topic='lastTimeSync',section='boiler',key='lastTimeSync',format='date'),
+	Attribute('type',DDREGISTER.BOILER_TYPE,topic='type',section='boiler',key='type',history=False,entities=(Entity('sensor','type',"Type"),)),
+	Attribute('release',DDREGISTER.CTRL,topic='ctrl',section='boiler',key='ctrl',history=False,entities=(Entity('sensor','ctrl',"Controleur"),)),
+	Attribute('extTemp',DDREGISTER.TEMP_EXT,scale=0.1,topic='ext/temp',section='boiler',key='extTemp',entities=(Entity('sensor','ext_temp',"Température Extérieure",'temperature',"°C"),)),
+	Attribute('temp',DDREGISTER.TEMP_CHAUD,scale=0.1,topic='temp',section='boiler',key='temp',entities=(Entity('sensor','boiler_temp',"Température Chaudière",'temperature',"°C"),)),
+	Attribute('targetTemp',DDREGISTER.TCALC_A,scale=0.1,topic='targetTemp',section='boiler',key='targetTemp',entities=(Entity('sensor','target_temp',"Température Cible",'temperature',"°C"),)),
+	Attribute('returnTemp',DDREGISTER.RETURN_TEMP,scale=0.1,topic='returnTemp',section='boiler',key='returnTemp',entities=(Entity('sensor','return_temp',"Température Retour",'temperature',"°C"),)),
+	Attribute('waterPressure',DDREGISTER.PRESSION_EAU,scale=0.1,topic='waterPressure',section='boiler',key='waterPressure',entities=(Entity('sensor','water_pressure',"Pression d'eau",'pressure',"bar"),)),
+	Attribute('burnerPower',decode='decodeBurnerPower',registers=(DDREGISTER.FAN_SPEED,DDREGISTER.IONIZATION_CURRENT),topic='power',section='boiler',key='power',entities=(Entity('sensor','power',"Puissance",'power_factor',"%"),)),
+	Attribute('smokeTemp',DDREGISTER.SMOKE_TEMP,scale=0.1,topic='smokeTemp',section='boiler',key='smokeTemp',entities=(Entity('sensor','smoke_temp',"Température Fumées",'temperature',"°C"),)),
+	Attribute('ionizationCurrent',DDREGISTER.IONIZATION_CURRENT,scale=0.1,topic='ionizationCurrent',section='boiler',key='ionizationCurrent',entities=(Entity('sensor','ionization_current',"Courant Ionisation",'current',"µA"),)),
+	Attribute('fanSpeed',DDREGISTER.FAN_SPEED,topic='fanSpeed',section='boiler',key='fanSpeed',entities=(Entity('sensor','fan_speed',"Vitesse Ventilateur",unit="RPM"),)),
+	Attribute('burnerStatus',DDREGISTER.BASE_ECS,mask=0x08,shift=3,topic='burnerStatus',section='boiler',key='burnerStatus',entities=(Entity('binary_sensor','burner_status',"Etat Bruleur"),)),
+	Attribute('pumpPower',decode='decodePumpPower',registers=(DDREGISTER.BASE_ECS,DDREGISTER.PUMP_POWER),valid=DDREGISTER.TEMP_AMB_A,topic='pumpPower',section='boiler',key='pumpPower',entities=(Entity('sensor','pump_power',"Puissance Pompe",'power_factor',"%"),)),
+	Attribute('alarm',decode='decodeAlarm',registers=(DDREGISTER.ALARME,),topic='alarm',section='boiler',key='alarm',format='json',
+		entities=(Entity('sensor','alarm',"Etat",template="{{ value_json.txt}}"),Entity('sensor','alarm_id',"N° Erreur",template="{{ value_json.id}}"))),
+	
+	#hotwater, mode is read in zone A mode register
+	Attribute('hotWaterPump',DDREGISTER.BASE_ECS,mask=0x20,shift=5,topic='hotWater/pump',section='hotWater',key='pump',entities=(Entity('binary_sensor','hot_water_pump',"Pompe ECS"),)),
+	Attribute('hotWaterTemp',DDREGISTER.TEMP_ECS,scale=0.1,topic='hotWater/temp',section='hotWater',key='temp',entities=(Entity('sensor','hot_water_temp',"Température ECS",'temperature',"°C"),)),
+	Attribute('hotWaterMode',DDREGISTER.MODE_A,mask=0x50,enum=HOT_WATER_MODES,request='hotWaterModeUpdateRequest',topic='hotWater/mode',section='hotWater',key='mode',
+		entities=(Entity('select','hot_water_mode',"Mode ECS"),Entity('sensor','hot_water_mode',"Mode ECS"))),
+	Attribute('hotWaterDayTargetTemp',DDREGISTER.CONS_ECS,scale=0.1,limits=HOT_WATER_LIMITS,topic='hotWater/dayTemp',section='hotWater',key='dayTemp',entities=(Entity('number','hot_water_temp_day',"Température ECS Jour",unit="°C"),)),
+	Attribute('hotWaterNightTargetTemp',DDREGISTER.CONS_ECS_NUIT,scale=0.1,limits=HOT_WATER_LIMITS,topic='hotWater/nightTemp',section='hotWater',key='nightTemp',entities=(Entity('number','hot_water_temp_night',"Température ECS Nuit",unit="°C"),)),
+	
+	#area A, values are unknown without room temperature
+	Attribute('zoneATemp',DDREGISTER.TEMP_AMB_A,scale=0.1,topic='zoneA/temp',section='zoneA',key='temp',entities=(Entity('sensor','zone_A_temp',"Température Zone A",'temperature',"°C"),)),
+	Attribute('zoneAMode',DDREGISTER.MODE_A,mask=0x2F,enum=MODES,valid=DDREGISTER.TEMP_AMB_A,request='zoneAModeUpdateRequest',topic='zoneA/mode',section='zoneA',key='mode',
+		entities=(Entity('select','zone_A_mode',"Mode Zone A"),Entity('sensor','zone_A_mode',"Mode Zone A"))),
+	Attribute('zoneAPump',DDREGISTER.BASE_ECS,mask=0x10,shift=4,valid=DDREGISTER.TEMP_AMB_A,topic='zoneA/pump',section='zoneA',key='pump',entities=(Entity('binary_sensor','zone_A_pump',"Pompe Zone A"),)),
+	Attribute('zoneADayTargetTemp',DDREGISTER.CONS_JOUR_A,scale=0.1,limits=ZONE_LIMITS,valid=DDREGISTER.TEMP_AMB_A,topic='zoneA/dayTemp',section='zoneA',key='dayTemp',entities=(Entity('number','zone_A_temp_day',"Température Jour Zone A",unit="°C"),)),
+	Attribute('zoneANightTargetTemp',DDREGISTER.CONS_NUIT_A,scale=0.1,limits=ZONE_LIMITS,valid=DDREGISTER.TEMP_AMB_A,topic='zoneA/nightTemp',section='zoneA',key='nightTemp',entities=(Entity('number','zone_A_temp_night',"Température Nuit Zone A",unit="°C"),)),
+	Attribute('zoneAAntiiceTargetTemp',DDREGISTER.CONS_ANTIGEL_A,scale=0.1,limits=ANTIICE_LIMITS,valid=DDREGISTER.TEMP_AMB_A,topic='zoneA/antiiceTemp',section='zoneA',key='antiiceTemp',entities=(Entity('number','zone_A_temp_antiice',"Température Antigel Zone A",unit="°C"),)),
+	
+	#area B, values are unknown without room temperature
+	Attribute('zoneBTemp',DDREGISTER.TEMP_AMB_B,scale=0.1,topic='zoneB/temp',section='zoneB',key='temp',entities=(Entity('sensor','zone_B_temp',"Température Zone B",'temperature',"°C"),)),
+	Attribute('zoneBMode',DDREGISTER.MODE_B,mask=0x2F,enum=MODES,valid=DDREGISTER.TEMP_AMB_B,request='zoneBModeUpdateRequest',topic='zoneB/mode',section='zoneB',key='mode',
+		entities=(Entity('select','zone_B_mode',"Mode Zone B"),Entity('sensor','zone_B_mode',"Mode Zone B"))),
+	Attribute('zoneBPump',DDREGISTER.OPTIONS_B_C,mask=0x10,shift=4,valid=DDREGISTER.TEMP_AMB_B,topic='zoneB/pump',section='zoneB',key='pump',entities=(Entity('binary_sensor','zone_B_pump',"Pompe Zone B"),)),
+	Attribute('zoneBDayTargetTemp',DDREGISTER.CONS_JOUR_B,scale=0.1,limits=ZONE_LIMITS,valid=DDREGISTER.TEMP_AMB_B,topic='zoneB/dayTemp',section='zoneB',key='dayTemp',entities=(Entity('number','zone_B_temp_day',"Température Jour Zone B",unit="°C"),)),
+	Attribute('zoneBNightTargetTemp',DDREGISTER.CONS_NUIT_B,scale=0.1,limits=ZONE_LIMITS,valid=DDREGISTER.TEMP_AMB_B,topic='zoneB/nightTemp',section='zoneB',key='nightTemp',entities=(Entity('number','zone_B_temp_night',"Température Nuit Zone B",unit="°C"),)),
+	Attribute('zoneBAntiiceTargetTemp',DDREGISTER.CONS_ANTIGEL_B,scale=0.1,limits=ANTIICE_LIMITS,valid=DDREGISTER.TEMP_AMB_B,topic='zoneB/antiiceTemp',section='zoneB',key='antiiceTemp',entities=(Entity('number','zone_B_temp_antiice',"Température Antigel Zone B",unit="°C"),)),
+	
+	#bus cycle
+	Attribute('cyclePeriod',topic='bus/cyclePeriod',section='bus',key='cyclePeriod',format='float'),
+	Attribute('windowGain',topic='bus/windowGain',section='bus',key='windowGain',format='float'),
+	
+	#register scan
+	Attribute('scanStatus',topic='scan',format='json')]);
 	
 #This class allow to read/write parameters to Diematic regulator with the helo of a RS485/TCPIP converter
-#refresh of attributes From regulator is done roughly every minute
-#update request to the regulator are done within 10 s and trigger a whole read refresh
+#refresh of attributes From regulator is done roughly every minute, burner data in each cycle and identity every few hours
+#update request to the regulator are done within 10 s, written registers and the ones derived from them are read back in the same window
+#pending update requests are merged, the last requested value wins
 class Diematic3Panel:
 	updateCallback=None;
+	#accepted advance of socket timeouts on the master switch time
+	SWITCH_TOLERANCE=0.005;
 
-	def __init__(self,ip,port,regulatorAddress,boilerTimezone='',syncTime=False):
+	def __init__(self,ip,port,regulatorAddress,boilerTimezone='',syncTime=False,sniffing=False,asyncEngine=False):
 		#default refresh period
 		REFRESH_PERIOD=60
 		
@@ -80,6 +185,21 @@ class Diematic3Panel:
 		#regulator modbus address
 		self.regulatorAddress=regulatorAddress;
 		
+		#engine used by the modbus loop : polling thread or asyncio
+		self.asyncEngine=asyncEngine;
+		self.asyncLoop=None;
+		self.asyncTask=None;
+		self.modBusInterface=None;
+		#thread running the loop, or future of the loop running in a shared event loop
+		self.loopThread=None;
+		self.loopFuture=None;
+		self.run=False;
+		
+		#other regulators on the same RS485 bus, exchanging through the connection of this panel
+		self.attached=list();
+		#panel owning the bus connection of an attached regulator
+		self.busOwner=None;
+		
 		#timezone
 		self.syncTime=syncTime;
 		self.tzinfo=None;
@@ -96,16 +216,55 @@ class Diematic3Panel:
 		#state machine initialisation
 		self.busStatus=DDModBusStatus.INIT;
 		
-		#queue for generic register write request
-		self.regUpdateRequest=queue.Queue();
+		#generic register write requests, merged while pending
+		self.regUpdateRequest=DDWindow.WriteCoalescer();
+		
+		#specific Mode register requests, only the last one is kept
+		self.zoneAModeUpdateRequest=DDWindow.PendingValue();
+		self.zoneBModeUpdateRequest=DDWindow.PendingValue();
+		self.hotWaterModeUpdateRequest=DDWindow.PendingValue();
 		
-		#queues for specific Mode register request
-		self.zoneAModeUpdateRequest=queue.Queue();
-		self.zoneBModeUpdateRequest=queue.Queue();
-		self.hotWaterModeUpdateRequest=queue.Queue();	
+		#read planner, with registers used by refreshAttributes
+		self.planner=DDPlanner.ReadPlanner();
+		self.addDecoderRegisters(reg.value for reg in DDREGISTER);
+		
+		#polling scheduler, with refresh class of each register
+		self.scheduler=DDPlanner.PollScheduler(self.planner);
+		for reg,refreshClass in REGISTER_REFRESH_CLASS.items():
+			self.scheduler.setClass([reg.value],refreshClass);
 		
 		#dictionnary used to save registers data read from the regulator
 		self.registers=dict();
+		#time of the last update of each register
+		self.registersTimestamp=dict();
+		
+		#passive harvesting of registers written by the boiler during its master phase
+		self.sniffing=sniffing;
+		
+		#registers read during last refresh
+		self.refreshedRegisters=set();
+		#registers changed since last attribute decoding
+		self.changedRegisters=set();
+		
+		#register to attribute decoder index
+		self.indexDecoders();
+		
+		#master window executor, sharing bus timing estimation with the planner
+		self.executor=DDWindow.WindowExecutor(self.planner.timing);
+		self.windowError=False;
+		
+		#boiler master/slave cycle tracking
+		self.phase=DDPhase.PhaseTracker();
+		
+		#converter connection supervision and recovery
+		self.connection=DDConnection.ConnectionManager();
+		
+		#register scan, None if no scan has been requested
+		self.scanner=None;
+		
+		#instrumentation, None when metrics are disabled
+		self.metrics=None;
+		self.lastRefreshTime=None;
 		
 		#init values of functionnal attributes
 		self.initRegulator();
@@ -116,52 +275,121 @@ class Diematic3Panel:
 		#init refreshRequest flag
 		self.refreshRequest=False;
 	
+	#boiler cycle estimation, period and jitter in seconds
+	@property
+	def cyclePeriod(self):
+		return self.phase.period;
+	
+	@property
+	def cycleJitter(self):
+		return self.phase.jitter if (self.phase.period is not None) else None;
+	
+	#position in the boiler cycle, 0 at the beginning of the boiler master phase
+	@property
+	def cyclePhase(self):
+		return self.phase.phase(time.time());
+	
+	#average time gained on the beginning of the master window thanks to the cycle prediction
+	@property
+	def windowGain(self):
+		return self.phase.windowGain;
+	
+	#refresh period is the period of NORMAL refresh class
+	@property
+	def refreshPeriod(self):
+		return self.scheduler.periods[DDPlanner.RefreshClass.NORMAL];
+	
+	@refreshPeriod.setter
+	def refreshPeriod(self,x):
+		self.scheduler.setPeriod(DDPlanner.RefreshClass.NORMAL,x);
+	
+#this property is used to add a regulator sharing the RS485 bus, its exchanges are done during the master windows of this panel
+#it keeps its own registers and attributes, bus time of the windows is shared fairly between regulators
+	def attach(self,panel):
+		panel.busOwner=self;
+		panel.executor=self.executor;
+		panel.planner.timing=self.planner.timing;
+		panel.masterSlaveSynchro=False;
+		panel.lastSynchroTimestamp=time.time();
+		self.attached.append(panel);
+	
+	#regulators exchanging through the bus connection of this panel
+	def regulators(self):
+		return [self]+self.attached;
+	
+#this property is used to enable the instrumentation of the panel and of its bus, name is used as regulator label
+	def enableMetrics(self,registry,name):
+		self.metrics=DDMetrics.PanelMetrics(registry,name,self);
+		if self.modBusInterface is not None:
+			self.modBusInterface.metrics=self.metrics;
+	
+#this property is used to start a scan of a register range, read in the time left by the other exchanges of the master windows
+#an interrupted scan of the same range saved in path is resumed
+	def startScan(self,first,last,path):
+		self.scanner=DDScan.RegisterScanner(self.regulatorAddress,first,last,path,self.planner.maxRegNb);
+		self.logger.warning('Register scan of '+str(first)+'-'+str(last)+' started, regulator '+hex(self.regulatorAddress));
+	
+	def stopScan(self):
+		self.scanner=None;
+	
+	#state of the register scan
+	@property
+	def scanStatus(self):
+		scanner=self.scanner;
+		return scanner.status() if (scanner is not None) else None;
+	
+	#jobs of a priority waiting for a master window
+	def pendingJobs(self,priorityName):
+		return len(self.executor.pending(DDWindow.Priority[priorityName],self));
+	
+	#register writes and mode changes requested, not yet queued in the master window executor
+	def pendingWrites(self):
+		modeRequests=(self.zoneAModeUpdateRequest,self.zoneBModeUpdateRequest,self.hotWaterModeUpdateRequest);
+		return len(self.regUpdateRequest.registers)+sum(1 for request in modeRequests if not request.empty());
+	
 	def initConnection(self):
 		#RS485 converter connexion init
+		self.closeConnection();
+		self.connection.attempt();
 		self.modBusInterface=DDModbus.DDModbus(self.ip,self.port);
+		self.modBusInterface.metrics=self.metrics;
+		self.executor.bus=self.modBusInterface;
 		self.logger.warning('Init Link with Regulator');
 		self.modBusInterface.clean();
+		self.resync();
+		self.connection.connected();
+		if (self.metrics is not None) and (self.connection.connects > 1):
+			self.metrics.reconnect();
+	
+	#RS485 converter connexion init, False if the converter can't be reached
+	def connect(self):
+		try:
+			self.initConnection();
+			return True;
+		except OSError as exc:
+			self.connectFailed(exc);
+			return False;
+	
+	def connectFailed(self,exc):
+		self.connection.connectFailed();
+		self.closeConnection();
+		self.logger.warning('Connection to converter failed: '+str(exc)+', next attempt in '+f"{self.connection.connectDelay():.0f}"+'s');
+	
+	def closeConnection(self):
+		if self.modBusInterface is not None:
+			self.modBusInterface.close();
+			self.modBusInterface=None;
+		self.executor.bus=None;
 	
 	def initAttributes(self):
 		#regulator attributes
 		self.availability=False;
-		self._datetime=None;
 		self.lastTimeSync=None;
-		self.type=None;
-		self.release=None;
-		self.extTemp=None;
-		self.temp=None;
-		self.targetTemp=None;
-		self.returnTemp=None;
-		self.waterPressure=None;
-		self.burnerPower=None;
-		self.smokeTemp=None;
-		self.fanSpeed=None;
-		self.ionizationCurrent=None
-		self.burnerStatus=None;
-		self.pumpPower=None;
-		self.alarm=None;
-		self.hotWaterPump=None;
-		self.hotWaterTemp=None;
-		self._hotWaterMode=None;
-		self._hotWaterDayTargetTemp=None;
-		self._hotWaterNightTargetTemp=None;
-		self.zoneATemp=None;
-		self._zoneAMode=None;
-		self.zoneAPump=None;
-		self._zoneADayTargetTemp=None;
-		self._zoneANightTargetTemp=None;
-		self._zoneAAntiiceTargetTemp=None;
-		self.zoneBTemp=None;
-		self._zoneBMode=None;
-		self.zoneBPump=None;
-		self._zoneBDayTargetTemp=None;
-		self._zoneBNightTargetTemp=None;
-		self._zoneBAntiiceTargetTemp=None;
+		for name,storage in self.storage.items():
+			setattr(self,storage,None);
 		
 	def initRegulator(self):
-		#RS485 converter connexion init
-		self.initConnection();
+		#RS485 converter connexion init is done by the modbus loop, which can be restarted
 		#Attributes init
 		self.initAttributes();
 		
@@ -169,145 +397,7 @@ class Diematic3Panel:
 
 
 #this setter/getter are used to read or change values of the regulator
-	@property
-	def hotWaterNightTargetTemp(self):
-			return self._hotWaterNightTargetTemp;
-			
-	@hotWaterNightTargetTemp.setter
-	def hotWaterNightTargetTemp(self,x):
-			#register structure creation, only 5 multiple are usable, temp is in tenth of degree
-			reg=DDModbus.RegisterSet(DDREGISTER.CONS_ECS_NUIT.value,[min(max(round(x/5)*50,TEMP_MIN_ECS*10),TEMP_MAX_ECS*10)]);
-			self.regUpdateRequest.put(reg);
-			
-	@property
-	def hotWaterDayTargetTemp(self):
-			return self._hotWaterDayTargetTemp;
-			
-	@hotWaterDayTargetTemp.setter
-	def hotWaterDayTargetTemp(self,x):
-			#register structure creation, only 5 multiple are usable, temp is in tenth of degree
-			reg=DDModbus.RegisterSet(DDREGISTER.CONS_ECS.value,[min(max(round(x/5)*50,TEMP_MIN_ECS*10),TEMP_MAX_ECS*10)]);
-			self.regUpdateRequest.put(reg);
-			
-	@property
-	def zoneAAntiiceTargetTemp(self):
-			return self._zoneAAntiiceTargetTemp;
-			
-	@zoneAAntiiceTargetTemp.setter
-	def zoneAAntiiceTargetTemp(self,x):
-			#register structure creation, only 0.5 multiple are usable, temp is in tenth of degree
-			reg=DDModbus.RegisterSet(DDREGISTER.CONS_ANTIGEL_A.value,[min(max(round(2*x)*5,TEMP_MIN_INT*10),TEMP_MAX_INT*10)]);
-			self.regUpdateRequest.put(reg);
-			
-	@property
-	def zoneANightTargetTemp(self):
-			return self._zoneANightTargetTemp;
-			
-	@zoneANightTargetTemp.setter
-	def zoneANightTargetTemp(self,x):
-			#register structure creation, only 0.5 multiple are usable, temp is in tenth of degree
-			reg=DDModbus.RegisterSet(DDREGISTER.CONS_NUIT_A.value,[min(max(round(2*x)*5,TEMP_MIN_INT*10),TEMP_MAX_INT*10)]);	
-			self.regUpdateRequest.put(reg);
-			
-	@property
-	def zoneADayTargetTemp(self):
-			return self._zoneADayTargetTemp;
-			
-	@zoneADayTargetTemp.setter
-	def zoneADayTargetTemp(self,x):
-			#register structure creation, only 0.5 multiple are usable, temp is in tenth of degree
-			reg=DDModbus.RegisterSet(DDREGISTER.CONS_JOUR_A.value,[min(max(round(2*x)*5,TEMP_MIN_INT*10),TEMP_MAX_INT*10)]);
-			self.regUpdateRequest.put(reg);
-
-	@property
-	def zoneBAntiiceTargetTemp(self):
-			return self._zoneBAntiiceTargetTemp;
-			
-	@zoneBAntiiceTargetTemp.setter
-	def zoneBAntiiceTargetTemp(self,x):
-			#register structure creation, only 0.5 multiple are usable, temp is in tenth of degree
-			reg=DDModbus.RegisterSet(DDREGISTER.CONS_ANTIGEL_B.value,[min(max(round(2*x)*5,TEMP_MIN_INT*10),TEMP_MAX_INT*10)]);
-			self.regUpdateRequest.put(reg);
-
-	@property
-	def zoneBNightTargetTemp(self):
-			return self._zoneBNightTargetTemp;
-			
-	@zoneBNightTargetTemp.setter
-	def zoneBNightTargetTemp(self,x):
-			#register structure creation, only 0.5 multiple are usable, temp is in tenth of degree
-			reg=DDModbus.RegisterSet(DDREGISTER.CONS_NUIT_B.value,[min(max(round(2*x)*5,TEMP_MIN_INT*10),TEMP_MAX_INT*10)]);
-			self.regUpdateRequest.put(reg);
-			
-	@property
-	def zoneBDayTargetTemp(self):
-			return self._zoneBDayTargetTemp;
-			
-	@zoneBDayTargetTemp.setter
-	def zoneBDayTargetTemp(self,x):
-			#register structure creation, only 0.5 multiple are usable, temp is in tenth of degree
-			reg=DDModbus.RegisterSet(DDREGISTER.CONS_JOUR_B.value,[min(max(round(2*x)*5,TEMP_MIN_INT*10),TEMP_MAX_INT*10)]);	
-			self.regUpdateRequest.put(reg);
-
-	@property
-	def zoneAMode(self):
-			return self._zoneAMode;
-			
-	@zoneAMode.setter
-	def zoneAMode(self,x):
-		
-		#request mode A register change depending mode requested
-		self.logger.debug('zone A mode requested:'+str(x));	
-		if (x=='AUTO'):
-			self.zoneAModeUpdateRequest.put(8);
-		elif (x=='TEMP JOUR'):
-			self.zoneAModeUpdateRequest.put(36);
-		elif (x=='TEMP NUIT'):
-			self.zoneAModeUpdateRequest.put(34);
-		elif (x=='PERM JOUR'):
-			self.zoneAModeUpdateRequest.put(4);
-		elif (x=='PERM NUIT'):
-			self.zoneAModeUpdateRequest.put(2);
-		elif (x=='ANTIGEL'):
-			self.zoneAModeUpdateRequest.put(1);
-	@property
-	def zoneBMode(self):
-			return self._zoneBMode;
-			
-	@zoneBMode.setter
-	def zoneBMode(self,x):
-		
-		#request mode B register change depending mode requested
-		self.logger.debug('zone B mode requested:'+str(x));	
-		if (x=='AUTO'):
-			self.zoneBModeUpdateRequest.put(8);
-		elif (x=='TEMP JOUR'):
-			self.zoneBModeUpdateRequest.put(36);
-		elif (x=='TEMP NUIT'):
-			self.zoneBModeUpdateRequest.put(34);
-		elif (x=='PERM JOUR'):
-			self.zoneBModeUpdateRequest.put(4);
-		elif (x=='PERM NUIT'):
-			self.zoneBModeUpdateRequest.put(2);
-		elif (x=='ANTIGEL'):
-			self.zoneBModeUpdateRequest.put(1);
-			
-	@property
-	def hotWaterMode(self):
-			return self._hotWaterMode;
-			
-	@hotWaterMode.setter
-	def hotWaterMode(self,x):
-			
-		#request hotwater mode register change depending mode requested
-		self.logger.debug('hot water mode requested:'+str(x));	
-		if (x=='AUTO'):
-			self.hotWaterModeUpdateRequest.put(0);
-		elif (x=='TEMP'):
-			self.hotWaterModeUpdateRequest.put(0x50);
-		elif (x=='PERM'):
-			self.hotWaterModeUpdateRequest.put(0x10);
-	
+#setters of the schema writable attributes are added after the class
 	@property
 	def datetime(self):
 			return self._datetime;
@@ -326,47 +416,85 @@ class Diematic3Panel:
 		reg=DDModbus.RegisterSet(DDREGISTER.JOUR.value,[x.day,x.month,(x.year % 100)]);
 		self.regUpdateRequest.put(reg);
 		
-#this property is used to get register values from the regulator
-	def refreshRegisters(self):
-		#update registers 1->63
-		reg=self.modBusInterface.masterReadAnalog(self.regulatorAddress,1,63);
-		if (reg is not None):
-			self.registers.update(reg);
-		else:
-			return(False);
-		#update registers 64->127
-		reg=self.modBusInterface.masterReadAnalog(self.regulatorAddress,64,64);
-		if (reg is not None):
-			self.registers.update(reg);
-		else:
-			return(False);
-			
-		#update registers 128->191
-		#reg=self.modBusInterface.masterReadAnalog(self.regulatorAddress,128,64);
-		#if (reg is not None):
-		#	self.registers.update(reg);
-		#else:
-		#	return(False);
-			
-		#update registers 191->255
-		#reg=self.modBusInterface.masterReadAnalog(self.regulatorAddress,192,64);
-		#if (reg is not None):
-		#	self.registers.update(reg);
-		#else:
-		#	return(False);
-			
-		#update registers 384->447
-		reg=self.modBusInterface.masterReadAnalog(self.regulatorAddress,384,64);
-		if (reg is not None):
-			self.registers.update(reg);
-		else:
-			return(False);
-		#update registers 448->470
-		reg=self.modBusInterface.masterReadAnalog(self.regulatorAddress,448,23);	
-		if (reg is not None):
-			self.registers.update(reg);
-		else:
-			return(False);
+#this property is used to save register values harvested from boiler master frames
+	def harvestRegisters(self,frame):
+		#only write requests carry register values
+		if (not frame.valid) or frame.R_W:
+			return;
+		now=time.time();
+		self.logger.debug('Harvested registers :'+str(frame.data));
+		self.storeRegisters(frame.data,now);
+		#harvested registers don't need to be read
+		self.scheduler.done(frame.data.keys(),now);
+	
+#this property is used to save register values, changed registers are kept for attribute decoding
+	def storeRegisters(self,values,now):
+		for address,value in values.items():
+			if (self.registers.get(address)!=value):
+				self.changedRegisters.add(address);
+			self.registers[address]=value;
+			self.registersTimestamp[address]=now;
+	
+#this property is used to declare registers needed by attribute decoding, read plan is updated accordingly
+	def addDecoderRegisters(self,registers):
+		self.planner.addRegisters(registers);
+
+#this property is used to check that all the registers used by refreshAttributes are available
+	def registersComplete(self):
+		return all((reg in self.registers) for reg in self.planner.registers);
+
+#this property is used to save the registers of an executed read transaction
+	def readDone(self,job,reg):
+		if (reg is None):
+			self.windowError=True;
+			return;
+		now=time.time();
+		self.storeRegisters(reg,now);
+		self.scheduler.done(reg.keys(),now);
+		self.refreshedRegisters.update(reg.keys());
+		
+#this property is used to check an executed write transaction
+	def writeDone(self,job,result):
+		if (not result):
+			self.windowError=True;
+		#written registers are checked, even if the write failed
+		self.readBack(job.regAddress,len(job.data));
+	
+#this property is used to request the read of written registers and of the registers derived from them
+#they are read in the current window if time is left, attributes decoded from changed ones are published
+	def readBack(self,regAddress,regNb):
+		registers=set(range(regAddress,regAddress+regNb));
+		for reg in range(regAddress,regAddress+regNb):
+			registers.update(derived.value for derived in DERIVED_REGISTERS.get(reg,()));
+		self.scheduler.request(registers);
+		
+#this property is used to queue due register reads in the master window, with the block reads given by the planner
+#registers read back after writes are read first, a refresh request forces the read of all the registers of NORMAL class with the same priority
+#register scan chunks are added if scan is True
+	def refreshRegisters(self,scan=True):
+		#reads not done in previous window are rebuilt according registers still due
+		self.executor.discard(DDWindow.Priority.READBACK,self);
+		self.executor.discard(DDWindow.Priority.POLL,self);
+		self.executor.discard(DDWindow.Priority.SCAN,self);
+		readBackRegisters=set(self.scheduler.requested);
+		readBackBlocks=self.planner.compute(readBackRegisters) if (len(readBackRegisters)!=0) else [];
+		#registers already read in this window are not read again
+		blocks=self.planner.compute(self.scheduler.due(time.time(),self.refreshRequest)-readBackRegisters-self.refreshedRegisters);
+		self.logger.debug('Read back blocks: '+str(readBackBlocks)+' refresh blocks: '+str(blocks)+' expected bus time: '+f"{self.planner.busTime(readBackBlocks+blocks):.3f}"+'s');
+		
+		for regAddress,regNb in readBackBlocks:
+			self.executor.submit(DDWindow.ReadTransaction(self.regulatorAddress,regAddress,regNb,DDWindow.Priority.READBACK,self.readDone),self);
+		priority=DDWindow.Priority.READBACK if self.refreshRequest else DDWindow.Priority.POLL;
+		for regAddress,regNb in blocks:
+			self.executor.submit(DDWindow.ReadTransaction(self.regulatorAddress,regAddress,regNb,priority,self.readDone),self);
+		
+		#register scan chunks, no more than a window can hold, executed only if time is left by polls
+		scanner=self.scanner;
+		if scan and (scanner is not None):
+			chunkNb=max(int(self.executor.WINDOW_DURATION/self.planner.timing.readTime(self.planner.maxRegNb)),1);
+			for regAddress,regNb in scanner.pending(chunkNb):
+				self.executor.submit(DDWindow.ReadTransaction(self.regulatorAddress,regAddress,regNb,DDWindow.Priority.SCAN,
+					lambda job,reg: scanner.chunkDone(job.regAddress,job.regNb,reg,job.outcome)),self);
 		
 		#display register table on standard output
 		#regLine="";
@@ -384,352 +512,509 @@ class Diematic3Panel:
 		#print('==========================================')
 		return(True);
 
-#decoding property to decode Modbus encoded float values	
-	def float10(self,reg):
-		if (reg==0xFFFF):
-			return None;
-		if (reg >= 0x8000):
-			reg=-(reg & 0x7FFF)
-		return(reg*0.1);
+#this property is used to build the private attribute keeping the value of each decoded attribute
+	def indexDecoders(self):
+		#value of a property is saved in its private attribute
+		self.storage={attribute.name:('_'+attribute.name) if isinstance(getattr(type(self),attribute.name,None),property) else attribute.name for attribute in SCHEMA.decoded};
 
-#this property is used to refresh class functionnal attributes with data extracted from the regulator	
-	def refreshAttributes(self):
-		FAN_SPEED_MAX=5900;
+#this property is used to refresh class functionnal attributes with data extracted from the regulator
+#only the attributes decoded from changed registers are refreshed, all of them if changed registers are not given
+	def refreshAttributes(self,registers=None):
+		refreshed=SCHEMA.decoded if (registers is None) else SCHEMA.refreshedBy(registers);
 		
-		#boiler
-		self.availability=True;
-		self._datetime=datetime.datetime(self.registers[DDREGISTER.ANNEE]+2000,self.registers[DDREGISTER.MOIS],self.registers[DDREGISTER.JOUR],self.registers[DDREGISTER.HEURE],self.registers[DDREGISTER.MINUTE],0,0);
-		if self.tzinfo is not None:
-			self._datetime=self.tzinfo.localize(self._datetime);
-		else:
-			self._datetime=self._datetime.astimezone();
-
-		self.type=self.registers[DDREGISTER.BOILER_TYPE];
-		self.release=self.registers[DDREGISTER.CTRL];
-		self.extTemp=self.float10(self.registers[DDREGISTER.TEMP_EXT]);
-		self.temp=self.float10(self.registers[DDREGISTER.TEMP_CHAUD]);
-		self.targetTemp=self.float10(self.registers[DDREGISTER.TCALC_A]);
-		self.returnTemp=self.float10(self.registers[DDREGISTER.RETURN_TEMP]);
-		self.waterPressure=self.float10(self.registers[DDREGISTER.PRESSION_EAU]);
-		self.smokeTemp=self.float10(self.registers[DDREGISTER.SMOKE_TEMP]);
-		self.ionizationCurrent=self.float10(self.registers[DDREGISTER.IONIZATION_CURRENT]);
-		self.fanSpeed=self.registers[DDREGISTER.FAN_SPEED];
-		self.burnerStatus=(self.registers[DDREGISTER.BASE_ECS] & 0x08) >>3;
-		#burner power calculation with fanspeed and ionization current
-		self.burnerPower=round((self.registers[DDREGISTER.FAN_SPEED] / FAN_SPEED_MAX)*100) if (self.ionizationCurrent>0) else 0;
-		self.alarm={'id':None,'txt':None}
-		self.alarm['id']=self.registers[DDREGISTER.ALARME];
-		if (self.alarm['id']==0):
-			self.alarm['txt']='OK';
-		elif (self.alarm['id']==10):
-			self.alarm['txt']='Défaut Sonde Retour';
-		elif (self.alarm['id']==21):
-			self.alarm['txt']='Pression d\'eau basse';
-		elif (self.alarm['id']==26):
-			self.alarm['txt']='Défaut Allumage';
-		elif (self.alarm['id']==27):
-			self.alarm['txt']='Flamme Parasite';
-		elif (self.alarm['id']==28):
-			self.alarm['txt']='STB Chaudière';
-		elif (self.alarm['id']==30):
-			self.alarm['txt']='Rearm. Coffret';	
-		elif (self.alarm['id']==31):
-			self.alarm['txt']='Défaut Sonde Fumée';
-		else:
-			self.alarm['txt']='Défaut inconnu';
-		
-		#hotwater
-		self.hotWaterPump=(self.registers[DDREGISTER.BASE_ECS] & 0x20) >>5;
-		self.hotWaterTemp=self.float10(self.registers[DDREGISTER.TEMP_ECS]);
-		if ((self.registers[DDREGISTER.MODE_A] & 0x50) ==0):
-			self._hotWaterMode='AUTO';
-		elif ((self.registers[DDREGISTER.MODE_A] & 0x50) ==0x50):
-			self._hotWaterMode='TEMP';
-		elif ((self.registers[DDREGISTER.MODE_A] & 0x50) ==0x10):
-			self._hotWaterMode='PERM';
-		else:
-			self._hotWaterMode=None;
-		self._hotWaterDayTargetTemp=self.float10(self.registers[DDREGISTER.CONS_ECS]);
-		self._hotWaterNightTargetTemp=self.float10(self.registers[DDREGISTER.CONS_ECS_NUIT]);
-		
-		#Area A
-		self.zoneATemp=self.float10(self.registers[DDREGISTER.TEMP_AMB_A]);
-		if ( self.zoneATemp is not None):
-			modeA=self.registers[DDREGISTER.MODE_A]& 0x2F;
-			
-			if (modeA==8):
-				self._zoneAMode='AUTO';
-			elif (modeA==36):
-				self._zoneAMode='TEMP JOUR';
-			elif (modeA==34):
-				self._zoneAMode='TEMP NUIT';
-			elif (modeA==4):
-				self._zoneAMode='PERM JOUR';
-			elif (modeA==2):
-				self._zoneAMode='PERM NUIT';
-			elif (modeA==1):
-				self._zoneAMode='ANTIGEL';			
-			self.zoneAPump=(self.registers[DDREGISTER.BASE_ECS] & 0x10) >>4;
-			self.pumpPower=self.registers[DDREGISTER.PUMP_POWER] if (self.zoneAPump==1) else 0;
-			self._zoneADayTargetTemp=self.float10(self.registers[DDREGISTER.CONS_JOUR_A]);
-			self._zoneANightTargetTemp=self.float10(self.registers[DDREGISTER.CONS_NUIT_A]);
-			self._zoneAAntiiceTargetTemp=self.float10(self.registers[DDREGISTER.CONS_ANTIGEL_A]);
-
-		else:
-			self._zoneAMode=None;
-			self.zoneAPump=None;
-			self._zoneADayTargetTemp=None;
-			self._zoneANightTargetTemp=None;
-			self._zoneAAntiiceTargetTemp=None;
-
-				
-		#Area B
-		self.zoneBTemp=self.float10(self.registers[DDREGISTER.TEMP_AMB_B]);
-		if ( self.zoneBTemp is not None):
-			modeB=self.registers[DDREGISTER.MODE_B]& 0x2F;
-			if (modeB==8):
-				self._zoneBMode='AUTO';
-			elif (modeB==36):
-				self._zoneBMode='TEMP JOUR';
-			elif (modeB==34):
-				self._zoneBMode='TEMP NUIT';
-			elif (modeB==4):
-				self._zoneBMode='PERM JOUR';
-			elif (modeB==2):
-				self._zoneBMode='PERM NUIT';
-			elif (modeB==1):
-				self._zoneBMode='ANTIGEL';
-				
-			self.zoneBPump=(self.registers[DDREGISTER.OPTIONS_B_C] & 0x10) >>4;
-			self._zoneBDayTargetTemp=self.float10(self.registers[DDREGISTER.CONS_JOUR_B]);
-			self._zoneBNightTempTarget=self.float10(self.registers[DDREGISTER.CONS_NUIT_B]);
-			self._zoneBAntiiceTempTarget=self.float10(self.registers[DDREGISTER.CONS_ANTIGEL_B]);
-
-		else:
-			self._zoneBMode=None;
-			self.zoneBPump=None;
-			self._zoneBDayTargetTemp=None;
-			self._zoneBNightTempTarget=None;
-			self._zoneBAntiiceTempTarget=None;
-
-		self.updateCallback();
+		attributes=set();
+		if not self.availability:
+			self.availability=True;
+			attributes.add('availability');
+		storage=self.storage;
+		for attribute in refreshed:
+			if attribute.decode is not None:
+				setattr(self,storage[attribute.name],attribute.decode(self));
+			attributes.add(attribute.name);
+		
+		self.updateCallback(attributes if (registers is not None) else None);
 
+#boiler clock decoding
+	def decodeDatetime(self):
+		value=datetime.datetime(self.registers[DDREGISTER.ANNEE]+2000,self.registers[DDREGISTER.MOIS],self.registers[DDREGISTER.JOUR],self.registers[DDREGISTER.HEURE],self.registers[DDREGISTER.MINUTE],0,0);
+		if self.tzinfo is not None:
+			return self.tzinfo.localize(value);
+		return value.astimezone();
 
-#this property is used by the Modbus loop to set register dedicated to Mode A and hotwater mode (in case of no usage of B area)		
-	def modeAUpdate(self):
-		#if mode A register update request is pending
-		if (not(self.zoneAModeUpdateRequest.empty()) or (not(self.hotWaterModeUpdateRequest.empty()) and (self.zoneBMode is None))):
-			#get current mode
-			currentMode=self.modBusInterface.masterReadAnalog(self.regulatorAddress,DDREGISTER.MODE_A.value,1);
-			#in case of success
-			if (currentMode):
-				mode=currentMode[DDREGISTER.MODE_A];
-				self.logger.info('Mode A current value :'+str(mode));
-				
-				#update mode with mode requests					
-				if (not(self.zoneAModeUpdateRequest.empty())):
-					mode= (mode & 0x50) | self.zoneAModeUpdateRequest.get();
-					
-				if (not(self.hotWaterModeUpdateRequest.empty()) and (self.zoneBMode is None)):
-					mode= (mode & 0x2F) | self.hotWaterModeUpdateRequest.get();
-
-				self.logger.info('Mode A next value :'+str(mode));
-				#specific case for antiice request
-				#following write procedure is an empirical solution to have remote control refresh while updating mode
-				if (mode==1):
-					#set antiice day number to 1
-					self.modBusInterface.masterWriteAnalog(self.regulatorAddress,DDREGISTER.NB_JOUR_ANTIGEL.value,[1]);
-					time.sleep(0.5);
-					#set antiice day number to 0
-					self.modBusInterface.masterWriteAnalog(self.regulatorAddress,DDREGISTER.NB_JOUR_ANTIGEL.value,[0]);
-					#set mode A number to requested value
-					self.modBusInterface.masterWriteAnalog(self.regulatorAddress,DDREGISTER.MODE_A.value,[mode]);
-
-				#general case
-				#following write procedure is an empirical solution to have remote control refresh while updating mode
-				else:
-					#set mode A
-					self.modBusInterface.masterWriteAnalog(self.regulatorAddress,DDREGISTER.MODE_A.value,[mode]);
-					#set antiice day number to 1
-					self.modBusInterface.masterWriteAnalog(self.regulatorAddress,DDREGISTER.NB_JOUR_ANTIGEL.value,[1]);
-					#set mode A again
-					self.modBusInterface.masterWriteAnalog(self.regulatorAddress,DDREGISTER.MODE_A.value,[mode]);
-					time.sleep(0.5);
-					#set mode A again
-					self.modBusInterface.masterWriteAnalog(self.regulatorAddress,DDREGISTER.MODE_A.value,[mode]);
-					#set antiice day number to 0
-					self.modBusInterface.masterWriteAnalog(self.regulatorAddress,DDREGISTER.NB_JOUR_ANTIGEL.value,[0]);
+#burner power calculation with fanspeed and ionization current
+	def decodeBurnerPower(self):
+		FAN_SPEED_MAX=5900;
+		
+		ionizationCurrent=DDSchema.float10(self.registers[DDREGISTER.IONIZATION_CURRENT]);
+		return round((self.registers[DDREGISTER.FAN_SPEED] / FAN_SPEED_MAX)*100) if (ionizationCurrent>0) else 0;
+
+#zone A pump power, 0 when the pump is stopped
+	def decodePumpPower(self):
+		return self.registers[DDREGISTER.PUMP_POWER] if (self.registers[DDREGISTER.BASE_ECS] & 0x10) else 0;
+
+#alarm decoding
+	def decodeAlarm(self):
+		alarm=self.registers[DDREGISTER.ALARME];
+		return {'id':alarm,'txt':ALARM_TEXTS.get(alarm,'Défaut inconnu')};
+
+#this property gives the zones whose mode register has to be updated, with their mode register and mode request
+#hot water mode is set in the mode register of zone B when zone B is used, of zone A otherwise
+	def modeZones(self):
+		hotWaterZone='B' if self.zoneBMode else 'A';
+		zones=list();
+		for name,register,request in (('A',DDREGISTER.MODE_A,self.zoneAModeUpdateRequest),('B',DDREGISTER.MODE_B,self.zoneBModeUpdateRequest)):
+			if (not request.empty()) or ((name==hotWaterZone) and not self.hotWaterModeUpdateRequest.empty()):
+				zones.append((name,register,request));
+		return zones;
+
+#this property gives the mode update sequence of zones, executed by the master window executor
+#following write procedure is an empirical solution to have remote control refresh while updating mode
+#zones updated in the same window share the antiice day number toggle, antiice mode is written once the toggle is done
+	def modeUpdateSequence(self,zones):
+		address=self.regulatorAddress;
+		#mode writes of the zones in antiice mode or in other modes
+		def modeWrites(antiice):
+			return [DDWindow.WriteStep(address,register.value,lambda context,name=name: [context['modes'][name]] if (name in context['modes']) and ((context['modes'][name]==1)==antiice) else None)
+				for name,register,request in zones];
+		steps=[DDWindow.ReadStep(address,register.value,1,name,False) for name,register,request in zones];
+		steps.append(DDWindow.CallStep(lambda context: self.modeValues(context,zones)));
+		steps.append(DDWindow.ConditionStep(lambda context: len(context['modes'])!=0,
+			modeWrites(False)+
+			[DDWindow.WriteStep(address,DDREGISTER.NB_JOUR_ANTIGEL.value,[1])]+
+			modeWrites(False)+
+			[DDWindow.DelayStep(0.5)]+
+			modeWrites(False)+
+			[DDWindow.WriteStep(address,DDREGISTER.NB_JOUR_ANTIGEL.value,[0])]+
+			modeWrites(True)+
+			#mode registers check
+			[DDWindow.CallStep(lambda context: [self.readBack(register.value,1) for name,register,request in zones if name in context['modes']])]));
+		return steps;
+
+#this property is used to compute the new value of mode registers from their current value and the mode requests
+#a zone whose mode register can't be read keeps its request for next window
+	def modeValues(self,context,zones):
+		hotWaterZone='B' if self.zoneBMode else 'A';
+		context['modes']=dict();
+		for name,register,request in zones:
+			if context[name] is None:
+				continue;
+			mode=context[name][register];
+			self.logger.info('Mode '+name+' current value :'+str(mode));
+			if not request.empty():
+				mode= (mode & SCHEMA['hotWaterMode'].mask) | request.get();
+			if (name==hotWaterZone) and not self.hotWaterModeUpdateRequest.empty():
+				mode= (mode & SCHEMA['zone'+name+'Mode'].mask) | self.hotWaterModeUpdateRequest.get();
+			self.logger.info('Mode '+name+' next value :'+str(mode));
+			context['modes'][name]=mode;
+
+#this property is used to queue mode and register write requests in the master window
+	def writeRequests(self):
+		#mode registers update if needed, a new sequence is built once the previous one is done
+		zones=self.modeZones();
+		queued=any(isinstance(job,DDWindow.Sequence) for job in self.executor.pending(DDWindow.Priority.WRITE,self));
+		if (len(zones)!=0) and not queued:
+			job=DDWindow.Sequence('modeUpdate '+','.join(name for name,register,request in zones),self.modeUpdateSequence(zones));
+			job.queueTime=DDWindow.requestTime(self.zoneAModeUpdateRequest,self.zoneBModeUpdateRequest,self.hotWaterModeUpdateRequest);
+			self.executor.submit(job,self);
+		
+		#general register update requests, writes carried over from previous window are merged with new requests
+		for job in self.executor.pending(DDWindow.Priority.WRITE,self):
+			if isinstance(job,DDWindow.WriteTransaction):
+				regSet=DDModbus.RegisterSet(job.regAddress,job.data);
+				regSet.requestTime=job.queueTime;
+				self.regUpdateRequest.restore(regSet);
+				self.executor.jobs.remove(job);
+		for regSet in self.regUpdateRequest.pop():
+			self.logger.debug('Write Request :'+str(regSet.address)+':'+str(regSet.data));
+			job=DDWindow.WriteTransaction(self.regulatorAddress,regSet.address,regSet.data,DDWindow.Priority.WRITE,self.writeDone);
+			job.queueTime=regSet.requestTime;
+			self.executor.submit(job,self);
+
+#this property is used to prepare the exchanges with the regulators during the boiler slave window
+	def beginWindow(self):
+		#window lasts until next boiler master phase if it can be predicted
+		self.executor.begin(self.lastFrameTime,self.phase.nextBurstTime());
+		for panel in self.regulators():
+			panel.beginRegulatorWindow();
+
+#this property is used to prepare the exchanges with the regulator
+	def beginRegulatorWindow(self):
+		self.windowError=False;
+		self.refreshedRegisters=set();
+		#writes
+		self.writeRequests();
+
+#this property is used to process the result of the exchanges with the regulators at the end of the boiler slave window
+	def endWindow(self):
+		self.logger.debug('Master window utilization: '+f"{self.executor.utilization():.2f}"+' converter latency: '+f"{self.planner.timing.latency:.3f}"+'s');
+		for panel in self.regulators():
+			panel.endRegulatorWindow();
+		self.attachedSynchroTimeout();
+		#bus errors are counted only if no regulator answered
+		if any(len(panel.refreshedRegisters)!=0 for panel in self.regulators()):
+			self.connection.success();
+		elif any(panel.windowError for panel in self.regulators()):
+			self.connection.error();
+
+#this property is used to process the result of the exchanges with the regulator
+	def endRegulatorWindow(self):
+		if (self.windowError):
+			#Cancel Master Slave Synchro Flag in case of error
+			self.logger.warning('ModBus Master Slave Synchro Error, regulator '+hex(self.regulatorAddress));
+			self.masterSlaveSynchro=False;
+			if self.metrics is not None:
+				self.metrics.synchroLoss();
+		
+		if (len(self.refreshedRegisters)!=0):
+			self.lastSynchroTimestamp=time.time();
+			self.lastRefreshTime=self.lastSynchroTimestamp;
 			
-				#request register refresh
-				self.refreshRequest=True;
-
-#this property is used by the Modbus loop to set register dedicated to Mode B and hotwater mode (in case of usage of B area)					
-	def modeBUpdate(self):
-		#if mode B register update request is pending
-		if (not(self.zoneBModeUpdateRequest.empty()) or (not(self.hotWaterModeUpdateRequest.empty()) and (self.zoneBMode))):
-			#get current mode
-			currentMode=self.modBusInterface.masterReadAnalog(self.regulatorAddress,DDREGISTER.MODE_B.value,1);
-			#in case of success
-			if (currentMode):
-				mode=currentMode[DDREGISTER.MODE_B];
-				self.logger.info('Mode B current value :'+str(mode));
-				
-				#update mode with mode requests					
-				if (not(self.zoneBModeUpdateRequest.empty())):
-					mode= (mode & 0x50) | self.zoneBModeUpdateRequest.get();
-					
-				if (not(self.hotWaterModeUpdateRequest.empty()) and (self.zoneBMode)):
-					mode= (mode & 0x2F) | self.hotWaterModeUpdateRequest.get();
-
-				self.logger.info('Mode B next value :'+str(mode));
-				#specific case for antiice request
-				#following write procedure is an empirical solution to have remote control refresh while updating mode
-				if (mode==1):
-					#set antiice day number to 1
-					self.modBusInterface.masterWriteAnalog(self.regulatorAddress,DDREGISTER.NB_JOUR_ANTIGEL.value,[1]);
-					time.sleep(0.5);
-					#set antiice day number to 0
-					self.modBusInterface.masterWriteAnalog(self.regulatorAddress,DDREGISTER.NB_JOUR_ANTIGEL.value,[0]);
-					#set mode B number to requested value
-					self.modBusInterface.masterWriteAnalog(self.regulatorAddress,DDREGISTER.MODE_B.value,[mode]);
-
-				#general case
-				#following write procedure is an empirical solution to have remote control refresh while updating mode
-				else:
-					#set mode B
-					self.modBusInterface.masterWriteAnalog(self.regulatorAddress,DDREGISTER.MODE_B.value,[mode]);
-					#set antiice day number to 1
-					self.modBusInterface.masterWriteAnalog(self.regulatorAddress,DDREGISTER.NB_JOUR_ANTIGEL.value,[1]);
-					#set mode B again
-					self.modBusInterface.masterWriteAnalog(self.regulatorAddress,DDREGISTER.MODE_B.value,[mode]);
-					time.sleep(0.5);
-					#set mode B again
-					self.modBusInterface.masterWriteAnalog(self.regulatorAddress,DDREGISTER.MODE_B.value,[mode]);
-					#set antiice day number to 0
-					self.modBusInterface.masterWriteAnalog(self.regulatorAddress,DDREGISTER.NB_JOUR_ANTIGEL.value,[0]);
+		#refresh regulator attributes depending on changed read or harvested registers, all of them after an attributes reset
+		if (((len(self.refreshedRegisters)!=0) or (len(self.changedRegisters)!=0)) and self.registersComplete()):
+			self.refreshAttributes(self.changedRegisters if self.availability else None);
+			self.changedRegisters=set();
+		
+		#register scan progress saving and publishing
+		scanner=self.scanner;
+		if (scanner is not None) and not scanner.saved:
+			try:
+				scanner.save();
+			except OSError as exc:
+				self.logger.error('Register scan stopped, file error: '+str(exc));
+				self.scanner=None;
+			self.updateCallback({'scanStatus'});
+		
+		#clear Flag once all requested reads are done
+		if (len(self.executor.pending(DDWindow.Priority.READBACK,self))==0) and not self.windowError:
+			self.refreshRequest=False;
+		
+		#check time drift when boiler clock has been read
+		if ((DDREGISTER.MINUTE.value in self.refreshedRegisters) and (self.datetime is not None)):
+			now = datetime.datetime.now().astimezone();
+			self.logger.debug('Now :' + str(now));
+			self.logger.debug('Boiler :' + str(self.datetime));
+			drift = (now - self.datetime).total_seconds();
+			self.logger.debug('Drift :' + str(drift));
 			
-				#request refresh
-				self.refreshRequest=True;					
+			#if drift is more than 60 s
+			if (self.syncTime and abs(drift) >=60):
+				self.overDriftCounter+=1;
+				self.logger.debug('Drift Counter:' + str(self.overDriftCounter));
+				# more than 6 successive times
+				if (self.overDriftCounter >=6):
+					#boiler time is set
+					self.overDriftCounter=0;
+					self.logger.critical('Sync Time: Set boiler time to :' + str(now));
+					self.datetime=now;
+			else:
+				self.overDriftCounter=0;
+
+#this property is used to exchange with the regulator during the boiler slave window
+#writes are done first, then due register reads which are also done during the delays of mode sequences
+#registers read back after the writes are then read, jobs which don't fit in the window are carried over to the next one
+	def masterWindow(self):
+		start=time.time();
+		self.beginWindow();
+		for panel in self.regulators():
+			panel.refreshRegisters(False);
+		self.executor.run();
+		#reads, including read back of written registers
+		for panel in self.regulators():
+			panel.refreshRegisters();
+		self.executor.run();
+		self.endWindow();
+		if self.metrics is not None:
+			self.metrics.window(self.executor.utilization(),time.time()-start);
+
+#asyncio version of masterWindow
+	async def amasterWindow(self):
+		start=time.time();
+		self.beginWindow();
+		for panel in self.regulators():
+			panel.refreshRegisters(False);
+		await self.executor.arun();
+		#reads, including read back of written registers
+		for panel in self.regulators():
+			panel.refreshRegisters();
+		await self.executor.arun();
+		self.endWindow();
+		if self.metrics is not None:
+			self.metrics.window(self.executor.utilization(),time.time()-start);
+
+#this property is used to init the bus state machine
+	def initLoop(self):
+		self.masterSlaveSynchro=False 
+		#reset timeout
+		self.lastSynchroTimestamp=time.time();
+		for panel in self.attached:
+			panel.lastSynchroTimestamp=time.time();
+		self.lastFrameTime=time.time();
+
+#this property is used to reset the bus state machine, boiler cycle is learned again
+	def resync(self):
+		self.busStatus=DDModBusStatus.INIT;
+		self.masterSlaveSynchro=False;
+		self.phase.reset();
+		self.lastFrameTime=time.time();
+
+#this property gives the recovery action to do after bus errors or a too long bus silence
+	def recoveryTier(self):
+		tier=self.connection.tier(self.modBusInterface.connected,time.time()-self.lastFrameTime,self.phase.period);
+		if (tier!=DDConnection.RecoveryTier.NONE):
+			if self.metrics is not None:
+				self.metrics.recovery(tier);
+			self.logger.warning('Bus recovery: '+tier.name+' after '+str(self.connection.errors)+' error(s), silence '+f"{time.time()-self.lastFrameTime:.1f}"+'s');
+		if (tier==DDConnection.RecoveryTier.RECONNECT):
+			self.closeConnection();
+		elif (tier==DDConnection.RecoveryTier.RESYNC):
+			self.resync();
+		return tier;
+
+#this property is used to process a frame received from the boiler
+	def frameReceived(self,frame):
+		#save registers written by the boiler
+		if (self.sniffing):
+			self.harvestRegisters(frame);
+		
+		#boiler is silent since last frame
+		now=time.time();
+		self.lastFrameTime=frame.lastByteTime if (frame.lastByteTime is not None) else now;
+		self.phase.frame(frame.firstByteTime if (frame.firstByteTime is not None) else now,self.lastFrameTime);
+		
+		if (self.busStatus!=DDModBusStatus.SLAVE):
+			#switch mode to slave
+			self.busStatus=DDModBusStatus.SLAVE;
+			self.slaveTime=time.time();
+			self.logger.debug('Bus status switched to SLAVE');
+
+#this property gives the time at which the bus will switch to MASTER if no frame is received
+	def masterSwitchTime(self):
+		if (self.busStatus!=DDModBusStatus.SLAVE):
+			return None;
+		#slave happen during at least 5s and no frame have been received since the rx timeout
+		switchTime=max(self.slaveTime+5,self.lastFrameTime+DDModbus.DDModbus.SLAVE_RX_TIMEOUT);
+		#or last frame of the boiler master phase, as predicted by the cycle tracker
+		predictedTime=self.phase.switchTime();
+		if (predictedTime is not None):
+			switchTime=min(switchTime,predictedTime);
+		return switchTime;
+
+#this property is used to switch the bus to MASTER
+	def switchToMaster(self):
+		#switch mode to MASTER
+		slaveModeDuration=time.time()-self.slaveTime;
+		self.masterTime=time.time();
+		self.phase.masterSwitch(self.masterTime,max(self.slaveTime+5,self.lastFrameTime+DDModbus.DDModbus.SLAVE_RX_TIMEOUT));
+		self.busStatus=DDModBusStatus.MASTER;
+		self.logger.debug('Bus status switched to MASTER after '+str(slaveModeDuration));
+		
+		#if the state wasn't still synchronised
+		if (not self.masterSlaveSynchro):
+			self.logger.info('ModBus Master Slave Synchro OK');
+			self.masterSlaveSynchro=True;
 
-#modbus loop, shall run in a specific thread. Allow to exchange register values with the Dielatic regulator
-	def loop(self):
+#this property gives the time at which the interface is reset if no successful exchange happen
+	def synchroTimeoutTime(self):
 		#parameter validity duration in seconds after expiration of period
-		#after this timeout, interface is reset
 		VALIDITY_TIME=30
+		return self.lastSynchroTimestamp+self.refreshPeriod+VALIDITY_TIME;
+
+#this property is used to reset the attributes of attached regulators after their synchro timeout, bus connection is kept
+	def attachedSynchroTimeout(self):
+		for panel in self.attached:
+			if (time.time() > panel.synchroTimeoutTime()):
+				panel.synchroTimeout();
+
+#this property is used to reset the regulator attributes on synchro timeout, connection is closed by the caller
+	def synchroTimeout(self):
+		#log
+		self.logger.warning('Synchro timeout');
+		if self.metrics is not None:
+			self.metrics.synchroTimeout();
+		#init regulator register
+		self.initAttributes();
+		#publish values
+		self.updateCallback();
+		self.refreshRequest=True;
+		#boiler cycle is learned again
+		self.phase.reset();
+		self.attachedSynchroTimeout();
+		#reset timeout
+		self.lastSynchroTimestamp=time.time();
+
+#modbus loop, shall run in a specific thread. Allow to exchange register values with the Dielatic regulator
+	def loop(self):
 		try:
-			self.masterSlaveSynchro=False 
-			self.run=True;
-			#reset timeout
-			self.lastSynchroTimestamp=time.time();
+			self.initLoop();
 			while self.run:
-				#wait for a frame received
-				frame=self.modBusInterface.slaveRx();
-
-				#depending current bus mode	
-				if (self.busStatus!=DDModBusStatus.SLAVE):
-					if (frame):
-						#switch mode to slave
-						self.busStatus=DDModBusStatus.SLAVE;
-						self.slaveTime=time.time();
-						self.logger.debug('Bus status switched to SLAVE');
-						
-				elif (self.busStatus==DDModBusStatus.SLAVE):
-					slaveModeDuration=time.time()-self.slaveTime;
-					#if no frame have been received and slave happen during at least 5s
-					if ((not frame) and (slaveModeDuration>5)):
-						#switch mode to MASTER
-						self.masterTime=time.time();
-						self.busStatus=DDModBusStatus.MASTER;
-						self.logger.debug('Bus status switched to MASTER after '+str(slaveModeDuration));
-						
-						#if the state wasn't still synchronised
-						if (not self.masterSlaveSynchro):
-							self.logger.info('ModBus Master Slave Synchro OK');
-							self.masterSlaveSynchro=True;
-							
-						#mode A register update if needed
-						self.modeAUpdate();
-						
-						#mode B register update if needed
-						self.modeBUpdate();
-								
-						#while general register update request are pending and Master mode is started since less than 2s
-						while (not(self.regUpdateRequest.empty()) and ((time.time()-self.masterTime) < 2)):
-							regSet=self.regUpdateRequest.get(False)
-							self.logger.debug('Write Request :'+str(regSet.address)+':'+str(regSet.data));
-							#write to Analog registers
-							if ( not self.modBusInterface.masterWriteAnalog(self.regulatorAddress,regSet.address,regSet.data)):
-								#And cancel Master Slave Synchro Flag in case of error
-
-								self.logger.warning('ModBus Master Slave Synchro Error');
-								self.masterSlaveSynchro=False;
-							self.refreshRequest=True;
-							
-						
-						#update registers, todo condition for refresh launch
-						if (((time.time()-self.lastSynchroTimestamp) > (self.refreshPeriod-5)) or self.refreshRequest):
-							if (self.refreshRegisters()):
-								self.lastSynchroTimestamp=time.time();
-							
-								#refresh regulator attribute
-								self.refreshAttributes();
-								
-								#clear Flag
-								self.refreshRequest=False;
-								
-								#check time drift
-								now = datetime.datetime.now().astimezone();
-								self.logger.debug('Now :' + str(now));
-								self.logger.debug('Boiler :' + str(self.datetime));
-								drift = (now - self.datetime).total_seconds();
-								self.logger.debug('Drift :' + str(drift));
-								
-								#if drift is more than 60 s
-								if (self.syncTime and abs(drift) >=60):
-									self.overDriftCounter+=1;
-									self.logger.debug('Drift Counter:' + str(self.overDriftCounter));
-									# more than 6 successive times
-									if (self.overDriftCounter >=6):
-										#boiler time is set
-										self.overDriftCounter=0;
-										self.logger.critical('Sync Time: Set boiler time to :' + str(now));
-										self.datetime=now;
-								else:
-									self.overDriftCounter=0;
-									
-							else:
-								#Cancel Master Slave Synchro Flag in case of error
-								self.logger.warning('ModBus Master Slave Synchro Error');
-								self.masterSlaveSynchro=False;
+				#(re)connection to the converter, spaced by the connection manager backoff
+				if (self.modBusInterface is None):
+					#regulator attributes are not kept while the converter can't be reached
+					if (time.time() > self.synchroTimeoutTime()):
+						self.synchroTimeout();
+					delay=self.connection.connectDelay();
+					if (delay > 0):
+						time.sleep(min(delay,DDModbus.DDModbus.SLAVE_RX_TIMEOUT));
+						continue;
+					if not self.connect():
+						continue;
+				
+				#wait for a frame received, until bus switch to MASTER
+				timeout=DDModbus.DDModbus.SLAVE_RX_TIMEOUT;
+				switchTime=self.masterSwitchTime();
+				if (switchTime is not None):
+					timeout=min(timeout,max(switchTime-time.time(),0.001));
+				frame=self.modBusInterface.slaveRx(timeout);
+				if (frame):
+					self.frameReceived(frame);
+				
+				#if no frame have been received and slave happen during at least 5s or last boiler frame has been received
+				elif (switchTime is not None) and (time.time() >= switchTime-self.SWITCH_TOLERANCE):
+					self.switchToMaster();
+					#exchange with the regulator during boiler silence
+					self.masterWindow();
 								
-				if ((time.time()-self.lastSynchroTimestamp) > self.refreshPeriod + VALIDITY_TIME):
-					#log
-					self.logger.warning('Synchro timeout');
-					#init regulator register
-					self.initAttributes();
-					#publish values
-					self.updateCallback();
+				#after this timeout, interface is reset
+				if (time.time() > self.synchroTimeoutTime()):
+					self.synchroTimeout();
 					#reinit connection
-					self.initConnection();
-					self.refreshRequest=True;
-					#reset timeout
-					self.lastSynchroTimestamp=time.time();
-					
+					self.closeConnection();
+				#lighter recovery depending on errors and bus silence
+				elif (self.recoveryTier()==DDConnection.RecoveryTier.CLEAN):
+					self.modBusInterface.clean();
 
 			self.logger.critical('Modbus Thread stopped');
 		except BaseException as exc:		
 			self.logger.exception(exc)
+		finally:
+			self.closeConnection();
+
+#asyncio RS485 converter connexion init
+	async def ainitConnection(self):
+		self.closeConnection();
+		self.connection.attempt();
+		self.modBusInterface=DDModbusAsync.AsyncDDModbus(self.ip,self.port);
+		self.modBusInterface.metrics=self.metrics;
+		self.executor.bus=self.modBusInterface;
+		await self.modBusInterface.connect();
+		self.logger.warning('Init Link with Regulator');
+		await self.modBusInterface.clean();
+		self.resync();
+		self.connection.connected();
+		if (self.metrics is not None) and (self.connection.connects > 1):
+			self.metrics.reconnect();
+	
+	async def aconnect(self):
+		try:
+			await self.ainitConnection();
+			return True;
+		except (OSError,asyncio.TimeoutError) as exc:
+			self.connectFailed(exc);
+			return False;
+
+#asyncio modbus loop, woken up by received frames or by the next bus event time instead of a periodic timeout
+#it can share its event loop with other coroutines like an asyncio MQTT client
+	async def aloop(self):
+		try:
+			self.asyncTask=asyncio.current_task();
+			self.initLoop();
+			while self.run:
+				#(re)connection to the converter, spaced by the connection manager backoff
+				if (self.modBusInterface is None):
+					#regulator attributes are not kept while the converter can't be reached
+					if (time.time() > self.synchroTimeoutTime()):
+						self.synchroTimeout();
+					delay=self.connection.connectDelay();
+					if (delay > 0):
+						await asyncio.sleep(min(delay,max(self.synchroTimeoutTime()-time.time(),0.001)));
+						continue;
+					if not await self.aconnect():
+						continue;
+				
+				#wait for a frame until next bus event
+				deadline=min(self.synchroTimeoutTime(),self.lastFrameTime+self.connection.silenceTimeout(self.phase.period));
+				switchTime=self.masterSwitchTime();
+				if (switchTime is not None):
+					deadline=min(deadline,switchTime);
+				frame=await self.modBusInterface.slaveRx(max(deadline-time.time(),0));
+				if (frame):
+					self.frameReceived(frame);
+				
+				elif (switchTime is not None) and (time.time() >= switchTime-self.SWITCH_TOLERANCE):
+					self.switchToMaster();
+					#exchange with the regulator during boiler silence
+					await self.amasterWindow();
+				
+				#after this timeout, interface is reset
+				if (time.time() > self.synchroTimeoutTime()):
+					self.synchroTimeout();
+					#reinit connection
+					self.closeConnection();
+				#lighter recovery depending on errors and bus silence
+				elif (self.recoveryTier()==DDConnection.RecoveryTier.CLEAN):
+					await self.modBusInterface.clean();
+					
+			self.logger.critical('Modbus loop stopped');
+		except asyncio.CancelledError:
+			self.logger.critical('Modbus loop stopped');
+		except BaseException as exc:
+			self.logger.exception(exc)
+		finally:
+			self.closeConnection();
 
-#property used to launch Modbus loop			
-	def loop_start(self):
+#property used to launch Modbus loop, with asyncio engine the event loop runs in the thread
+#or in the given event loop, which can be shared by several panels
+	def loop_start(self,asyncLoop=None):
+			self.run=True;
 			#launch loop
-			self.loopThread = threading.Thread(target=self.loop)
+			if self.asyncEngine and (asyncLoop is not None):
+				self.asyncLoop=asyncLoop;
+				self.loopFuture=asyncio.run_coroutine_threadsafe(self.aloop(),asyncLoop);
+				return;
+			if self.asyncEngine:
+				self.asyncLoop=asyncio.new_event_loop();
+				self.loopThread = threading.Thread(target=self.asyncLoop.run_until_complete,args=(self.aloop(),));
+			else:
+				self.loopThread = threading.Thread(target=self.loop)
 			self.loopThread.start();
 			
+#property used to check that the Modbus loop is running
+	def alive(self):
+		if (self.loopFuture is not None):
+			return not self.loopFuture.done();
+		return (self.loopThread is not None) and self.loopThread.is_alive();
+	
 #property used to stop Modbus loop	
 	def loop_stop(self):
 		self.run=False;
-		self.loopThread.join();
-		#reinit Regulator
-		self.initAttributes();
-		self.updateCallback();
+		if self.asyncEngine and (self.asyncTask is not None):
+			#wake up the loop waiting for a frame
+			self.asyncLoop.call_soon_threadsafe(self.asyncTask.cancel);
+		if (self.loopFuture is not None):
+			self.loopFuture.result();
+		else:
+			self.loopThread.join();
+		#reinit Regulators
+		for panel in self.regulators():
+			panel.initAttributes();
+			panel.updateCallback();
+
+#property of a writable attribute, decoded value is kept in its private attribute
+#a requested value is encoded with the attribute schema, mode values are given to their pending request
+def writableProperty(attribute):
+	storage='_'+attribute.name;
+	def getter(self):
+		return getattr(self,storage);
+	def setter(self,x):
+		self.logger.debug(attribute.name+' requested:'+str(x));
+		value=attribute.encode(x);
+		if value is None:
+			self.logger.warning(attribute.name+' value error :'+str(x));
+		elif attribute.request is not None:
+			getattr(self,attribute.request).put(value);
+		else:
+			self.regUpdateRequest.put(DDModbus.RegisterSet(attribute.register.value,[value]));
+	return property(getter,setter);
+
+for attribute in SCHEMA.writable:
+	setattr(Diematic3Panel,attribute.name,writableProperty(attribute));
@@ -1,7 +1,7 @@
 ﻿#!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-import logging,json
+import logging,json,re
 	
 #This class allow to interface with Home Assistant through the MQTT Discovery Protocol
 class Hassio:
@@ -12,6 +12,8 @@ class Hassio:
 		self.logger = logging.getLogger(__name__);
 		#attribute init
 		self.availabilityTopic=None;
+		self.bridgeTopic=None;
+		self.states=dict();
 		#mqttClient instance ref saving
 		self.mqtt=mqttClient;
 		self.topicRoot=topicRoot;
@@ -25,6 +27,35 @@ class Hassio:
 		self.payload_available=payload_available;
 		self.payload_not_available=payload_not_available;
 	
+	#status topic of the process publishing the messages of several boilers, entities need both to be available
+	def bridgeInfo(self,bridgeTopic):
+		self.bridgeTopic=bridgeTopic;
+	
+	def availability(self,payload):
+		if (self.bridgeTopic is None):
+			payload["availability_topic"]=self.availabilityTopic;
+			payload["payload_available"]=self.payload_available;
+			payload["payload_not_available"]=self.payload_not_available;
+		else:
+			payload["availability"]=[{"topic":topic,"payload_available":self.payload_available,"payload_not_available":self.payload_not_available} for topic in (self.availabilityTopic,self.bridgeTopic)];
+			payload["availability_mode"]="all";
+	
+	#states published in JSON documents : short state topic to (document short topic, key)
+	def jsonStates(self,states):
+		self.states=states;
+	
+	#state topic and value template of an entity, value is extracted from the JSON document if its state is in one
+	def state(self,payload,shortStateTopic,valueTemplate=None):
+		if (shortStateTopic in self.states):
+			shortStateTopic,key=self.states[shortStateTopic];
+			if (valueTemplate is None):
+				valueTemplate="{{ value_json."+key+" }}";
+			else:
+				valueTemplate=re.sub(r'\bvalue(_json)?\b','value_json.'+key,valueTemplate);
+		payload["state_topic"]=self.topicRoot+'/'+shortStateTopic;
+		if (valueTemplate is not None):
+			payload["value_template"]=valueTemplate;
+	
 	def addSensor(self,object_id,name,deviceClass,shortStateTopic,valueTemplate,unit_of_measurement):
 		#build discovery topic
 		discoveryTopic=self.discovery_prefix+'/sensor/'+self.clientId+'/'+object_id+'/config';
@@ -34,12 +65,8 @@ class Hassio:
 		payload["unique_id"]=self.clientId+'.'+object_id;
 		if (deviceClass is not None):
 			payload["device_class"]=deviceClass;
-		payload["state_topic"]=self.topicRoot+'/'+shortStateTopic;
-		if (valueTemplate is not None):
-			payload["value_template"]=valueTemplate;
-		payload["availability_topic"]=self.availabilityTopic;
-		payload["payload_available"]=self.payload_available;
-		payload["payload_not_available"]=self.payload_not_available;
+		self.state(payload,shortStateTopic,valueTemplate);
+		self.availability(payload);
 		if (unit_of_measurement is not None):
 			payload["unit_of_measurement"]=unit_of_measurement;
 		#send discovery message
@@ -54,12 +81,10 @@ class Hassio:
 		payload["unique_id"]=self.clientId+'.'+object_id;
 		if (deviceClass is not None):
 			payload["device_class"]=deviceClass;
-		payload["state_topic"]=self.topicRoot+'/'+shortStateTopic;
+		self.state(payload,shortStateTopic);
 		payload["payload_on"]=payload_on;
 		payload["payload_off"]=payload_off;
-		payload["availability_topic"]=self.availabilityTopic;
-		payload["payload_available"]=self.payload_available;
-		payload["payload_not_available"]=self.payload_not_available;
+		self.availability(payload);
 		payload["enabled_by_default"]=False;
 		#send discovery message
 		self.mqtt.publish(discoveryTopic,json.dumps(payload),1,False);
@@ -71,11 +96,9 @@ class Hassio:
 		payload={"name":name};
 		payload["object_id"]=object_id;
 		payload["unique_id"]=self.clientId+'.'+object_id;
-		payload["state_topic"]=self.topicRoot+'/'+shortStateTopic;
+		self.state(payload,shortStateTopic);
 		payload["command_topic"]=self.topicRoot+'/'+shortCommandTopic;
-		payload["availability_topic"]=self.availabilityTopic;
-		payload["payload_available"]=self.payload_available;
-		payload["payload_not_available"]=self.payload_not_available;
+		self.availability(payload);
 		payload["qos"]=2;
 		payload["min"]=min;
 		payload["max"]=max;
@@ -92,11 +115,9 @@ class Hassio:
 		payload={"name":name};
 		payload["object_id"]=object_id;
 		payload["unique_id"]=self.clientId+'.'+object_id;
-		payload["state_topic"]=self.topicRoot+'/'+shortStateTopic;
+		self.state(payload,shortStateTopic);
 		payload["command_topic"]=self.topicRoot+'/'+shortCommandTopic;
-		payload["availability_topic"]=self.availabilityTopic;
-		payload["payload_available"]=self.payload_available;
-		payload["payload_not_available"]=self.payload_not_available;
+		self.availability(payload);
 		payload["qos"]=2;
 		payload["options"]=options;
 		
@@ -111,15 +132,31 @@ class Hassio:
 		payload["object_id"]=object_id;
 		payload["unique_id"]=self.clientId+'.'+object_id;
 		if (shortStateTopic is not None):
-			payload["state_topic"]=self.topicRoot+'/'+shortStateTopic;
+			self.state(payload,shortStateTopic);
 		payload["command_topic"]=self.topicRoot+'/'+shortCommandTopic;
-		payload["availability_topic"]=self.availabilityTopic;
-		payload["payload_available"]=self.payload_available;
-		payload["payload_not_available"]=self.payload_not_available;
+		self.availability(payload);
 		payload["payload_off"]=payload_off;
 		payload["payload_on"]=payload_on;		
 		payload["qos"]=2;
 
 		#send discovery message
-		self.mqtt.publish(discoveryTopic,json.dumps(payload),1,False);		
+		self.mqtt.publish(discoveryTopic,json.dumps(payload),1,False);
 
+	#entity of a schema attribute, its state topic is the attribute topic and its command topic the attribute topic followed by /set
+	#number limits and select options are the ones of the attribute
+	def addEntity(self,entity,attribute):
+		shortStateTopic=entity.state if (entity.state is not None) else attribute.topic;
+		shortCommandTopic=attribute.topic+'/set';
+		if (entity.component=='sensor'):
+			self.addSensor(entity.objectId,entity.name,entity.deviceClass,shortStateTopic,entity.template,entity.unit);
+		elif (entity.component=='binary_sensor'):
+			self.addBinarySensor(entity.objectId,entity.name,entity.deviceClass,shortStateTopic,entity.payloads[1],entity.payloads[0]);
+		elif (entity.component=='number'):
+			min,max,step=attribute.limits;
+			self.addNumber(entity.objectId,entity.name,shortStateTopic,shortCommandTopic,min,max,step,entity.unit);
+		elif (entity.component=='select'):
+			self.addSelect(entity.objectId,entity.name,shortStateTopic,shortCommandTopic,list(attribute.enum.values()));
+		elif (entity.component=='switch'):
+			self.addSwitch(entity.objectId,entity.name,shortStateTopic,shortCommandTopic,entity.payloads[0],entity.payloads[1]);
+		else:
+			self.logger.warning('Unknown entity component: '+entity.component);